@@ -1,4 +1,10 @@
-from .main import generate_index
-
-# Making the function accessible directly from the package
+# Making the function accessible directly from the package. It is imported on first use, so
+# the search server can read index files through this package without the HTML and NLP stack
 __all__ = ['generate_index']
+
+
+def __getattr__(name):
+    if name == 'generate_index':
+        from .main import generate_index
+        return generate_index
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,86 @@
+import os
+import pickle
+from contextlib import contextmanager
+
+CHECKPOINT_NAME = 'checkpoint.pkl'
+# Increased when the checkpoint contents change, older checkpoints can't be resumed
+CHECKPOINT_VERSION = 5
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb'):
+    """
+    Open a file to write it under a temporary name, renamed to its path once it is complete and
+    flushed to disk. A crash leaves either the previous file or the new one, never a truncated file,
+    and an exception while writing removes the temporary file.
+    Args:
+        path: Path of the file
+        mode: 'wb' for a binary file, 'w' for a text file
+    Yields:
+        The file object to write to
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        # A failed write leaves the previous file, and no partial temporary file
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def write_checkpoint(index_dir: str, checkpoint: dict):
+    """
+    Save the progress of an index build, atomically replacing the previous checkpoint.
+    Args:
+        index_dir: Directory of the index being built
+        checkpoint: Dictionary of the build state, see InvertedIndex.save_checkpoint
+    """
+    with atomic_write(os.path.join(index_dir, CHECKPOINT_NAME)) as f:
+        pickle.dump(dict(checkpoint, version=CHECKPOINT_VERSION), f)
+
+
+def read_checkpoint(index_dir: str, corpus_signature: list, options: dict):
+    """
+    Load the checkpoint of an interrupted build, checking it was made by the same build.
+    Args:
+        index_dir: Directory of the index being built
+        corpus_signature: Signature of the sources of the build, see CorpusSource.signature
+        options: Dictionary of the build options, which must be those of the checkpoint
+    Returns:
+        dict: The checkpoint, or None if there is none
+    Raises:
+        ValueError: If the checkpoint was made from another corpus, with other options, or lost partial indexes
+    """
+    path = os.path.join(index_dir, CHECKPOINT_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        checkpoint = pickle.load(f)
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} was written by another version of the indexer, start the build over")
+    if checkpoint['corpus'] != corpus_signature:
+        sources = [source['path'] for source in checkpoint['corpus']]
+        raise ValueError(f"{path} is the checkpoint of {sources} as they were then, not of this corpus")
+    if checkpoint['options'] != options:
+        raise ValueError(f"{path} was made with the options {checkpoint['options']}, not {options}")
+    for partial in checkpoint['partials']:
+        for file_name, size in partial['files'].items():
+            if os.path.exists(file_name) and os.path.getsize(file_name) == size:
+                continue
+            # The partial indexes of shards already merged are removed
+            if checkpoint['stage'] == 'merging' and partial['shard'] in checkpoint['index_manager']['merged_shards']:
+                continue
+            raise ValueError(f"Partial index {file_name} of the checkpoint is missing or changed")
+    return checkpoint
+
+
+def remove_checkpoint(index_dir: str):
+    """Remove the checkpoint of a finished build"""
+    path = os.path.join(index_dir, CHECKPOINT_NAME)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,192 @@
+import glob
+import json
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from contextlib import contextmanager
+from .zip_handler import ZipHandler
+
+# Extensions of the JSON-lines files holding the crawled pages, in ZIPs and directories
+JSON_EXTENSIONS = ('.json', '.jsonl')
+# Name of the file mapping the document ID ranges of an index to the sources they were read from
+SOURCES_NAME = 'sources.json'
+
+
+def expand_sources(paths) -> list:
+    """
+    Expand the paths of a corpus to the ZIPs and directories it is made of.
+    Args:
+        paths: Path, or list of paths, to ZIPs, directories of JSON-lines files, or glob patterns of them
+    Returns:
+        list: Absolute paths of the sources, in the order given, the matches of a glob sorted
+    Raises:
+        FileNotFoundError: If a path or pattern matches nothing
+        zipfile.BadZipFile: If a file is not a valid ZIP
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    sources = []
+    for path in paths:
+        matches = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+        if not matches or not all(os.path.exists(match) for match in matches):
+            raise FileNotFoundError(f"No corpus source found at {path}")
+        for match in matches:
+            if not os.path.isdir(match):
+                ZipHandler.check_zip_file(match)
+            sources.append(os.path.abspath(match))
+    return sources
+
+
+def list_members(source: str) -> list:
+    """
+    List the JSON-lines files of a source.
+    Args:
+        source: Path to a ZIP or a directory
+    Returns:
+        list: Names of the files, in ZIP order or sorted relative paths for a directory
+    """
+    if not os.path.isdir(source):
+        with zipfile.ZipFile(source, 'r') as zipfolder:
+            return [name for name in zipfolder.namelist() if name.endswith(JSON_EXTENSIONS)]
+    members = []
+    for root, _, files in os.walk(source):
+        for file_name in files:
+            if file_name.endswith(JSON_EXTENSIONS):
+                members.append(os.path.relpath(os.path.join(root, file_name), source))
+    return sorted(members)
+
+
+@contextmanager
+def open_member(source: str, member: str):
+    """
+    Open a JSON-lines file of a source for binary reading.
+    Args:
+        source: Path to a ZIP or a directory
+        member: Name of the file in the source
+    Yields:
+        Binary file object
+    """
+    if os.path.isdir(source):
+        with open(os.path.join(source, member), 'rb') as f:
+            yield f
+    else:
+        with zipfile.ZipFile(source, 'r') as zipfolder, zipfolder.open(member) as f:
+            yield f
+
+
+# ZIPs opened by the reader processes, so their central directories are read once per process.
+# Keyed by process ID too: a forked process shares the file offsets of the ZIPs its parent opened.
+_open_zips = {}
+
+
+def read_member(source: str, member: str) -> list:
+    """
+    Read the pages of a JSON-lines file of a source, in a reader process or in the main one.
+    Args:
+        source: Path to a ZIP or a directory
+        member: Name of the file in the source
+    Returns:
+        list: (URL, content) tuple of each page
+    """
+    if os.path.isdir(source):
+        with open(os.path.join(source, member), 'rb') as f:
+            return list(ZipHandler.parse_json_lines(f, member))
+    key = (os.getpid(), source)
+    if key not in _open_zips:
+        _open_zips[key] = zipfile.ZipFile(source, 'r')
+    return list(ZipHandler.parse_json_file(_open_zips[key], member))
+
+
+def _read_member_task(task):
+    """Pool task reading one member, see read_member"""
+    return read_member(*task)
+
+
+class CorpusSource:
+    """
+    The JSON-lines files of a corpus spread over any number of ZIPs and directories, read in order
+    by a pool of reader processes. Decompressing and decoding run in parallel, while the pages
+    still come out in a fixed order, so a build always assigns the same document IDs.
+    """
+    def __init__(self, paths, readers: int = None, read_ahead: int = 64):
+        """
+        List the files of the corpus.
+        Args:
+            paths: Path, or list of paths, to ZIPs, directories or glob patterns of them
+            readers: Number of reader processes, defaults to the number of CPUs up to 4.
+                With 1, files are read by the calling process.
+            read_ahead: Number of files read ahead of the one being consumed, bounding memory use
+        """
+        self.sources = expand_sources(paths)
+        # (source index, member name) of every file, in reading order
+        self.members = [(i, member) for i, source in enumerate(self.sources) for member in list_members(source)]
+        self.readers = readers if readers is not None else min(4, os.cpu_count() or 1)
+        self.read_ahead = read_ahead
+        self.pool = None
+
+    def signature(self) -> list:
+        """Identify the sources as they are now, so a checkpoint is only resumed on the same corpus"""
+        signature = []
+        for i, source in enumerate(self.sources):
+            if os.path.isdir(source):
+                signature.append({'path': source, 'files': sum(1 for member in self.members if member[0] == i)})
+            else:
+                signature.append({'path': source, 'size': os.path.getsize(source),
+                                  'mtime': os.path.getmtime(source)})
+        return signature
+
+    def read(self, start: int = 0):
+        """
+        Read the files of the corpus from one of them on.
+        Args:
+            start: Index in members of the first file to read
+        Yields:
+            (member index, list of (URL, content) tuples) of each file, in order
+        """
+        if self.readers <= 1:
+            for index in range(start, len(self.members)):
+                source_index, member = self.members[index]
+                yield index, read_member(self.sources[source_index], member)
+            return
+
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(processes=self.readers)
+        pending = deque()
+        next_index = start
+        while pending or next_index < len(self.members):
+            # Keep the readers busy, without reading the whole corpus into memory
+            while next_index < len(self.members) and len(pending) < self.read_ahead:
+                source_index, member = self.members[next_index]
+                pending.append((next_index, self.pool.apply_async(_read_member_task,
+                                                                  ((self.sources[source_index], member),))))
+                next_index += 1
+            index, result = pending.popleft()
+            yield index, result.get()
+
+    def close(self):
+        """Stop the reader processes, and close the ZIPs read by this process"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for source in self.sources:
+            zipfolder = _open_zips.pop((os.getpid(), source), None)
+            if zipfolder is not None:
+                zipfolder.close()
+
+
+def load_sources(index_dir: str):
+    """
+    Load the sources of the documents of an index.
+    Args:
+        index_dir: Directory of the index
+    Returns:
+        list: (first document ID, end document ID, source path) of each source, or None for
+            indexes written without sources.json
+    """
+    path = os.path.join(index_dir, SOURCES_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return [tuple(source) for source in json.load(f)]
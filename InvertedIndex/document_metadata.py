@@ -0,0 +1,211 @@
+import mmap
+import os
+import struct
+from array import array
+from .checkpoint import atomic_write
+
+METADATA_NAME = 'docmeta.bin'
+MAGIC = b'DOCM'
+VERSION = 1
+# Strings are front-coded in blocks, a lookup decodes at most one block
+BLOCK_SIZE = 16
+# Magic, version, first document ID, ID stride, number of rows, number of documents, then the
+# offsets of the length, norm and static score columns and of the URL and file string columns
+HEADER = struct.Struct('<4sIQIIIQQQQQ')
+
+
+def _write_varint(out: bytearray, value: int):
+    """Append an unsigned integer 7 bits at a time, the high bit set on every byte but the last"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position: int):
+    """Read an unsigned integer written by _write_varint, returning it and the position after it"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def _front_code(strings) -> bytes:
+    """
+    Encode strings in blocks of BLOCK_SIZE: the first string of a block is stored whole,
+    the others as the length of the prefix they share with the previous one and the rest.
+    Returns:
+        bytes: The offset of each block, as an array of unsigned ints, followed by the blocks
+    """
+    blocks = bytearray()
+    block_offsets = array('I')
+    previous = b''
+    for i, string in enumerate(strings):
+        encoded = string.encode('utf-8')
+        if i % BLOCK_SIZE == 0:
+            block_offsets.append(len(blocks))
+            shared = 0
+        else:
+            shared = 0
+            for a, b in zip(previous, encoded):
+                if a != b:
+                    break
+                shared += 1
+            _write_varint(blocks, shared)
+        _write_varint(blocks, len(encoded) - shared)
+        blocks += encoded[shared:]
+        previous = encoded
+    block_offsets.append(len(blocks))
+    return struct.pack('<I', len(block_offsets)) + block_offsets.tobytes() + bytes(blocks)
+
+
+def _pad(out: bytearray):
+    """Align the end of the file to 4 bytes, so the next column can be read as an array"""
+    out += b'\0' * (-len(out) % 4)
+
+
+def write_document_metadata(directory: str, documents: dict, first_doc_id: int = None, stride: int = 1):
+    """
+    Write the columnar metadata file of the documents of an index, one row per document ID.
+    Args:
+        directory: Directory of the index, docmeta.bin is written to it
+        documents: Dictionary mapping document IDs to (URL, file name, length in tokens,
+            norm of the term frequency vector, static score) tuples
+        first_doc_id: First document ID of the rows, defaults to the smallest document ID
+        stride: Difference between the IDs of consecutive rows, the number of shards of a sharded index
+    """
+    if first_doc_id is None:
+        first_doc_id = min(documents) if documents else 0
+    num_rows = (max(documents) - first_doc_id) // stride + 1 if documents else 0
+    # Rows of IDs without a document, such as documents dropped by a merge, keep empty values
+    rows = [documents.get(first_doc_id + row * stride, ('', '', 0, 0.0, 0.0)) for row in range(num_rows)]
+
+    out = bytearray(HEADER.size)
+    offsets = []
+    for column, typecode in ((2, 'I'), (3, 'f'), (4, 'f')):
+        offsets.append(len(out))
+        out += array(typecode, (row[column] for row in rows)).tobytes()
+    for column in (0, 1):
+        offsets.append(len(out))
+        out += _front_code(row[column] for row in rows)
+        _pad(out)
+    HEADER.pack_into(out, 0, MAGIC, VERSION, first_doc_id, stride, num_rows, len(documents), *offsets)
+
+    with atomic_write(os.path.join(directory, METADATA_NAME)) as f:
+        f.write(out)
+
+
+class DocumentMetadata:
+    """
+    Reads the docmeta.bin file of an index through mmap. Every lookup is an array read, or the
+    decoding of one block of front-coded strings, so opening the file is instant and its pages
+    are shared by the processes serving the same index.
+    """
+    def __init__(self, path: str):
+        """
+        Map a document metadata file.
+        Args:
+            path: Path to docmeta.bin
+        """
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, _, self.first_doc_id, self.stride, self.num_rows, self.num_documents,
+         lengths_start, norms_start, static_start, urls_start, files_start) = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a document metadata file")
+        view = memoryview(self.data)
+        self.lengths = view[lengths_start:lengths_start + 4 * self.num_rows].cast('I')
+        self.norms = view[norms_start:norms_start + 4 * self.num_rows].cast('f')
+        self.static_scores = view[static_start:static_start + 4 * self.num_rows].cast('f')
+        self.urls = self._open_strings(view, urls_start)
+        self.files = self._open_strings(view, files_start)
+
+    @classmethod
+    def open(cls, directory: str):
+        """
+        Open the document metadata of an index if it has it.
+        Args:
+            directory: Directory of the index
+        Returns:
+            DocumentMetadata, or None if the index has no metadata file
+        """
+        path = os.path.join(directory, METADATA_NAME)
+        return cls(path) if os.path.exists(path) else None
+
+    def _open_strings(self, view, start: int):
+        """Get the block offsets and the start of the blocks of a front-coded column"""
+        num_offsets = struct.unpack_from('<I', self.data, start)[0]
+        block_offsets = view[start + 4:start + 4 + 4 * num_offsets].cast('I')
+        return block_offsets, start + 4 + 4 * num_offsets
+
+    def row(self, doc_id: int):
+        """Get the row of a document ID, or None if it isn't in this file"""
+        offset = doc_id - self.first_doc_id
+        if offset < 0 or offset % self.stride:
+            return None
+        row = offset // self.stride
+        return row if row < self.num_rows else None
+
+    def _string(self, column, row: int) -> str:
+        """Decode the string of a row from a front-coded column"""
+        block_offsets, blocks_start = column
+        block_number, index = divmod(row, BLOCK_SIZE)
+        # Copy the block once, indexing bytes is faster than indexing the mmap
+        block = self.data[blocks_start + block_offsets[block_number]:blocks_start + block_offsets[block_number + 1]]
+        length, position = _read_varint(block, 0)
+        string = block[position:position + length]
+        position += length
+        for _ in range(index):
+            shared, position = _read_varint(block, position)
+            length, position = _read_varint(block, position)
+            string = string[:shared] + block[position:position + length]
+            position += length
+        return string.decode('utf-8')
+
+    def get_url(self, doc_id: int):
+        """Get the URL of a document, or None for unknown documents"""
+        row = self.row(doc_id)
+        return (self._string(self.urls, row) or None) if row is not None else None
+
+    def get_file(self, doc_id: int):
+        """Get the name of the ZIP member a document was read from, or None for unknown documents"""
+        row = self.row(doc_id)
+        return (self._string(self.files, row) or None) if row is not None else None
+
+    def get_length(self, doc_id: int) -> int:
+        """Get the number of tokens of a document, 0 for unknown documents"""
+        row = self.row(doc_id)
+        return self.lengths[row] if row is not None else 0
+
+    def get_norm(self, doc_id: int) -> float:
+        """Get the norm of the term frequency vector of a document, 0 for unknown documents"""
+        row = self.row(doc_id)
+        return self.norms[row] if row is not None else 0.0
+
+    def get_static_score(self, doc_id: int) -> float:
+        """Get the query-independent quality score of a document, 0 for unknown documents"""
+        row = self.row(doc_id)
+        return self.static_scores[row] if row is not None else 0.0
+
+    def documents(self):
+        """
+        Iterate over the documents of the file.
+        Returns:
+            Iterator of (document ID, URL, file name, length, norm, static score) tuples
+        """
+        for row in range(self.num_rows):
+            url = self._string(self.urls, row)
+            if url:
+                yield (self.first_doc_id + row * self.stride, url, self._string(self.files, row),
+                       self.lengths[row], self.norms[row], self.static_scores[row])
+
+    def close(self):
+        """Unmap the metadata file"""
+        for view in (self.lengths, self.norms, self.static_scores, self.urls[0], self.files[0]):
+            view.release()
+        self.data.close()
@@ -0,0 +1,147 @@
+import hashlib
+import re
+from array import array
+from simhash import Simhash
+
+# Number of slots of an empty DigestSet, a power of two
+INITIAL_SLOTS = 1024
+# HTML tags, comments and script and style elements, which aren't part of the text of a page
+MARKUP_PATTERN = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>', re.DOTALL | re.IGNORECASE)
+
+
+def content_digest(content: str) -> int:
+    """
+    Hash the text of a page, ignoring markup, case and whitespace, to find exact duplicates.
+    The tags are stripped with a regular expression, much faster than parsing the page.
+    Args:
+        content: HTML content of the page
+    Returns:
+        int: Nonzero 64-bit digest
+    """
+    normalized = ' '.join(MARKUP_PATTERN.sub(' ', content).split()).lower()
+    digest = hashlib.blake2b(normalized.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    # 0 marks the empty slots of a DigestSet
+    return int.from_bytes(digest, 'little') or 1
+
+
+def document_fingerprint(tokens: list) -> int:
+    """
+    Compute the simhash fingerprint of a page from its tokens, to find near duplicates.
+    The features are the shingles of 3 consecutive tokens: pages sharing most of their vocabulary
+    but not their text, whose token counts give close fingerprints, stay apart.
+    Args:
+        tokens: Stemmed tokens of the text of the page, in order
+    Returns:
+        int: 64-bit fingerprint
+    """
+    return Simhash({' '.join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))}).value
+
+
+class DigestSet:
+    """
+    Set of the 64-bit content digests of the pages kept so far. The digests are stored in an
+    open-addressing hash table backed by an array, 8 bytes per slot instead of the 100 or so
+    bytes of an int in a Python set.
+    """
+    def __init__(self, digests=()):
+        """
+        Initialize the set.
+        Args:
+            digests: Optional iterable of nonzero digests to add
+        """
+        self.slots = array('Q', bytes(8 * INITIAL_SLOTS))
+        self.size = 0
+        for digest in digests:
+            self.add(digest)
+
+    def _find(self, digest: int) -> int:
+        """Get the slot holding a digest, or the empty slot it would be added to"""
+        mask = len(self.slots) - 1
+        # The digests are uniformly distributed, their low bits are a good slot number
+        slot = digest & mask
+        while True:
+            value = self.slots[slot]
+            if value == digest or value == 0:
+                return slot
+            slot = (slot + 1) & mask
+
+    def __contains__(self, digest: int) -> bool:
+        return self.slots[self._find(digest)] == digest
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return (digest for digest in self.slots if digest)
+
+    def add(self, digest: int) -> bool:
+        """
+        Add a digest to the set.
+        Args:
+            digest: Nonzero digest, see content_digest
+        Returns:
+            bool: Whether the digest was added, False if it was already in the set
+        """
+        slot = self._find(digest)
+        if self.slots[slot] == digest:
+            return False
+        self.slots[slot] = digest
+        self.size += 1
+        # Keep the table at most 2/3 full, so probes stay short
+        if self.size * 3 > len(self.slots) * 2:
+            self._grow()
+        return True
+
+    def _grow(self):
+        """Double the number of slots"""
+        old_slots = self.slots
+        self.slots = array('Q', bytes(16 * len(old_slots)))
+        for digest in old_slots:
+            if digest:
+                self.slots[self._find(digest)] = digest
+
+
+class FingerprintIndex:
+    """
+    The simhash fingerprints of the pages kept so far, finding those within a Hamming distance of
+    a new fingerprint without comparing it to all of them. The 64 bits are split into threshold + 1
+    blocks: two fingerprints at most threshold bits apart are identical on at least one block, so
+    only the fingerprints sharing a block with the new one are compared.
+    """
+    def __init__(self, threshold: int, fingerprints=()):
+        """
+        Initialize the index.
+        Args:
+            threshold: Maximum number of differing bits of near duplicates
+            fingerprints: Optional iterable of 64-bit fingerprints to add
+        """
+        self.threshold = threshold
+        self.fingerprints = array('Q')
+        num_blocks = threshold + 1
+        bounds = [64 * i // num_blocks for i in range(num_blocks + 1)]
+        # (shift, mask) of each block
+        self.blocks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        # Fingerprints by the value of each of their blocks
+        self.tables = [{} for _ in self.blocks]
+        for fingerprint in fingerprints:
+            self.add(fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def __iter__(self):
+        return iter(self.fingerprints)
+
+    def near_duplicate(self, fingerprint: int) -> bool:
+        """Check if a fingerprint is at most threshold bits away from one of the index"""
+        for (shift, mask), table in zip(self.blocks, self.tables):
+            for candidate in table.get((fingerprint >> shift) & mask, ()):
+                if bin(candidate ^ fingerprint).count('1') <= self.threshold:
+                    return True
+        return False
+
+    def add(self, fingerprint: int):
+        """Add a fingerprint to the index"""
+        self.fingerprints.append(fingerprint)
+        for (shift, mask), table in zip(self.blocks, self.tables):
+            table.setdefault((fingerprint >> shift) & mask, []).append(fingerprint)
@@ -0,0 +1,56 @@
+import re
+
+# Bit of each field in the field flags of a posting
+FIELDS = {'title': 1, 'h1': 2, 'h2': 4, 'h3': 8, 'bold': 16}
+# Field of each HTML tag whose text is weighted
+TAG_FIELDS = {'title': 'title', 'h1': 'h1', 'h2': 'h2', 'h3': 'h3', 'b': 'bold', 'strong': 'bold'}
+# Weight of each field at query time, in occurrences of the term in the body text
+DEFAULT_FIELD_WEIGHTS = {'title': 5, 'h1': 4, 'h2': 3, 'h3': 2, 'bold': 1.5}
+
+
+def tag_fields(soup) -> dict:
+    """
+    Find the tokens of the weighted tags (ie: title, h1, h2, h3, b, strong) of a page.
+    Args:
+        soup: BeautifulSoup object
+
+    Returns:
+        Dictionary mapping each lowercase token to the field flags of the tags it appears in
+    """
+    flags = {}
+    for tag in soup.find_all(list(TAG_FIELDS)):
+        bit = FIELDS[TAG_FIELDS[tag.name]]
+        for token in re.findall(r'[A-Za-z0-9]+', tag.get_text(separator=' ').lower()):
+            flags[token] = flags.get(token, 0) | bit
+    return flags
+
+
+def field_boost(flags: int, weights: dict) -> float:
+    """
+    Get the occurrences a term is worth for appearing in fields.
+    Args:
+        flags: Field flags of a posting
+        weights: Weight of each field, see DEFAULT_FIELD_WEIGHTS
+    Returns:
+        float: Sum of the weights of the fields in flags
+    """
+    return sum(weights.get(field, 0) for field, bit in FIELDS.items() if flags & bit)
+
+
+def parse_field_weights(spec: str) -> dict:
+    """
+    Parse field weights written as comma separated field=weight pairs, such as "title=8,bold=1".
+    Fields left out keep their default weight.
+    Args:
+        spec: Field weights
+    Returns:
+        dict: Weight of every field
+    """
+    weights = dict(DEFAULT_FIELD_WEIGHTS)
+    for pair in filter(None, (pair.strip() for pair in spec.split(','))):
+        field, _, weight = pair.partition('=')
+        field = field.strip()
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field {field!r}, expected one of {', '.join(FIELDS)}")
+        weights[field] = float(weight)
+    return weights
@@ -1,24 +1,83 @@
-import zipfile
+from array import array
 from tqdm import tqdm
-from .zip_handler import ZipHandler
+from .corpus import CorpusSource
+from .duplicates import DigestSet, FingerprintIndex, content_digest
 from .index_manager import IndexManager
+from .report import NULL_PROFILER
 from urllib.parse import urldefrag
-from simhash import Simhash
 
 
 class FileOpener:
-    def __init__(self, zipPath: str, simhash_threshold: int = 5):
-        """Initialize file opener with zip path"""
+    def __init__(self, zipPath, simhash_threshold: int = 5, index_manager: IndexManager = None,
+                 profiler=None, readers: int = None, exact_duplicates: bool = True):
+        """
+        Initialize file opener with the corpus path, or list of paths to ZIPs, directories and glob
+        patterns, and the index manager partial indexes are delegated to, and optionally the
+        IndexingProfiler timing the reads and duplicate checks, the number of reader processes and
+        whether to drop pages whose text is the same as a page already read
+        """
         self.zipPath = zipPath
+        self.corpus = CorpusSource(zipPath, readers)
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
         self.seenUrls = set()
-        self.simhashes = set()
         self.simhash_threshold = simhash_threshold
-        self.index_manager = IndexManager()
+        # Simhash fingerprints of the documents kept, computed by the tokenizing workers
+        self.simhashes = FingerprintIndex(simhash_threshold)
+        # Digests of the text of the documents kept, None when exact duplicates are kept
+        self.content_digests = DigestSet() if exact_duplicates else None
+        # Number of documents dropped for a URL already read, the same text or a near-duplicate simhash
+        self.duplicates = {'url': 0, 'exact': 0, 'near': 0}
+        self.index_manager = index_manager if index_manager is not None else IndexManager()
+        # Position of the next document to read: the index of its JSON file, and of the document in the file
+        self.file_index = 0
+        self.entry_index = 0
+        self.files_read = 0
+        # Number of documents kept from each source, which get consecutive document IDs
+        self.source_counts = [0] * len(self.corpus.sources)
+        # Files read ahead by the corpus readers, and the (index, pages) of the file being consumed
+        self.reader = None
+        self.current_file = None
+        # Source index of each document of the last batch read
+        self.batch_sources = {}
 
         # Initialize progress tracking
-        with zipfile.ZipFile(self.zipPath, 'r') as zipfolder:
-            self.total_files = len([f for f in zipfolder.namelist() if f.endswith('.json')])
-            self.pbar = tqdm(total = self.total_files, desc = "Processing files")
+        self.total_files = len(self.corpus.members)
+        self.pbar = tqdm(total = self.total_files, desc = "Processing files")
+
+    def state(self) -> dict:
+        """
+        Get what a resumed build needs to continue reading where this one stopped, for a checkpoint.
+        Returns:
+            dict: The corpus cursor, the URLs read so far, the content digests and simhashes of the
+                documents read and the duplicate counts
+        """
+        return {
+            'file_index': self.file_index,
+            'entry_index': self.entry_index,
+            'files_read': self.files_read,
+            'source_counts': self.source_counts,
+            'seen_urls': self.seenUrls,
+            'simhashes': array('Q', self.simhashes),
+            'content_digests': array('Q', self.content_digests) if self.content_digests is not None else None,
+            'duplicates': self.duplicates,
+        }
+
+    def restore(self, state: dict):
+        """
+        Continue reading from the state saved by state().
+        Args:
+            state: Dictionary returned by state()
+        """
+        self.file_index = state['file_index']
+        self.entry_index = state['entry_index']
+        self.files_read = state['files_read']
+        self.source_counts = state['source_counts']
+        self.seenUrls = state['seen_urls']
+        self.simhashes = FingerprintIndex(self.simhash_threshold, state['simhashes'])
+        if state['content_digests'] is not None:
+            self.content_digests = DigestSet(state['content_digests'])
+        self.duplicates = state['duplicates']
+        self.pbar.update(self.files_read)
 
     def normalize_url(self, url):
         """
@@ -27,69 +86,111 @@ class FileOpener:
         # so we dont get the #content type of website
         return urldefrag(url)[0]
 
-    # https://usavps.com/blog/48168/
-
-    def compute_simhash(self, text):
+    def drop_near_duplicates(self, fingerprints: dict) -> list:
         """
-        Gets tokens and converts it into binary
+        Check the simhash fingerprints of the last batch read, computed by the tokenizing workers,
+        against those of the documents kept so far, in reading order.
+        Args:
+            fingerprints: Dictionary mapping the (URL, file name) of each document of the batch to its fingerprint
+        Returns:
+            list: (URL, file name) of the near duplicates, to drop from the batch
         """
-        tokens = text.split()
-        return Simhash(tokens)
-
-    def near_duplicate(self, simhash_val):
-        """
-        Checks if the simhash values are similar
-        """
-        if not simhash_val:
-            return False
-        for hashVal in self.simhashes:
-            if hashVal.distance(simhash_val) <= self.simhash_threshold:
-                return True
-        return False
+        dropped = []
+        for doc, fingerprint in fingerprints.items():
+            if self.simhashes.near_duplicate(fingerprint):
+                dropped.append(doc)
+                # The document was counted as kept and read by read_zip
+                self.seenUrls.discard(doc[0])
+                self.source_counts[self.batch_sources[doc]] -= 1
+                self.files_read -= 1
+                self.pbar.update(-1)
+                self.duplicates['near'] += 1
+            else:
+                self.simhashes.add(fingerprint)
+        return dropped
 
     def read_zip(self, count: int = None) -> dict:
         """
-        Read files from the ZIP and return a dict mapping a tuple (urls, file_name) to content
-        param count: The number of files to read from the ZIP. If None, read all files.
+        Read files from the corpus and return a dict mapping a tuple (urls, file_name) to content.
+        Each call continues after the last document read by the previous one.
+        param count: The number of files to read from the corpus. If None, read all files.
         return: A dictionary mapping URLs to their content.
         """
-        ZipHandler.check_zip_file(self.zipPath)
         url_to_content = {}
         files_processed = 0
-
-        with zipfile.ZipFile(self.zipPath, 'r') as zipfolder:
-            json_files = ZipHandler.get_json_file_list(self.zipPath)
-
-            for file_name in json_files:
-                if count is not None and files_processed >= count:
-                    break
-
-                for url, content in ZipHandler.parse_json_file(zipfolder, file_name):
+        self.batch_sources = {}
+
+        with self.profiler.stage('zip_read'):
+            if self.reader is None:
+                self.reader = self.corpus.read(self.file_index)
+            while self.file_index < self.total_files:
+                if self.current_file is None:
+                    self.current_file = next(self.reader)
+                _, pages = self.current_file
+                source_index, file_name = self.corpus.members[self.file_index]
+                for entry_index in range(self.entry_index, len(pages)):
                     if count is not None and files_processed >= count:
-                        break
+                        return url_to_content
+                    url, content = pages[entry_index]
+                    self.entry_index = entry_index + 1
+                    self.profiler.count('zip_read', 1, len(content))
                     normalized_url = self.normalize_url(url)
-                    if self.simhash_threshold > 0:
-                        content_hash = self.compute_simhash(content)
-                    else:
-                        content_hash = None
-
-                    if normalized_url not in self.seenUrls and not self.near_duplicate(
-                            content_hash):
-                        self.seenUrls.add(normalized_url)
-                        url_to_content[(normalized_url, file_name)] = content
-                        files_processed += 1
-                        self.pbar.update(1)
+                    if normalized_url in self.seenUrls:
+                        self.duplicates['url'] += 1
+                        continue
+                    # Near duplicates are found once the tokenizing workers computed the simhashes
+                    digest = None
+                    if self.content_digests is not None:
+                        with self.profiler.stage('dedup'):
+                            digest = content_digest(content)
+                            self.profiler.count('dedup', 1, len(content))
+                        if digest in self.content_digests:
+                            self.duplicates['exact'] += 1
+                            continue
+                    self.seenUrls.add(normalized_url)
+                    if digest is not None:
+                        self.content_digests.add(digest)
+                    url_to_content[(normalized_url, file_name)] = content
+                    self.batch_sources[(normalized_url, file_name)] = source_index
+                    files_processed += 1
+                    self.files_read += 1
+                    self.source_counts[source_index] += 1
+                    self.pbar.update(1)
+                self.current_file = None
+                self.file_index += 1
+                self.entry_index = 0
 
         return url_to_content
 
-    def save_partial_index(self, batch_tfs, partial_index_count):
+    def source_ranges(self, start_doc_id: int = 0) -> list:
+        """
+        Get the document ID range of each source of the documents read.
+        Args:
+            start_doc_id: ID of the first document
+        Returns:
+            list: [first document ID, end document ID, source path] of each source documents were kept from
+        """
+        ranges = []
+        doc_id = start_doc_id
+        for source, count in zip(self.corpus.sources, self.source_counts):
+            if count:
+                ranges.append([doc_id, doc_id + count, source])
+                doc_id += count
+        return ranges
+
+    def save_partial_index(self, batch_tfs, partial_index_count, batch_positions=None, batch_snippets=None,
+                           batch_lengths=None, batch_links=None):
         """Delegate to index manager to save partial index"""
-        return self.index_manager.create_and_save_partial_index(batch_tfs, partial_index_count)
+        return self.index_manager.create_and_save_partial_index(batch_tfs, partial_index_count,
+                                                                batch_positions, batch_snippets,
+                                                                batch_lengths, batch_links)
 
-    def merge_partial_indexes(self, partial_index_count: int):
+    def merge_partial_indexes(self, partial_index_count: int, on_shard_merged=None):
         """Delegate to index manager to merge partial indexes"""
-        return self.index_manager.merge_partial_indexes(partial_index_count)
+        self.index_manager.sources = self.source_ranges(self.index_manager.start_id)
+        return self.index_manager.merge_partial_indexes(partial_index_count, on_shard_merged)
 
     def close(self):
-        """Close the progress bar when done processing all files"""
+        """Close the progress bar and stop the readers when done processing all files"""
         self.pbar.close()
+        self.corpus.close()
@@ -1,53 +1,68 @@
+from .checkpoint import read_checkpoint, write_checkpoint
+from .duplicates import document_fingerprint
+from .fields import tag_fields
+from .links import extract_links, url_digest
 from .file import FileOpener
+from .index_manager import IndexManager
+from .positions import encode_positions
+from .snippets import encode_snippet_record
+from .terms import TermDictionary
+from .report import NULL_PROFILER, clock, peak_rss
+from .suggest import load_term_frequencies
 from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning, XMLParsedAsHTMLWarning
 import warnings
 import re
 from nltk.stem import PorterStemmer
-from collections import Counter
-import json
-import ijson
+from array import array
+from collections import Counter, defaultdict
+import os
+import pickle
 import multiprocessing
 from functools import partial
 import tqdm
 
 # how to find the tf-idf https://www.learndatasci.com/glossary/tf-idf-term-frequency-inverse-document-frequency/
 
-def weighted_tags(soup) -> list:
-    """
-    Process tokens if they have tags (ie: h1, h2, h3, b, strong)
-    Args:
-        soup: BeautifulSoup object
-
-    Returns:
-        List of tokens that are duplicated based on weights given
-    """
-
-    tag_weights = {'title':5, 'h1': 4, 'h2': 3, 'h3': 2, 'b': 1.5, 'strong': 1.5}
-    weighted_tokens = []
-    
-    # Process all tags in one pass
-    for tag in soup.find_all(list(tag_weights.keys())):
-        weight = tag_weights.get(tag.name, 1)
-        tokens = re.findall(r'\b[A-Za-z0-9]+\b', tag.get_text().lower())
-        weighted_tokens.extend([token for token in tokens for _ in range(int(weight))])
-    
-    return weighted_tokens
-
 # Worker function for multiprocessing
-def tokenize_chunk(chunk, stemmer):
+def tokenize_chunk(chunk, stemmer, store_positions=False, store_snippets=False, timings=None, fingerprints=None,
+                   fields=None, links=None):
     """
     Process a chunk of documents in a separate process
     
     Args:
         chunk: Dictionary of document name to document text
         stemmer: PorterStemmer instance
+        store_positions: Whether to also return the positions of each token in the text
+        store_snippets: Whether to also return the encoded snippet record of each document
+        timings: Optional dictionary the wall and CPU time, documents and bytes of HTML parsing
+            and tokenizing are added to, as (wall seconds, CPU seconds, documents, bytes) tuples
+        fingerprints: Optional dictionary the simhash fingerprint of each document is added to
+        fields: Optional dictionary the field flags of the terms of each document found in weighted
+            tags are added to, as dictionaries mapping terms to flags (see fields.py)
+        links: Optional dictionary the URLs each document links to are added to, resolved against
+            the URL of the document, the first item of its name
         
     Returns:
-        Dictionary mapping document names to their raw token counts
+        Dictionary mapping document names to their raw token counts in the text, or with
+        store_positions to a tuple of their raw token counts and a dictionary mapping tokens to
+        their positions. Terms only found in weighted tags have a count of 0.
+        With store_snippets, the tuple has a third item, the snippet record, and its positions
+        are None unless store_positions is set.
     """
     result = {}
+    # Stem of each token seen in the chunk, the stemmer runs once per distinct token
+    stems = {}
+
+    def stem(token):
+        stemmed = stems.get(token)
+        if stemmed is None:
+            stemmed = stems[token] = stemmer.stem(token)
+        return stemmed
+
     for doc_name, doc_text in chunk.items():
         # Parse HTML and extract text
+        if timings is not None:
+            parse_start = clock()
 
         #https://www.crummy.com/software/BeautifulSoup/bs4/doc/#specifying-the-parser-to-use should fix broken html files
         warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
@@ -55,66 +70,307 @@ def tokenize_chunk(chunk, stemmer):
         soup = BeautifulSoup(doc_text, features='lxml')
         text = soup.get_text(separator=" ")
 
+        if timings is not None:
+            tokenize_start = clock()
+            _add_timing(timings, 'html_parse', parse_start, tokenize_start, len(doc_text))
+
         # Tokenize using regex
-        tokens = re.findall(r'[A-Za-z0-9]+', text.lower())
+        if store_snippets:
+            # Snippets need the offset of each token in the text
+            text = ' '.join(text.split())
+            matches = list(re.finditer(r'[A-Za-z0-9]+', text))
+            tokens = [match.group(0).lower() for match in matches]
+        else:
+            tokens = re.findall(r'[A-Za-z0-9]+', text.lower())
         
-        # Extract weighted tokens
-        weighted_tokens = weighted_tags(soup)
-        weighted_tokens = [stemmer.stem(token.lower()) for token in weighted_tags(soup)]
-
         # Stem tokens
-        stemmed_tokens = [stemmer.stem(token) for token in tokens]
-        
-        all_tokens = weighted_tokens + stemmed_tokens
+        stemmed_tokens = [stem(token) for token in tokens]
         
         # Just store raw token counts
-        result[doc_name] = dict(Counter(all_tokens))
+        result[doc_name] = counts = dict(Counter(stemmed_tokens))
+
+        if fields is not None:
+            # Tokens of weighted tags are flagged with their fields instead of being counted again
+            doc_fields = {}
+            for token, flags in tag_fields(soup).items():
+                term = stem(token)
+                doc_fields[term] = doc_fields.get(term, 0) | flags
+                counts.setdefault(term, 0)
+            fields[doc_name] = doc_fields
+
+        if links is not None:
+            links[doc_name] = extract_links(soup, doc_name[0])
+
+        positions = None
+        if store_positions:
+            # Positions index the text tokens
+            positions = defaultdict(list)
+            for position, token in enumerate(stemmed_tokens):
+                positions[token].append(position)
+            positions = dict(positions)
+            result[doc_name] = (result[doc_name], positions)
+
+        if store_snippets:
+            snippet = encode_snippet_record(text, [match.start() for match in matches], stemmed_tokens)
+            result[doc_name] = (result[doc_name][0] if store_positions else result[doc_name], positions, snippet)
+
+        if timings is not None:
+            _add_timing(timings, 'tokenize', tokenize_start, clock(), len(text))
+
+        if fingerprints is not None:
+            if timings is not None:
+                simhash_start = clock()
+            fingerprints[doc_name] = document_fingerprint(stemmed_tokens)
+            if timings is not None:
+                _add_timing(timings, 'simhash', simhash_start, clock(), len(text))
     
     return result
 
+def encode_chunk(chunk, stemmer, store_positions=False, store_snippets=False, timings=None, fingerprints=False):
+    """
+    Tokenize a chunk of documents like tokenize_chunk, numbering its terms with a dictionary local
+    to the chunk, so each distinct term is sent back to the parent process once and the documents
+    as arrays of integers.
+
+    Args:
+        fingerprints: Whether to compute the simhash fingerprint of each document, for the parent
+            process to find near duplicates
+
+    Returns:
+        Tuple of the terms of the chunk, indexed by local term ID, and a dictionary mapping document
+        names to a tuple of the local term IDs, counts and field flags of the document, as arrays,
+        the encoded positions of each of its terms with store_positions, its snippet record with
+        store_snippets and its fingerprint with fingerprints (None otherwise), and the URL digests
+        of the pages it links to, as an array
+    """
+    local_ids = {}
+    encoded = {}
+    document_fingerprints = {} if fingerprints else None
+    document_fields = {}
+    document_links = {}
+    results = tokenize_chunk(chunk, stemmer, store_positions, store_snippets, timings, document_fingerprints,
+                             document_fields, document_links)
+    for doc_name, result in results.items():
+        positions = snippet = None
+        if store_snippets:
+            counts, positions, snippet = result
+        elif store_positions:
+            counts, positions = result
+        else:
+            counts = result
+        term_ids = array('I', [local_ids.setdefault(term, len(local_ids)) for term in counts])
+        if positions is not None:
+            positions = [encode_positions(positions.get(term, [])) for term in counts]
+        fingerprint = document_fingerprints[doc_name] if fingerprints else None
+        doc_fields = document_fields[doc_name]
+        flags = array('B', [doc_fields.get(term, 0) for term in counts])
+        links = array('Q', map(url_digest, document_links[doc_name]))
+        encoded[doc_name] = (term_ids, array('I', counts.values()), flags, positions, snippet, fingerprint, links)
+    return list(local_ids), encoded
+
+def _add_timing(timings, stage, start, end, num_bytes):
+    """Add the time between two clock() readings, one document and its bytes to a stage of timings"""
+    wall_seconds, cpu_seconds, documents, total_bytes = timings.get(stage, (0.0, 0.0, 0, 0))
+    timings[stage] = (wall_seconds + end[0] - start[0], cpu_seconds + end[1] - start[1],
+                      documents + 1, total_bytes + num_bytes)
+
+def profile_tokenize_chunk(chunk, stemmer, store_positions=False, store_snippets=False, fingerprints=False):
+    """
+    Tokenize a chunk of documents like encode_chunk, also measuring the time of each stage.
+    
+    Returns:
+        Tuple of the result of encode_chunk and its timings, with the process ID and peak RSS of the worker
+    """
+    timings = {}
+    result = encode_chunk(chunk, stemmer, store_positions, store_snippets, timings, fingerprints)
+    timings['pid'] = os.getpid()
+    timings['peak_rss'] = peak_rss()
+    return result, timings
+
 class InvertedIndex:
     """
     Creates and manages an inverted index from a collection of documents.
     Implements disk-based indexing for memory efficiency.
     """
-    def __init__(self, zipPath: str = None, simhash_threshold: int = 5):
+    def __init__(self, zipPath=None, simhash_threshold: int = 5, index_dir: str = '.',
+                 num_shards: int = 1, start_doc_id: int = 0, store_positions: bool = False,
+                 store_snippets: bool = False, profiler=None, checkpoint: bool = False, resume: bool = False,
+                 readers: int = None, exact_duplicates: bool = True):
         """
         Initialize the inverted index. If zipPath is provided, immediately
         processes the documents in that path.
+        Args:
+            zipPath: Path to the ZIP of documents to index, or list of paths to ZIPs, directories of
+                JSON-lines files and glob patterns of them (see corpus.py)
+            simhash_threshold: Maximum simhash distance of near duplicates, 0 disables simhash
+            index_dir: Directory the index files are written to
+            num_shards: Number of document-partitioned shards to split the index into
+            start_doc_id: First document ID to assign
+            store_positions: Whether to build a positional index for phrase queries
+            store_snippets: Whether to store the text of the documents for search result snippets
+            profiler: Optional IndexingProfiler recording the time of each stage (see report.py)
+            checkpoint: Whether to save a checkpoint (see checkpoint.py) after each partial index and
+                merged shard. A failed build then keeps its partial indexes for a resume instead of merging them.
+            resume: Whether to continue from the checkpoint of an interrupted build in index_dir, if any
+            readers: Number of processes reading the corpus files, defaults to the number of CPUs up to 4
+            exact_duplicates: Whether to drop documents with the same text as a document already read
         """
         self.total_documents = 0
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
         self.stemmer = PorterStemmer()
         self.partial_index_count = 0
+        self.index_dir = index_dir
+        self.store_positions = store_positions
+        self.store_snippets = store_snippets
+        # Token positions of the current batch, filled by tokenize_documents when storing positions
+        self.document_positions = None
+        # Snippet records of the current batch, filled by tokenize_documents when storing snippets
+        self.document_snippets = None
+        # Number of tokens of each document of the current batch, filled by tokenize_documents
+        self.document_lengths = None
+        # Simhash fingerprints of the documents of the current batch, filled by tokenize_documents
+        # when near duplicates are eliminated
+        self.simhash_threshold = simhash_threshold
+        self.document_fingerprints = None
+        # URL digests of the pages each document of the current batch links to, filled by tokenize_documents
+        self.document_links = None
+        self.checkpointing = checkpoint
+        # Build stage of the checkpoint: 'indexing', 'merging' once all partial indexes are written, then 'merged'
+        self.stage = 'indexing'
+        # Files and sizes of the written partial indexes, checked before resuming
+        self.partials = []
+        # Numbers the terms of the documents, shared with the index manager writing the partial indexes
+        self.terms = TermDictionary()
         if zipPath is not None:
-            self.file_opener = FileOpener(zipPath, simhash_threshold)
-            self.load_zip()
+            os.makedirs(index_dir, exist_ok=True)
+            self.options = {'simhash_threshold': simhash_threshold, 'num_shards': num_shards,
+                            'start_doc_id': start_doc_id, 'store_positions': store_positions,
+                            'store_snippets': store_snippets, 'exact_duplicates': exact_duplicates}
+            index_manager = IndexManager(index_dir, num_shards, start_doc_id)
+            self.file_opener = FileOpener(zipPath, simhash_threshold, index_manager, self.profiler, readers,
+                                          exact_duplicates)
+            self.terms = index_manager.terms
+            if resume:
+                self.resume()
+            if self.stage == 'merged':
+                self.file_opener.close()
+            else:
+                self.load_zip()
+
+    def save_checkpoint(self):
+        """Save the progress of the build, from which resume() continues after a crash"""
+        write_checkpoint(self.index_dir, {
+            'corpus': self.file_opener.corpus.signature(),
+            'options': self.options,
+            'stage': self.stage,
+            'total_documents': self.total_documents,
+            'partial_index_count': self.partial_index_count,
+            'partials': self.partials,
+            'file_opener': self.file_opener.state(),
+            'index_manager': self.file_opener.index_manager.state(),
+        })
+
+    def resume(self):
+        """
+        Continue from the checkpoint of an interrupted build: after the last written partial
+        index, or with the merge of the shards not merged yet.
+        Raises:
+            ValueError: If the checkpoint belongs to another corpus or other options
+        """
+        checkpoint = read_checkpoint(self.index_dir, self.file_opener.corpus.signature(), self.options)
+        if checkpoint is None:
+            print("No checkpoint to resume from, starting the build from the beginning.")
+            return
+        self.stage = checkpoint['stage']
+        self.total_documents = checkpoint['total_documents']
+        self.partial_index_count = checkpoint['partial_index_count']
+        self.partials = checkpoint['partials']
+        self.file_opener.restore(checkpoint['file_opener'])
+        self.file_opener.index_manager.restore(checkpoint['index_manager'])
+        self.terms = self.file_opener.index_manager.terms
+        print(f"Resuming the build after {self.total_documents} documents and "
+              f"{self.partial_index_count} partial indexes, at the {self.stage} stage.")
+
+    def _record_partial(self):
+        """Add the files of the partial index just written to the checkpoint manifest"""
+        index_manager = self.file_opener.index_manager
+        for shard in range(index_manager.num_shards):
+            files = index_manager.partial_index_files(shard, self.partial_index_count)
+            self.partials.append({'number': self.partial_index_count, 'shard': shard,
+                                  'files': {fname: os.path.getsize(fname) for fname in files}})
 
     def load_zip(self):
         """
         Processes documents from a ZIP file in batches to manage memory usage.
         Creates partial indexes for each batch.
         """
+        completed = False
         try:
-            while True:
+            while self.stage == 'indexing':
                 # Read batches so there are 3 partial indexes
-                count = self.file_opener.total_files // 3
+                count = max(1, self.file_opener.total_files // 3)
                 self.documents = self.file_opener.read_zip(count)
                 if not self.documents:
                     break
                 batch_tfs = self.tokenize_documents()
-                self.file_opener.save_partial_index(batch_tfs, self.partial_index_count)
+                if self.document_fingerprints is not None:
+                    self.drop_near_duplicates(batch_tfs)
+                with self.profiler.stage('partial_write'):
+                    self.file_opener.save_partial_index(batch_tfs, self.partial_index_count,
+                                                        self.document_positions, self.document_snippets,
+                                                        self.document_lengths, self.document_links)
+                self.profiler.count('partial_write', len(batch_tfs))
+                if self.checkpointing:
+                    self._record_partial()
                 self.partial_index_count += 1
+                if self.checkpointing:
+                    self.save_checkpoint()
+            completed = True
         finally:
             self.file_opener.close()
-            if self.partial_index_count > 0:
-                self.file_opener.merge_partial_indexes(self.partial_index_count)
+            # With checkpoints, the partial indexes of a failed build are kept for a resume
+            if self.partial_index_count > 0 and (completed or not self.checkpointing):
+                self.merge()
+
+    def merge(self):
+        """Merge the partial indexes, saving a checkpoint before the merge and after each merged shard"""
+        self.stage = 'merging'
+        save_checkpoint = self.save_checkpoint if self.checkpointing else None
+        if save_checkpoint is not None:
+            save_checkpoint()
+        with self.profiler.stage('merge'):
+            self.file_opener.merge_partial_indexes(self.partial_index_count, save_checkpoint)
+        self.profiler.count('merge', self.total_documents)
+        self.stage = 'merged'
+        if save_checkpoint is not None:
+            save_checkpoint()
+
+    def drop_near_duplicates(self, batch_tfs: dict):
+        """
+        Remove from the batch the documents whose simhash fingerprint is close to one of a document
+        already kept, see FileOpener.drop_near_duplicates.
+        Args:
+            batch_tfs: Dictionary returned by tokenize_documents
+        """
+        with self.profiler.stage('dedup'):
+            dropped = self.file_opener.drop_near_duplicates(self.document_fingerprints)
+        for doc in dropped:
+            del batch_tfs[doc]
+            del self.document_lengths[doc]
+            del self.document_links[doc]
+            if self.document_positions is not None:
+                del self.document_positions[doc]
+            if self.document_snippets is not None:
+                del self.document_snippets[doc]
+        self.total_documents -= len(dropped)
 
     def tokenize_documents(self) -> dict:
         """
         Tokenizes all documents in the ZIP file and calculates proper term frequencies.
         Uses multiprocessing for faster processing by dividing documents into chunks.
         Returns:
-            dict: a dictionary mapping document names to their term frequencies.
+            dict: a dictionary mapping document names to a tuple of the IDs of their terms in
+                self.terms, their term frequencies and their field flags, as arrays
         """
 
         # Determine optimal number of processes
@@ -125,61 +381,81 @@ class InvertedIndex:
         chunks = [dict(list(self.documents.items())[i:i + chunk_size]) 
                  for i in range(0, len(self.documents), chunk_size)]
         
-        # Process chunks in parallel to get raw token counts
+        # Process chunks in parallel to get raw token counts, timing each stage in the workers when profiling
+        profiling = self.profiler is not NULL_PROFILER
         with multiprocessing.Pool(processes=num_processes) as pool:
             raw_results = list(tqdm.tqdm(
-                pool.imap(partial(tokenize_chunk, stemmer=self.stemmer), chunks),
+                pool.imap(partial(profile_tokenize_chunk if profiling else encode_chunk,
+                                  stemmer=self.stemmer,
+                                  store_positions=self.store_positions,
+                                  store_snippets=self.store_snippets,
+                                  fingerprints=self.simhash_threshold > 0), chunks),
                 total=len(chunks),
                 desc="Tokenizing documents",
                 unit="chunk",
                 leave=False
             ))
-        
-        # Combine results from all processes
+        if profiling:
+            for _, timings in raw_results:
+                self.profiler.add_worker_timings(timings)
+            raw_results = [chunk_result for chunk_result, _ in raw_results]
+
+        # Combine results from all processes, mapping the term IDs local to each chunk to global ones
         token_counts = {}
-        for chunk_result in raw_results:
-            token_counts.update(chunk_result)
-        
+        if self.store_positions:
+            self.document_positions = {}
+        if self.store_snippets:
+            self.document_snippets = {}
+        if self.simhash_threshold > 0:
+            self.document_fingerprints = {}
+        self.document_links = {}
+        for chunk_terms, chunk_result in raw_results:
+            term_ids = self.terms.ids(chunk_terms)
+            for doc_name, (local_ids, counts, flags, positions, snippet, fingerprint, links) in chunk_result.items():
+                token_counts[doc_name] = (array('I', map(term_ids.__getitem__, local_ids)), counts, flags)
+                if self.store_positions:
+                    self.document_positions[doc_name] = positions
+                if self.store_snippets:
+                    self.document_snippets[doc_name] = snippet
+                if self.simhash_threshold > 0:
+                    self.document_fingerprints[doc_name] = fingerprint
+                self.document_links[doc_name] = links
+
+        self.document_lengths = {doc_name: sum(counts) for doc_name, (_, counts, _) in token_counts.items()}
+
         # Now calculate term frequencies from the complete token counts
         term_frequencies = {}
-        for doc_name, counts in token_counts.items():
-            term_frequencies[doc_name] = self.calculate_tfs(counts)
+        for doc_name, (doc_term_ids, counts, flags) in token_counts.items():
+            term_frequencies[doc_name] = (doc_term_ids, self.calculate_tfs(counts), flags)
         
         self.total_documents += len(self.documents)
         return term_frequencies
 
-    def calculate_tfs(self, tokens: dict) -> dict:
+    def calculate_tfs(self, counts: array) -> array:
         """
         Calculates the term frequency of all tokens in a document.
         TF = number of times the token appears in the document / total number
         of tokens in the document.
         Args:
-            tokens (dict): Dictionary mapping of token and its raw frequencies
+            counts (array): Raw frequency of each token
         Returns:
-            dict: Dictionary mapping tokens to their normalized term frequencies.
+            array: Normalized term frequency of each token, in the same order
         """
-        total_tokens = sum(tokens.values())
-        return {token: count / total_tokens for token, count in tokens.items()}
+        # Terms only found in weighted tags count for nothing in the text
+        total_tokens = sum(counts) or 1
+        return array('d', [count / total_tokens for count in counts])
 
 
     def unique_tokens(self):
         """
         Count the unique tokens in the index.
-        First tries token_position.json for quicker access
-        if missing tries counting from index.json
+        First tries the document frequencies of the lexicon or global statistics,
+        if missing counts the entries of token_positions.pkl
         Returns:
             int: Number of unique tokens in the index
         """
-        try:
-            # First try to use token positions file for a quick count
-            with open('token_positions.json', 'r') as f:
-                token_positions = json.load(f)
-                return len(token_positions)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # Fall back to counting from the index file
-            with open('index.json', 'r') as f:
-                parser = ijson.kvitems(f, "")
-                count = 0
-                for _ in parser:
-                    count += 1
-            return count
+        frequencies = load_term_frequencies(self.index_dir)
+        if frequencies:
+            return len(frequencies)
+        with open(os.path.join(self.index_dir, 'token_positions.pkl'), 'rb') as f:
+            return len(pickle.load(f))
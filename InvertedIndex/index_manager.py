@@ -1,18 +1,111 @@
 import json
 import heapq
+import math
 import os
 import pickle
+from array import array
 from collections import defaultdict
+from contextlib import ExitStack
 from typing import Dict, List
 from tqdm import tqdm
-from .posting import Posting
+from .checkpoint import atomic_write
+from .corpus import SOURCES_NAME
+from .posting import PostingsBuffer
+from .document_metadata import write_document_metadata
+from .links import LinkGraph
+from .terms import TermDictionary
 
 class IndexManager:
-    def __init__(self):
+    def __init__(self, index_dir: str = '.', num_shards: int = 1, start_id: int = 0):
+        """
+        Initialize the index manager.
+        Args:
+            index_dir: Directory the index files are written to
+            num_shards: Number of document-partitioned shards to build. With more than
+                one shard, each shard gets its own directory (shard_0, shard_1, ...) holding
+                its own token positions, postings and URL/file maps.
+            start_id: First ID to assign, so segments of an incremental index get disjoint ID ranges
+        """
         self.url_to_id = {}  # Map URLs to numeric IDs
         self.file_to_id = {}
-        self.current_url_id = 0
-        self.current_file_id = 0
+        self.current_url_id = start_id
+        self.current_file_id = start_id
+        self.start_id = start_id
+        self.index_dir = index_dir
+        self.num_shards = num_shards
+        # Byte offset of each document's snippet record in the snippets.bin of its shard
+        self.snippet_offsets = [{} for _ in range(num_shards)]
+        # (URL, file name, length, norm, static score) of each document ID, for docmeta.bin
+        self.documents = {}
+        # Shards whose partial indexes are merged, so a resumed merge skips them
+        self.merged_shards = set()
+        # [first document ID, end document ID, source path] of each source of the documents, for sources.json
+        self.sources = None
+        # IDs of the terms, which the partial indexes store instead of the terms themselves
+        self.terms = TermDictionary()
+        # Links between the documents, turned into their static scores before the merge
+        self.links = LinkGraph()
+
+    def state(self) -> dict:
+        """
+        Get what a resumed build needs to continue with the same IDs, for a checkpoint.
+        Returns:
+            dict: The ID maps, term dictionary, links, document metadata, snippet offsets and sizes
+                and merged shards
+        """
+        snippet_sizes = []
+        for shard in range(self.num_shards):
+            path = os.path.join(self.shard_dir(shard), 'snippets.bin')
+            snippet_sizes.append(os.path.getsize(path) if self.snippet_offsets[shard] else 0)
+        return {
+            'url_to_id': self.url_to_id,
+            'file_to_id': self.file_to_id,
+            'current_url_id': self.current_url_id,
+            'current_file_id': self.current_file_id,
+            'terms': self.terms.terms,
+            'links': (self.links.sources, self.links.targets),
+            'documents': self.documents,
+            'snippet_offsets': self.snippet_offsets,
+            'snippet_sizes': snippet_sizes,
+            'merged_shards': sorted(self.merged_shards),
+        }
+
+    def restore(self, state: dict):
+        """
+        Continue from the state saved by state(). Snippet records appended after it was saved
+        are cut off, the documents of the interrupted batch are indexed again.
+        Args:
+            state: Dictionary returned by state()
+        """
+        self.url_to_id = state['url_to_id']
+        self.file_to_id = state['file_to_id']
+        self.current_url_id = state['current_url_id']
+        self.current_file_id = state['current_file_id']
+        self.terms = TermDictionary(state['terms'])
+        self.links = LinkGraph(*state['links'])
+        self.documents = state['documents']
+        self.snippet_offsets = state['snippet_offsets']
+        self.merged_shards = set(state['merged_shards'])
+        for shard, size in enumerate(state['snippet_sizes']):
+            path = os.path.join(self.shard_dir(shard), 'snippets.bin')
+            if size and os.path.exists(path):
+                os.truncate(path, size)
+
+    def partial_index_files(self, shard: int, partial_index_count: int) -> List[str]:
+        """Get the files of a partial index of a shard: postings, token offsets and positions when stored"""
+        filename = os.path.join(self.shard_dir(shard), f'partial_index_{partial_index_count}.bin')
+        files = [filename, filename.replace('.bin', '_index.pkl'), filename.replace('.bin', '_positions.bin')]
+        return [fname for fname in files if os.path.exists(fname)]
+
+    def shard_dir(self, shard: int) -> str:
+        """Get the directory holding the files of a shard"""
+        if self.num_shards == 1:
+            return self.index_dir
+        return os.path.join(self.index_dir, f'shard_{shard}')
+
+    def shard_for(self, doc_id: int) -> int:
+        """Get the shard a document ID is partitioned to"""
+        return doc_id % self.num_shards
 
     def get_url_id(self, url: str) -> int:
         """Get or create a numeric ID for a URL"""
@@ -29,76 +122,245 @@ class IndexManager:
         return self.file_to_id[file_path]
     
     def save_file_mapping(self):
-        """Save the file path to ID mapping to a separate file"""
-        id_to_file = {str(id): file_path for file_path, id in self.file_to_id.items()}
-        with open('files.json', 'w') as f:
-            json.dump(id_to_file, f)
+        """Save the file path to ID mapping to a separate file (one per shard)"""
+        for shard in range(self.num_shards):
+            id_to_file = {str(id): file_path for file_path, id in self.file_to_id.items()
+                          if self.shard_for(id) == shard}
+            with atomic_write(os.path.join(self.shard_dir(shard), 'files.json'), 'w') as f:
+                json.dump(id_to_file, f)
 
     def save_url_mapping(self):
-        """Save the URL to ID mapping to a separate file"""
-        id_to_url = {str(id): url for url, id in self.url_to_id.items()}
-        with open('urls.json', 'w') as f:
-            json.dump(id_to_url, f)
+        """Save the URL to ID mapping to a separate file (one per shard)"""
+        for shard in range(self.num_shards):
+            id_to_url = {str(id): url for url, id in self.url_to_id.items()
+                         if self.shard_for(id) == shard}
+            with atomic_write(os.path.join(self.shard_dir(shard), 'urls.json'), 'w') as f:
+                json.dump(id_to_url, f)
 
-    def create_and_save_partial_index(self, batch_tfs: Dict[str, Dict[str, int]], partial_index_count: int) -> str:
+    def save_document_metadata(self):
+        """Save the columnar metadata of the documents (one file per shard)"""
+        for shard in range(self.num_shards):
+            # The first ID of the shard, its IDs are num_shards apart
+            first_doc_id = self.start_id + (shard - self.start_id) % self.num_shards
+            write_document_metadata(self.shard_dir(shard),
+                                    {doc_id: document for doc_id, document in self.documents.items()
+                                     if self.shard_for(doc_id) == shard},
+                                    first_doc_id, self.num_shards)
+
+    def save_sources(self):
+        """Save the source of each document ID range, the same for every shard, if known"""
+        if self.sources is None:
+            return
+        for shard in range(self.num_shards):
+            with atomic_write(os.path.join(self.shard_dir(shard), SOURCES_NAME), 'w') as f:
+                json.dump(self.sources, f)
+
+    def save_snippet_offsets(self):
+        """Save the offsets of the snippet records to a separate file (one per shard), if any were written"""
+        for shard in range(self.num_shards):
+            if self.snippet_offsets[shard]:
+                with atomic_write(os.path.join(self.shard_dir(shard), 'snippet_offsets.pkl')) as f:
+                    pickle.dump(self.snippet_offsets[shard], f)
+
+    def _write_snippets(self, shard: int, snippets: Dict[int, bytes]):
+        """
+        Append snippet records to the snippets.bin of a shard, recording their offsets.
+        Args:
+            shard: Shard of the documents
+            snippets: Dictionary mapping document IDs to their encoded snippet records
+        """
+        offsets = self.snippet_offsets[shard]
+        # The file is started over by the first batch of a build
+        with open(os.path.join(self.shard_dir(shard), 'snippets.bin'), 'ab' if offsets else 'wb') as f:
+            for doc_id, record in snippets.items():
+                offsets[doc_id] = f.tell()
+                pickle.dump(record, f)
+
+    def copy_snippets(self, directories: List[str], directory: str, keep_doc=None):
+        """
+        Copy the snippet records of several indexes into one, such as merged segments.
+        Args:
+            directories: Directories of the indexes to copy from, all must have snippets
+            directory: Directory to write snippets.bin and snippet_offsets.pkl to
+            keep_doc: Optional predicate on document IDs, records it rejects are dropped
+        """
+        offsets = {}
+        with open(os.path.join(directory, 'snippets.bin'), 'wb') as f_out:
+            for source in directories:
+                with open(os.path.join(source, 'snippet_offsets.pkl'), 'rb') as f:
+                    source_offsets = pickle.load(f)
+                with open(os.path.join(source, 'snippets.bin'), 'rb') as f_in:
+                    for doc_id, offset in sorted(source_offsets.items(), key=lambda item: item[1]):
+                        if keep_doc is not None and not keep_doc(doc_id):
+                            continue
+                        f_in.seek(offset)
+                        offsets[doc_id] = f_out.tell()
+                        pickle.dump(pickle.load(f_in), f_out)
+        with open(os.path.join(directory, 'snippet_offsets.pkl'), 'wb') as f:
+            pickle.dump(offsets, f)
+
+    def save_global_stats(self, document_frequencies: Dict[str, int]):
+        """
+        Save the collection-wide statistics shared by all shards, so every shard
+        computes IDF and normalizes document lengths against the whole corpus instead of its own partition,
+        and the global lexicon, so wildcard terms expand to the same terms on every shard.
+        Args:
+            document_frequencies: Dictionary mapping tokens to their global document frequency
+        """
+        lengths = [document[2] for document in self.documents.values()]
+        with atomic_write(os.path.join(self.index_dir, 'global_stats.pkl')) as f:
+            pickle.dump({'total_documents': len(self.url_to_id),
+                         'num_shards': self.num_shards,
+                         'document_frequencies': document_frequencies,
+                         'average_length': sum(lengths) / len(lengths) if lengths else 0.0}, f)
+        # The global lexicon lets the search expand wildcard terms once for every shard
+        self.save_lexicon(self.index_dir, sorted(document_frequencies.items()))
+
+    def save_lexicon(self, directory: str, lexicon: List[tuple]):
+        """
+        Save the sorted lexicon of an index, the terms and their document frequencies.
+        Args:
+            directory: Directory to write lexicon.pkl to
+            lexicon: List of (token, document frequency) tuples, in sorted token order
+        """
+        with atomic_write(os.path.join(directory, 'lexicon.pkl')) as f:
+            pickle.dump({'terms': [token for token, _ in lexicon],
+                         'document_frequencies': array('I', (df for _, df in lexicon))}, f)
+
+    def create_and_save_partial_index(self, batch_tfs: Dict[tuple, tuple], partial_index_count: int,
+                                      batch_positions: Dict[tuple, List[bytes]] = None,
+                                      batch_snippets: Dict[str, bytes] = None,
+                                      batch_lengths: Dict[str, int] = None,
+                                      batch_links: Dict[tuple, array] = None) -> str:
         """
         Creates a partial index from batch of tfs and saves it to disk
         
         Args:
-            batch_tfs: Dictionary mapping URLs to their token frequency dictionaries
+            batch_tfs: Dictionary mapping (URL, file name) to a tuple of the IDs of the document's terms
+                in self.terms, their term frequencies and their field flags
             partial_index_count: Counter to identify this partial index
+            batch_positions: Optional dictionary mapping (URL, file name) to the encoded positions of
+                each term of the document, saved to a separate positions file in the same order as the postings
+            batch_snippets: Optional dictionary mapping URLs to the encoded snippet records of the
+                documents, appended to the snippets file of their shard
+            batch_lengths: Optional dictionary mapping URLs to the number of tokens of the documents
+            batch_links: Optional dictionary mapping (URL, file name) to the URL digests of the pages
+                the document links to, added to the link graph
             
         Returns:
-            filename: Name of the file where the partial index was saved
+            filenames: Names of the files where the partial index was saved, one per shard
         """
         # Create partial index
         with tqdm(total=len(batch_tfs), desc="Creating partial index", leave=False) as pbar:
-            partial_index = defaultdict(list)
-            for (url, file_path), tokens in batch_tfs.items():
+            partial_indexes = [defaultdict(PostingsBuffer) for _ in range(self.num_shards)]
+            partial_positions = [defaultdict(list) for _ in range(self.num_shards)]
+            partial_snippets = [{} for _ in range(self.num_shards)]
+            for doc, (term_ids, tfs, flags) in batch_tfs.items():
+                url, file_path = doc
                 url_id = self.get_url_id(url)
                 file_id = self.get_file_id(file_path)
-                for token, tf in tokens.items():
-                    partial_index[token].append(Posting(url_id, tf))
+                length = batch_lengths.get(doc, 0) if batch_lengths is not None else 0
+                norm = math.sqrt(sum(tf * tf for tf in tfs))
+                self.documents[url_id] = (url, file_path, length, norm, 0.0)
+                partial_index = partial_indexes[self.shard_for(url_id)]
+                for term_id, tf, fields in zip(term_ids, tfs, flags):
+                    partial_index[term_id].append(url_id, tf, fields)
+                if batch_positions is not None:
+                    positions = partial_positions[self.shard_for(url_id)]
+                    for term_id, encoded in zip(term_ids, batch_positions[doc]):
+                        positions[term_id].append(encoded)
+                if batch_snippets is not None:
+                    partial_snippets[self.shard_for(url_id)][url_id] = batch_snippets[doc]
+                if batch_links is not None:
+                    self.links.add(url_id, batch_links[doc])
                 pbar.update(1)
             pbar.close()
-        
-        # Write to binary file with custom format
-        filename = f'partial_index_{partial_index_count}.bin'
+
+        filenames = []
+        for shard, partial_index in enumerate(partial_indexes):
+            directory = self.shard_dir(shard)
+            os.makedirs(directory, exist_ok=True)
+            positions = partial_positions[shard] if batch_positions is not None else None
+            if partial_snippets[shard]:
+                self._write_snippets(shard, partial_snippets[shard])
+            filenames.append(self._write_partial_index(partial_index, directory, partial_index_count, positions))
+        return filenames
+
+    def _write_partial_index(self, partial_index, directory: str, partial_index_count: int,
+                             positions=None) -> str:
+        """
+        Write one partial index to disk, keyed by term ID and sorted by term
+        Args:
+            partial_index: Dictionary mapping term IDs to their PostingsBuffer
+            directory: Directory to write the partial index to
+            partial_index_count: Counter to identify this partial index
+            positions: Optional dictionary mapping term IDs to the encoded positions of each posting
+        Returns:
+            filename: Name of the file where the partial index was saved
+        """
+        # Write to binary file with custom format, the files only get their names once complete
+        filename = os.path.join(directory, f'partial_index_{partial_index_count}.bin')
         token_positions = {}
-        with open(filename, 'wb') as f_out:
+        with ExitStack() as files:
+            f_out = files.enter_context(atomic_write(filename))
+            positions_file = None
+            if positions is not None:
+                positions_file = files.enter_context(atomic_write(filename.replace('.bin', '_positions.bin')))
             with tqdm(total=len(partial_index), desc="Writing partial index to disk", leave=False) as pbar:
-                for token in sorted(partial_index.keys()):
-                    token_positions[token] = f_out.tell()
-                    # Write token and postings (postings converted to dicts)
-                    pickle.dump((token, [vars(p) for p in partial_index[token]]), f_out)
+                # In term order, like every partial index, so the merge reads them all in one pass
+                for term_id in sorted(partial_index.keys(), key=self.terms.__getitem__):
+                    token_positions[term_id] = f_out.tell()
+                    # Write term ID and the raw bytes of the postings arrays
+                    pickle.dump((term_id, *partial_index[term_id].to_bytes()), f_out)
+                    if positions_file is not None:
+                        pickle.dump((term_id, positions[term_id]), positions_file)
                     pbar.update(1)
                 pbar.close()
         # Save token positions separately for O(1) lookup later
-        index_filename = f'partial_index_{partial_index_count}_index.pkl'
-        with open(index_filename, 'wb') as idx_file:
+        index_filename = filename.replace('.bin', '_index.pkl')
+        with atomic_write(index_filename) as idx_file:
             pickle.dump(token_positions, idx_file)
         
         return filename
 
-    def _initialize_file_iterators(self, files: List[str], merge_pbar):
-        """Initialize file iterators for each partial index file in binary mode"""
+    def _read_entry(self, fp, positions_fp=None):
+        """
+        Read the next token of an index file, and its positions from the matching positions file.
+        Both files are closed when the end is reached.
+        Returns:
+            Tuple of (token, postings, positions), positions being None without positions file,
+            or None at the end of the file. The postings of a partial index are a PostingsBuffer.
+        """
+        try:
+            token, *postings = pickle.load(fp)
+            # Partial indexes hold the raw bytes of the document ID, TF and field flag arrays
+            postings = PostingsBuffer.from_bytes(*postings) if len(postings) == 3 else postings[0]
+            positions = pickle.load(positions_fp)[1] if positions_fp is not None else None
+            return token, postings, positions
+        except EOFError:
+            fp.close()
+            if positions_fp is not None:
+                positions_fp.close()
+            return None
+
+    def _initialize_file_iterators(self, files: List[str], merge_pbar, positions_files: List[str] = None):
+        """Initialize file iterators for each partial index file (and positions file) in binary mode"""
         file_iters = []
-        for fname in files:
+        for i, fname in enumerate(files):
             fp = open(fname, 'rb')
-            try:
-                token, postings = pickle.load(fp)
-                file_iters.append((token, postings, fp))
+            positions_fp = open(positions_files[i], 'rb') if positions_files is not None else None
+            entry = self._read_entry(fp, positions_fp)
+            if entry is not None:
+                file_iters.append((*entry, fp, positions_fp))
                 merge_pbar.update(1)
-            except EOFError:
-                fp.close()
         return file_iters
 
-    def _initialize_heap(self, file_iters):
-        """Initialize the heap with the first entry from each file"""
+    def _initialize_heap(self, file_iters, sort_key):
+        """Initialize the heap with the first entry from each file, ordered by the sort key of its token"""
         heap = []
         counter = 0
-        for token, postings, fp in file_iters:
-            heap.append((token, counter, postings, fp))
+        for token, postings, positions, fp, positions_fp in file_iters:
+            heap.append((sort_key(token), counter, token, postings, positions, fp, positions_fp))
             counter += 1
         heapq.heapify(heap)
         return heap, counter
@@ -119,71 +381,206 @@ class IndexManager:
         outfile.write(':')
         json.dump(current_postings, outfile)
 
-    def merge_partial_indexes(self, partial_index_count: int):
-        """Merge partial indexes using a k-way merge without loading everything into memory."""
+    def merge_partial_indexes(self, partial_index_count: int, on_shard_merged=None):
+        """
+        Merge the partial indexes of every shard. When the index is sharded, the document
+        frequencies of all shards are combined and saved as global statistics.
+        Shards already merged by an interrupted build (see merged_shards) are skipped.
+        Args:
+            partial_index_count: Number of partial indexes of each shard
+            on_shard_merged: Optional callable run after each shard is merged, before its partial
+                indexes are removed, such as saving a checkpoint
+        """
+        self.compute_static_scores()
         self.save_url_mapping()
         self.save_file_mapping()
+        self.save_document_metadata()
+        self.save_snippet_offsets()
+        self.save_sources()
+
+        document_frequencies = defaultdict(int) if self.num_shards > 1 else None
+        for shard in range(self.num_shards):
+            directory = self.shard_dir(shard)
+            if shard in self.merged_shards:
+                if document_frequencies is not None:
+                    # The lexicon of a merged shard holds the document frequencies it contributes
+                    with open(os.path.join(directory, 'lexicon.pkl'), 'rb') as f:
+                        lexicon = pickle.load(f)
+                    for token, df in zip(lexicon['terms'], lexicon['document_frequencies']):
+                        document_frequencies[token] += df
+            else:
+                self._merge_shard(directory, partial_index_count, document_frequencies)
+                self.merged_shards.add(shard)
+                if on_shard_merged is not None:
+                    on_shard_merged()
+            self._remove_partial_indexes(directory, partial_index_count)
+
+        if document_frequencies is not None:
+            self.save_global_stats(dict(document_frequencies))
 
-        files = [f'partial_index_{i}.bin' for i in range(0, partial_index_count)]
-        merge_pbar = tqdm(total=partial_index_count, desc="Merging partial indexes", leave=False)
+    def compute_static_scores(self):
+        """
+        Set the static score of every document to its PageRank in the link graph, scaled so the
+        average score is 1. Documents keep a score of 0 when no links were collected.
+        """
+        if not len(self.links):
+            return
+        scores = self.links.static_scores(self.url_to_id, self.start_id, self.current_url_id - self.start_id)
+        for doc_id, (url, file_path, length, norm, _) in self.documents.items():
+            self.documents[doc_id] = (url, file_path, length, norm, float(scores[doc_id - self.start_id]))
+
+    def static_score(self, doc_id: int) -> float:
+        """Get the static score of a document"""
+        return self.documents[doc_id][4]
 
-        file_iters = self._initialize_file_iterators(files, merge_pbar)
+    def _merge_shard(self, directory: str, partial_index_count: int, document_frequencies=None):
+        """
+        Merge the partial indexes of one shard.
+        Args:
+            directory: Directory holding the partial indexes of the shard
+            partial_index_count: Number of partial indexes to merge
+            document_frequencies: Optional dictionary to add each token's document frequency to
+        """
+        files = [os.path.join(directory, f'partial_index_{i}.bin') for i in range(0, partial_index_count)]
+        positions_files = [fname.replace('.bin', '_positions.bin') for fname in files]
+        if not all(os.path.exists(fname) for fname in positions_files):
+            positions_files = None
+        self.merge_index_files(files, directory, document_frequencies, positions_files=positions_files,
+                               terms=self.terms, static_score=self.static_score if len(self.links) else None)
+
+    def _remove_partial_indexes(self, directory: str, partial_index_count: int):
+        """Clean up the partial index files of a merged shard, and their token index and positions files"""
+        for i in range(partial_index_count):
+            fname = os.path.join(directory, f'partial_index_{i}.bin')
+            for path in (fname, fname.replace('.bin', '_index.pkl'), fname.replace('.bin', '_positions.bin')):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def merge_index_files(self, files: List[str], directory: str, document_frequencies=None,
+                          keep_doc=None, positions_files: List[str] = None, terms: TermDictionary = None,
+                          static_score=None):
+        """
+        Merge token-sorted index files using a k-way merge without loading everything into memory.
+        Writes index.bin, token_positions.pkl and the sorted lexicon.pkl to the directory,
+        and positions.bin and position_offsets.pkl when positions files are given.
+        Args:
+            files: Index files to merge, each a sequence of pickled (token, postings) sorted by token
+            directory: Directory to write the merged index to
+            document_frequencies: Optional dictionary to add each token's document frequency to
+            keep_doc: Optional predicate on document IDs, postings it rejects are dropped
+            positions_files: Optional positions file of each index file, a sequence of pickled
+                (token, encoded positions of each posting) in the same order
+            terms: Term dictionary of partial indexes, whose tokens are term IDs. The IDs are
+                compared by the rank of their term, and written as terms.
+            static_score: Optional function giving the static score of a document ID. The postings
+                of each token are then written by decreasing static score instead of document ID,
+                so the best documents of a long postings list come first.
+        """
+        merge_pbar = tqdm(total=len(files), desc="Merging partial indexes", leave=False)
+
+        file_iters = self._initialize_file_iterators(files, merge_pbar, positions_files)
         
         merge_pbar.reset()
         merge_pbar.set_description("Processing tokens")
         merge_pbar.total = None
 
-        heap, counter = self._initialize_heap(file_iters)
+        # Integers compare faster than strings, term IDs are compared by the sorted order of their terms
+        sort_key = terms.sort_ranks().__getitem__ if terms is not None else (lambda token: token)
+        heap, counter = self._initialize_heap(file_iters, sort_key)
         
         # Dictionary to store token positions in the binary index file
         token_positions = {}
+        # (token, document frequency) of every written token, in sorted token order
+        lexicon = []
+        # Byte offsets of each token's positions in positions.bin
+        position_offsets = {} if positions_files is not None else None
 
-        with open('index.bin', 'wb') as outfile:
-            first_token = True
+        with ExitStack() as output_files:
+            outfile = output_files.enter_context(atomic_write(os.path.join(directory, 'index.bin')))
+            positions_out = None
+            if positions_files is not None:
+                positions_out = output_files.enter_context(atomic_write(os.path.join(directory, 'positions.bin')))
             current_token = None
             current_postings = []
+            current_positions = []
 
             while heap:
-                token, _, postings, fp = heapq.heappop(heap)
+                _, _, token, postings, positions, fp, positions_fp = heapq.heappop(heap)
+                if keep_doc is not None:
+                    kept = [i for i, p in enumerate(postings) if keep_doc(p['doc_id'])]
+                    postings = [postings[i] for i in kept]
+                    if positions is not None:
+                        positions = [positions[i] for i in kept]
                 
                 if current_token is None or token != current_token:
                     if current_token is not None:
-                        # Record position before writing the token
-                        token_position = outfile.tell()
-                        token_positions[current_token] = token_position
-                        
-                        # Pickle the token and its postings
-                        pickle.dump((current_token, current_postings), outfile)
+                        self._write_merged_token(outfile, terms[current_token] if terms is not None else current_token,
+                                                 current_postings, token_positions, document_frequencies,
+                                                 positions_out, current_positions, position_offsets,
+                                                 lexicon, static_score)
                     
                     current_token = token
                     current_postings = postings
+                    current_positions = positions
                 else:
                     current_postings.extend(postings)
+                    if positions is not None:
+                        current_positions.extend(positions)
 
-                try:
-                    token, postings = pickle.load(fp)
-                    heapq.heappush(heap, (token, counter, postings, fp))
+                entry = self._read_entry(fp, positions_fp)
+                if entry is not None:
+                    token, postings, positions = entry
+                    heapq.heappush(heap, (sort_key(token), counter, token, postings, positions, fp, positions_fp))
                     counter += 1
-                except EOFError:
-                    fp.close()
 
             if current_token is not None:
-                # Record position for the last token
-                token_position = outfile.tell()
-                token_positions[current_token] = token_position
-                
-                # Pickle the last token and its postings
-                pickle.dump((current_token, current_postings), outfile)
+                # Write the last token
+                self._write_merged_token(outfile, terms[current_token] if terms is not None else current_token,
+                                         current_postings, token_positions, document_frequencies,
+                                         positions_out, current_positions, position_offsets,
+                                         lexicon, static_score)
 
         merge_pbar.close()
         
         # Save token positions to a separate file using pickle
         print("Saving token positions for fast lookup...")
-        with open('token_positions.pkl', 'wb') as f:
+        with atomic_write(os.path.join(directory, 'token_positions.pkl')) as f:
             pickle.dump(token_positions, f)
 
-        # Clean up temporary binary partial index files and their token index files
-        for fname in files:
-            os.remove(fname)
-            index_fname = fname.replace('.bin', '_index.pkl')
-            os.remove(index_fname)
+        # Tokens come out of the merge in sorted order, so prefixes are ranges of the lexicon
+        self.save_lexicon(directory, lexicon)
+
+        if position_offsets is not None:
+            with atomic_write(os.path.join(directory, 'position_offsets.pkl')) as f:
+                pickle.dump(position_offsets, f)
+
+    def _write_merged_token(self, outfile, token, postings, token_positions, document_frequencies,
+                            positions_out=None, positions=None, position_offsets=None, lexicon=None,
+                            static_score=None):
+        """
+        Pickle a token and its merged postings to the output file, recording its byte position,
+        and its positions to the positions file when there is one.
+        The token and its document frequency are appended to the lexicon when one is given.
+        Tokens left without postings (all of their documents were dropped) are skipped.
+        With static_score, the postings and their positions are sorted by decreasing static score.
+        """
+        if not postings:
+            return
+        if isinstance(postings, PostingsBuffer):
+            # The merged index keeps the list of dictionaries the search reads
+            postings = postings.to_dicts()
+        if static_score is not None:
+            # The sort is stable, documents with the same score stay in document ID order
+            order = sorted(range(len(postings)), key=lambda i: -static_score(postings[i]['doc_id']))
+            postings = [postings[i] for i in order]
+            if positions is not None:
+                positions = [positions[i] for i in order]
+        token_positions[token] = outfile.tell()
+        pickle.dump((token, postings), outfile)
+        if positions_out is not None:
+            position_offsets[token] = positions_out.tell()
+            pickle.dump((token, positions), positions_out)
+        if document_frequencies is not None:
+            document_frequencies[token] += len(postings)
+        if lexicon is not None:
+            lexicon.append((token, len(postings)))
@@ -0,0 +1,143 @@
+import hashlib
+from array import array
+from urllib.parse import urldefrag, urljoin
+import numpy as np
+
+
+def url_digest(url: str) -> int:
+    """
+    Hash a URL, so links are stored as 8-byte integers instead of strings.
+    Args:
+        url: Absolute URL without fragment
+    Returns:
+        int: 64-bit digest
+    """
+    digest = hashlib.blake2b(url.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def extract_links(soup, base_url: str) -> list:
+    """
+    Find the pages a page links to.
+    Args:
+        soup: BeautifulSoup object of the page
+        base_url: URL of the page, relative links are resolved against it
+    Returns:
+        list: Absolute http(s) URLs without fragment of the linked pages, once each and
+            without the page itself
+    """
+    links = {}
+    for anchor in soup.find_all('a', href=True):
+        try:
+            url = urldefrag(urljoin(base_url, anchor['href'].strip()))[0]
+        except ValueError:
+            # Malformed URLs, such as invalid IPv6 hosts
+            continue
+        if url.startswith(('http://', 'https://')) and url != base_url:
+            links[url] = None
+    return list(links)
+
+
+def pagerank(indptr: np.ndarray, indices: np.ndarray, damping: float = 0.85, tolerance: float = 1e-6,
+             max_iterations: int = 100) -> np.ndarray:
+    """
+    Compute the PageRank of every node of a graph by power iteration, each iteration being a
+    sparse product over the edge arrays. The rank of pages without links is spread over all pages.
+    Args:
+        indptr: CSR row pointers, the links of node i are indices[indptr[i]:indptr[i + 1]]
+        indices: Target node of each link
+        damping: Probability of following a link rather than jumping to a random page
+        tolerance: The iterations stop once the ranks change by less than this in total
+        max_iterations: Maximum number of iterations
+    Returns:
+        np.ndarray: PageRank of each node, summing to 1
+    """
+    num_nodes = len(indptr) - 1
+    if num_nodes == 0:
+        return np.zeros(0)
+    out_degree = np.diff(indptr)
+    sources = np.repeat(np.arange(num_nodes), out_degree)
+    dangling = out_degree == 0
+    rank = np.full(num_nodes, 1.0 / num_nodes)
+    for _ in range(max_iterations):
+        shares = np.divide(rank, out_degree, out=np.zeros(num_nodes), where=~dangling)
+        new_rank = np.bincount(indices, weights=shares[sources], minlength=num_nodes)
+        new_rank = damping * (new_rank + rank[dangling].sum() / num_nodes) + (1 - damping) / num_nodes
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tolerance:
+            break
+    return rank
+
+
+class LinkGraph:
+    """
+    The links between the documents of an index build. Links are collected as parallel arrays
+    of source document IDs and target URL digests, 12 bytes a link, since their targets may not
+    be read yet, and only resolved to document IDs into a CSR graph once every document has one.
+    """
+    def __init__(self, sources: array = None, targets: array = None):
+        """
+        Initialize the graph.
+        Args:
+            sources: Optional array('I') of the document ID of each link, such as those of
+                an interrupted build
+            targets: Optional array('Q') of the URL digest of each link
+        """
+        self.sources = sources if sources is not None else array('I')
+        self.targets = targets if targets is not None else array('Q')
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def add(self, doc_id: int, targets: array):
+        """
+        Add the links of a document.
+        Args:
+            doc_id: ID of the document
+            targets: array('Q') of the URL digests of the linked pages
+        """
+        self.sources.extend(array('I', [doc_id]) * len(targets))
+        self.targets.extend(targets)
+
+    def to_csr(self, url_to_id: dict, start_id: int, num_nodes: int) -> tuple:
+        """
+        Build the CSR graph of the links between indexed documents. Links to pages outside the
+        index and links of a document to itself are dropped.
+        Args:
+            url_to_id: Dictionary mapping the URLs of the documents to their IDs
+            start_id: First document ID, node i is document start_id + i
+            num_nodes: Number of document IDs
+        Returns:
+            Tuple of the row pointers and the target nodes, as NumPy arrays
+        """
+        digests = np.fromiter(map(url_digest, url_to_id), dtype=np.uint64, count=len(url_to_id))
+        nodes = np.fromiter(url_to_id.values(), dtype=np.int64, count=len(url_to_id)) - start_id
+        order = np.argsort(digests)
+        digests, nodes = digests[order], nodes[order]
+
+        sources = np.frombuffer(self.sources, dtype=np.uint32).astype(np.int64) - start_id
+        targets = np.frombuffer(self.targets, dtype=np.uint64)
+        found = np.minimum(np.searchsorted(digests, targets), max(len(digests) - 1, 0))
+        indexed = (digests[found] == targets) if len(digests) else np.zeros(len(targets), dtype=bool)
+        sources, targets = sources[indexed], nodes[found[indexed]]
+        kept = sources != targets
+        sources, targets = sources[kept], targets[kept]
+
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_nodes), out=indptr[1:])
+        return indptr, targets[order]
+
+    def static_scores(self, url_to_id: dict, start_id: int, num_nodes: int) -> np.ndarray:
+        """
+        Compute the query-independent quality score of every document from the links.
+        Args:
+            url_to_id: Dictionary mapping the URLs of the documents to their IDs
+            start_id: First document ID
+            num_nodes: Number of document IDs
+        Returns:
+            np.ndarray: PageRank of each document times the number of documents, so the average score is 1
+        """
+        indptr, indices = self.to_csr(url_to_id, start_id, num_nodes)
+        return pagerank(indptr, indices) * num_nodes
@@ -1,5 +1,10 @@
 #from file import FileOpener
+from .checkpoint import remove_checkpoint
 from .index import InvertedIndex
+from .pairs import build_pair_index
+from .report import IndexingProfiler
+from .spelling import build_spelling_index
+from .suggest import build_suggestions
 import os
 import sys
 
@@ -13,28 +18,76 @@ def generate_m1_report(path: str):
         - Number of indexed documents
         - Number of unique words
         - Total size of index on disk
+        and M1Report.json, the indexing report with the time of each stage (see report.py)
     """
-    index = InvertedIndex(path)
+    profiler = IndexingProfiler()
+    index = InvertedIndex(path, profiler=profiler)
     numDocuments = index.total_documents
     numUniqueTokens = index.unique_tokens()
+    report = profiler.write("M1Report.json", '.', numDocuments, options={'path': path})
 
     with open("M1Report.txt", 'w') as f:
         f.write(f"The number of indexed documents: {numDocuments}\n")
         f.write(f"The number of unique words: {numUniqueTokens}\n")
-        index_size = os.path.getsize("index.json") / 1024  # Convert bytes to KB
-        url_map_size = os.path.getsize("urls.json") / 1024  # Convert bytes to KB
-        total_size = index_size + url_map_size
+        # The postings, token positions and URL and file maps the search component reads
+        index_files = ('index.bin', 'token_positions.pkl', 'urls.json', 'files.json')
+        total_size = sum(report['files'].get(name, 0) for name in index_files) / 1024  # Convert bytes to KB
         f.write(f"The total size (in KB) of index on disk: {total_size:.2f}\n")
 
-def generate_index(path: str, sim_hash: int = 5):
+def generate_index(path, sim_hash: int = 5, index_dir: str = '.', num_shards: int = 1,
+                   store_positions: bool = False, query_log: str = None, store_snippets: bool = True,
+                   report_path: str = None, resume: bool = False, readers: int = None,
+                   exact_duplicates: bool = True, num_pairs: int = 0):
     """
     Generates an inverted index from the document collection, without creating a report.
     Args:
-        path : Path to the document collection
+        path : Path to the document collection, or list of paths to ZIPs, directories and glob patterns
+        sim_hash: Simhash distance threshold for near duplicates, 0 disables simhash
+        index_dir: Directory to write the index to
+        num_shards: Number of document-partitioned shards to build
+        store_positions: Whether to store token positions for phrase queries
+        query_log: Optional file of past queries, one per line, to suggest in autocomplete
+        store_snippets: Whether to store the text of the documents for search result snippets
+        report_path: Optional path of a JSON report of the run, with the wall and CPU time,
+            throughput and peak memory of each stage and statistics of the postings
+        resume: Whether to continue an interrupted build from its checkpoint in index_dir
+        readers: Number of processes reading the documents, defaults to the number of CPUs up to 4
+        exact_duplicates: Whether to drop documents with the same text as a document already read
+        num_pairs: Number of frequent term pairs whose intersected postings are precomputed,
+            chosen from query_log when given, 0 for no pair index
     Creates:
-        index.json, urls.json, and token_positions.json
+        index.bin, urls.json, files.json and token_positions.pkl, once per shard
+        (in shard_<n> directories) plus global_stats.pkl and the global lexicon.pkl when num_shards > 1,
+        and positions.bin and position_offsets.pkl with store_positions,
+        snippets.bin and snippet_offsets.pkl with store_snippets,
+        and suggest.bin for autocomplete and spelling.pkl for spelling corrections,
+        pairs.bin and pair_offsets.pkl with num_pairs.
+        sources.json maps the document ID ranges to the ZIPs and directories they were read from.
+        checkpoint.pkl holds the progress of the build until it finishes.
     """
-    InvertedIndex(path, sim_hash)
+    profiler = IndexingProfiler() if report_path is not None else None
+    index = InvertedIndex(path, sim_hash, index_dir, num_shards, store_positions=store_positions,
+                          store_snippets=store_snippets, profiler=profiler, checkpoint=True, resume=resume,
+                          readers=readers, exact_duplicates=exact_duplicates)
+    if profiler is None:
+        build_suggestions(index_dir, query_log)
+        build_spelling_index(index_dir)
+        build_pair_index(index_dir, query_log, num_pairs)
+        remove_checkpoint(index_dir)
+        return
+
+    with profiler.stage('suggestions'):
+        build_suggestions(index_dir, query_log)
+    with profiler.stage('spelling'):
+        build_spelling_index(index_dir)
+    with profiler.stage('pairs'):
+        build_pair_index(index_dir, query_log, num_pairs)
+    profiler.write(report_path, index_dir, index.total_documents,
+                   options={'path': path, 'sim_hash': sim_hash, 'num_shards': num_shards,
+                            'store_positions': store_positions, 'store_snippets': store_snippets,
+                            'exact_duplicates': exact_duplicates, 'num_pairs': num_pairs},
+                   duplicates=index.file_opener.duplicates)
+    remove_checkpoint(index_dir)
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
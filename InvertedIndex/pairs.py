@@ -0,0 +1,126 @@
+import glob
+import os
+import pickle
+import re
+from collections import Counter
+from itertools import combinations
+from .checkpoint import atomic_write
+from .suggest import load_term_frequencies
+
+PAIRS_NAME = 'pairs.bin'
+PAIR_OFFSETS_NAME = 'pair_offsets.pkl'
+# Number of the most searched pairs of a query log scored for each pair kept
+CANDIDATES_PER_PAIR = 4
+
+
+def pair_key(term_a: str, term_b: str) -> tuple:
+    """Get the key of a pair of terms, the same in both orders"""
+    return (term_a, term_b) if term_a <= term_b else (term_b, term_a)
+
+
+def query_pairs(query_log: str) -> Counter:
+    """
+    Count the pairs of distinct terms searched together in a query log.
+    Args:
+        query_log: File of past queries, one per line
+    Returns:
+        Counter: Number of queries containing each pair, keyed by pair_key
+    """
+    from nltk.stem import PorterStemmer
+    stemmer = PorterStemmer()
+    counts = Counter()
+    with open(query_log, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            # Wildcard terms match several terms, they can't be paired
+            terms = {stemmer.stem(token) for token in re.findall(r'[A-Za-z0-9]+\*?', line.lower())
+                     if not token.endswith('*')}
+            counts.update(combinations(sorted(terms), 2))
+    return counts
+
+
+def _read_postings(directory: str, terms) -> dict:
+    """Read the postings of some terms from the index in a directory, empty for missing terms"""
+    with open(os.path.join(directory, 'token_positions.pkl'), 'rb') as f:
+        offsets = pickle.load(f)
+    postings = {term: [] for term in terms}
+    with open(os.path.join(directory, 'index.bin'), 'rb') as f:
+        for term in sorted((term for term in terms if term in offsets), key=offsets.__getitem__):
+            f.seek(offsets[term])
+            postings[term] = pickle.load(f)[1]
+    return postings
+
+
+def build_pair_index(index_dir: str = '.', query_log: str = None, num_pairs: int = 1000,
+                     candidate_terms: int = 64) -> int:
+    """
+    Build the pair index of an index: the postings of frequent term pairs, intersected ahead of
+    time, so a query containing both terms reads the documents holding both in one small postings
+    list instead of intersecting two long ones.
+
+    Pairs are kept by their popularity times the postings they save, the postings of both terms
+    minus those of their intersection. Their popularity is the number of queries searching both
+    terms of a query log, or without one, the number of documents holding both terms among the
+    pairs of the candidate_terms most frequent terms.
+    Args:
+        index_dir: Directory of the index, pairs.bin and pair_offsets.pkl are written to it,
+            or to each of its shards
+        query_log: Optional file of past queries, one per line
+        num_pairs: Number of pairs to keep, 0 removes the pair index
+        candidate_terms: Number of the most frequent terms paired without a query log
+    Returns:
+        int: Number of pairs in the pair index
+    """
+    if os.path.exists(os.path.join(index_dir, 'segments.json')):
+        print("Pair postings aren't built for incremental indexes.")
+        return 0
+    directories = sorted(glob.glob(os.path.join(index_dir, 'shard_*'))) or [index_dir]
+    if num_pairs <= 0:
+        # The pairs of a previous build would not match the new postings
+        for directory in directories:
+            for name in (PAIRS_NAME, PAIR_OFFSETS_NAME):
+                if os.path.exists(os.path.join(directory, name)):
+                    os.remove(os.path.join(directory, name))
+        return 0
+    frequencies = load_term_frequencies(index_dir)
+
+    # Popularity of the candidate pairs, in past queries or in documents
+    if query_log is not None and os.path.exists(query_log):
+        candidates = Counter({pair: count for pair, count in query_pairs(query_log).items()
+                              if pair[0] in frequencies and pair[1] in frequencies})
+        candidates = dict(candidates.most_common(CANDIDATES_PER_PAIR * num_pairs))
+    else:
+        top_terms = sorted(frequencies, key=frequencies.get, reverse=True)[:candidate_terms]
+        candidates = {pair: None for pair in combinations(sorted(top_terms), 2)}
+
+    # Number of documents holding both terms and postings saved by reading the pair instead of
+    # both terms: pairs whose terms nearly always occur together save little
+    together = Counter()
+    saved = Counter()
+    for directory in directories:
+        documents = {term: {posting['doc_id'] for posting in postings} for term, postings in
+                     _read_postings(directory, {term for pair in candidates for term in pair}).items()}
+        for term_a, term_b in candidates:
+            both = len(documents[term_a] & documents[term_b])
+            together[term_a, term_b] += both
+            saved[term_a, term_b] += len(documents[term_a]) + len(documents[term_b]) - 2 * both
+    scores = Counter({pair: (count or together[pair]) * saved[pair] for pair, count in candidates.items()})
+    pairs = sorted(pair for pair, score in scores.most_common(num_pairs) if score > 0)
+
+    for directory in directories:
+        postings = _read_postings(directory, {term for pair in pairs for term in pair})
+        offsets = {}
+        with atomic_write(os.path.join(directory, PAIRS_NAME)) as f:
+            for term_a, term_b in pairs:
+                both = ({posting['doc_id'] for posting in postings[term_a]}
+                        & {posting['doc_id'] for posting in postings[term_b]})
+                offsets[term_a, term_b] = f.tell()
+                # The postings of both terms in the documents holding both, in their index order
+                pickle.dump(((term_a, term_b),
+                             {term: [posting for posting in postings[term] if posting['doc_id'] in both]
+                              for term in (term_a, term_b)}), f)
+        with atomic_write(os.path.join(directory, PAIR_OFFSETS_NAME)) as f:
+            # The document frequencies of the paired terms spare queries using the pairs
+            # from reading the full postings to get them
+            pickle.dump({'offsets': offsets,
+                         'document_frequencies': {term: len(term_postings) for term, term_postings in postings.items()}}, f)
+    return len(pairs)
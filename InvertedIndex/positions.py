@@ -0,0 +1,44 @@
+def encode_positions(positions) -> bytes:
+    """
+    Encode the sorted token positions of a term in a document as delta-encoded varints.
+    Each gap to the previous position is written 7 bits at a time, with the high bit
+    set on every byte but the last.
+    Args:
+        positions: Sorted list of token positions
+    Returns:
+        bytes: The encoded positions
+    """
+    encoded = bytearray()
+    previous = 0
+    for position in positions:
+        gap = position - previous
+        previous = position
+        while gap >= 0x80:
+            encoded.append((gap & 0x7F) | 0x80)
+            gap >>= 7
+        encoded.append(gap)
+    return bytes(encoded)
+
+
+def decode_positions(data: bytes) -> list:
+    """
+    Decode token positions encoded by encode_positions.
+    Args:
+        data: The encoded positions
+    Returns:
+        list: Sorted list of token positions
+    """
+    positions = []
+    position = 0
+    gap = 0
+    shift = 0
+    for byte in data:
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            position += gap
+            positions.append(position)
+            gap = 0
+            shift = 0
+    return positions
@@ -0,0 +1,219 @@
+import heapq
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from .suggest import load_term_frequencies
+from .timing import NULL_STAGE, StageTimer
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module, peak memory is left out of the report
+    resource = None
+
+# Stages of an indexing run, in the order they run
+STAGES = ('zip_read', 'dedup', 'simhash', 'html_parse', 'tokenize', 'partial_write', 'merge', 'suggestions', 'spelling',
+          'pairs')
+# Stages run by the tokenizing worker processes, their times are summed over the workers
+WORKER_STAGES = ('simhash', 'html_parse', 'tokenize')
+
+
+def peak_rss(who=None):
+    """
+    Get the peak resident set size of this process, or of its largest waited-for child process.
+    Args:
+        who: resource.RUSAGE_SELF (the default) or resource.RUSAGE_CHILDREN
+    Returns:
+        int: Peak RSS in bytes, or None where the resource module isn't available
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def clock():
+    """Get the wall clock and CPU time of this process, in seconds"""
+    return time.perf_counter(), time.process_time()
+
+
+class IndexingProfiler:
+    """
+    Records the wall and CPU time, throughput and peak memory of each stage of an indexing run,
+    and writes them with statistics of the finished index as a JSON report.
+
+    Stages nest: time spent in a stage running inside another (duplicate checks while reading the ZIP)
+    only counts for the inner stage.
+    """
+    def __init__(self):
+        """Start an empty report"""
+        self.started = datetime.now(timezone.utc)
+        self.start_wall, self.start_cpu = clock()
+        self.stages = {}
+        self.timer = StageTimer(clock, self._record)
+        # Process IDs and peak RSS of the tokenizing worker processes
+        self.worker_pids = set()
+        self.worker_peak_rss = {}
+
+    def _stage_stats(self, name):
+        """Get the accumulated statistics of a stage"""
+        return self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'documents': 0, 'bytes': 0})
+
+    def stage(self, name):
+        """
+        Time a stage of the run.
+        Args:
+            name: Name of the stage, one of STAGES
+        Returns:
+            Context manager timing the code it wraps
+        """
+        return self.timer.stage(name)
+
+    def add_time(self, name, wall_seconds, cpu_seconds):
+        """Add time measured elsewhere to a stage, taking it out of the running stage"""
+        self.timer.add_time(name, (wall_seconds, cpu_seconds))
+
+    def _record(self, name, times):
+        """Add the exclusive wall and CPU time of a stage measured by the stage timer"""
+        stats = self._stage_stats(name)
+        stats['wall_seconds'] += times[0]
+        stats['cpu_seconds'] += times[1]
+
+    def count(self, name, documents=0, num_bytes=0):
+        """Add to the number of documents and bytes processed by a stage"""
+        stats = self._stage_stats(name)
+        stats['documents'] += documents
+        stats['bytes'] += num_bytes
+
+    def add_worker_timings(self, timings):
+        """
+        Add the stage times measured by a tokenizing worker (see tokenize_chunk).
+        Args:
+            timings: Dictionary mapping stage names to (wall seconds, CPU seconds, documents, bytes),
+                plus the process ID 'pid' and peak RSS 'peak_rss' of the worker
+        """
+        for name in WORKER_STAGES:
+            if name in timings:
+                wall_seconds, cpu_seconds, documents, num_bytes = timings[name]
+                stats = self._stage_stats(name)
+                stats['wall_seconds'] += wall_seconds
+                stats['cpu_seconds'] += cpu_seconds
+                self.count(name, documents, num_bytes)
+        self.worker_pids.add(timings['pid'])
+        if timings.get('peak_rss') is not None:
+            self.worker_peak_rss[timings['pid']] = max(self.worker_peak_rss.get(timings['pid'], 0),
+                                                       timings['peak_rss'])
+
+    def stage_report(self):
+        """Get the statistics of every stage, with their throughput"""
+        report = {}
+        for name in STAGES:
+            if name not in self.stages:
+                continue
+            stats = dict(self.stages[name])
+            wall_seconds = stats['wall_seconds']
+            stats['docs_per_sec'] = stats['documents'] / wall_seconds if wall_seconds and stats['documents'] else None
+            stats['bytes_per_sec'] = stats['bytes'] / wall_seconds if wall_seconds and stats['bytes'] else None
+            if name in WORKER_STAGES:
+                # Summed over the workers, so the throughput is per worker process
+                stats['processes'] = len(self.worker_pids)
+            report[name] = stats
+        return report
+
+    def write(self, path, index_dir, num_documents, top_terms=50, options=None, duplicates=None):
+        """
+        Write the report of the run as JSON.
+        Args:
+            path: Path of the report
+            index_dir: Directory of the built index
+            num_documents: Number of indexed documents
+            top_terms: Number of most frequent terms to list
+            options: Optional dictionary of the options of the run
+            duplicates: Optional dictionary of the number of documents dropped as duplicates, by kind
+        Returns:
+            dict: The report
+        """
+        wall, cpu = clock()
+        worker_peaks = list(self.worker_peak_rss.values())
+        report = {
+            'started': self.started.isoformat(),
+            'index_dir': os.path.abspath(index_dir),
+            'options': options or {},
+            'documents': num_documents,
+            'wall_seconds': wall - self.start_wall,
+            'cpu_seconds': cpu - self.start_cpu,
+            'docs_per_sec': num_documents / (wall - self.start_wall) if wall > self.start_wall else None,
+            'duplicates_dropped': duplicates or {},
+            'stages': self.stage_report(),
+            'peak_rss_bytes': {
+                'main': peak_rss(),
+                'workers': {str(pid): rss for pid, rss in self.worker_peak_rss.items()},
+                'max_worker': max(worker_peaks) if worker_peaks else None,
+            },
+            'postings': postings_statistics(index_dir, top_terms),
+            'files': index_file_sizes(index_dir),
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+class _NullProfiler:
+    """Profiler used when no report is requested, which records nothing"""
+    def stage(self, name):
+        return NULL_STAGE
+
+    def count(self, name, documents=0, num_bytes=0):
+        pass
+
+    def add_worker_timings(self, timings):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def postings_statistics(index_dir, top_terms=50):
+    """
+    Describe the sizes of the postings lists of an index.
+    Args:
+        index_dir: Directory of the index
+        top_terms: Number of most frequent terms to list
+    Returns:
+        dict: Number of terms and postings, document frequency percentiles, a histogram of
+            document frequencies in powers of two, and the most frequent terms
+    """
+    frequencies = load_term_frequencies(index_dir)
+    if not frequencies:
+        return {'terms': 0, 'postings': 0}
+    dfs = sorted(frequencies.values())
+    histogram = {}
+    for df in dfs:
+        low = 1 << (df.bit_length() - 1)
+        bucket = str(low) if low == 1 else f"{low}-{2 * low - 1}"
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+    return {
+        'terms': len(dfs),
+        'postings': sum(dfs),
+        'document_frequency_percentiles': {f"p{p}": dfs[min(len(dfs) - 1, len(dfs) * p // 100)]
+                                           for p in (50, 90, 99, 100)},
+        'document_frequency_histogram': histogram,
+        'top_terms': heapq.nlargest(top_terms, frequencies.items(), key=lambda item: item[1]),
+    }
+
+
+def index_file_sizes(index_dir):
+    """Get the size in bytes of every file of an index, including those of its shards and segments"""
+    sizes = {}
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if os.path.isfile(path):
+            sizes[name] = os.path.getsize(path)
+        elif name.startswith('shard_') or name == 'segments':
+            for root, _, files in os.walk(path):
+                for file_name in files:
+                    file_path = os.path.join(root, file_name)
+                    sizes[os.path.relpath(file_path, index_dir)] = os.path.getsize(file_path)
+    return dict(sorted(sizes.items()))
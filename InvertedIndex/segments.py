@@ -0,0 +1,302 @@
+import json
+import math
+import os
+import shutil
+import threading
+from urllib.parse import urldefrag
+from .index import InvertedIndex
+from .index_manager import IndexManager
+from .document_metadata import DocumentMetadata, write_document_metadata
+
+MANIFEST_NAME = 'segments.json'
+
+
+class SegmentManager:
+    """
+    Manages an incrementally built index made of immutable segments.
+
+    Every ZIP added to the index becomes a new segment with its own document ID range.
+    Deleted or updated URLs are marked with tombstones instead of rewriting segments,
+    and a tiered merge policy compacts small segments into larger ones. The list of
+    live segments and their tombstones is kept in segments.json, which is replaced
+    atomically on every change so readers always see a consistent index.
+    """
+    def __init__(self, index_dir: str = '.', merge_factor: int = 10, floor_segment_size: int = 1000,
+                 max_deleted_ratio: float = 0.5):
+        """
+        Initialize the segment manager, loading the manifest if the index already exists.
+        Args:
+            index_dir: Directory of the segmented index
+            merge_factor: Number of adjacent segments of the same tier merged together
+            floor_segment_size: Segments smaller than this many documents are all in the lowest tier
+            max_deleted_ratio: Segments with a larger fraction of deleted documents are rewritten
+        """
+        self.index_dir = index_dir
+        self.merge_factor = merge_factor
+        self.floor_segment_size = floor_segment_size
+        self.max_deleted_ratio = max_deleted_ratio
+        # Guards the manifest, held only while reading or committing it
+        self.lock = threading.Lock()
+        # Only one segment may be added, and one merge run, at a time
+        self.add_lock = threading.Lock()
+        self.merge_lock = threading.Lock()
+
+        os.makedirs(os.path.join(index_dir, 'segments'), exist_ok=True)
+        manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'generation': 0, 'next_doc_id': 0, 'next_segment': 0,
+                             'segments': [], 'tombstones': {}, 'retired': []}
+
+    def segment_dir(self, name: str) -> str:
+        """Get the directory holding the files of a segment"""
+        return os.path.join(self.index_dir, 'segments', name)
+
+    def _new_segment_name(self) -> str:
+        """Reserve a name for a new segment, must be called while holding the lock"""
+        name = f"seg_{self.manifest['next_segment']:06d}"
+        self.manifest['next_segment'] += 1
+        return name
+
+    def _commit(self, retired=()):
+        """
+        Atomically write the manifest, must be called while holding the lock.
+        Segments retired by the previous commit are deleted now, so readers that opened
+        the previous generation had a full commit to move on before their files disappear.
+        Args:
+            retired: Names of the segments this commit stops referencing
+        """
+        for name in self.manifest['retired']:
+            shutil.rmtree(self.segment_dir(name), ignore_errors=True)
+        self.manifest['retired'] = list(retired)
+        self.manifest['generation'] += 1
+
+        manifest_path = os.path.join(self.index_dir, MANIFEST_NAME)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def _load_map(self, name: str, file_name: str) -> dict:
+        """Load the URL or file mapping of a segment"""
+        with open(os.path.join(self.segment_dir(name), file_name), 'r') as f:
+            return {int(k): v for k, v in json.load(f).items()}
+
+    def _live_urls(self) -> dict:
+        """
+        Map the URL of every live document to its ID, must be called while holding the lock.
+        Returns:
+            dict: Dictionary mapping URLs to (segment name, document ID)
+        """
+        live_urls = {}
+        for segment in self.manifest['segments']:
+            deleted = set(self.manifest['tombstones'].get(segment['name'], []))
+            for doc_id, url in self._load_map(segment['name'], 'urls.json').items():
+                if doc_id not in deleted:
+                    live_urls[url] = (segment['name'], doc_id)
+        return live_urls
+
+    def _tombstone(self, segment_name: str, doc_id: int):
+        """Mark a document as deleted, must be called while holding the lock"""
+        self.manifest['tombstones'].setdefault(segment_name, []).append(doc_id)
+
+    def add_segment(self, zip_path, simhash_threshold: int = 0, store_positions: bool = False,
+                    store_snippets: bool = False, readers: int = None):
+        """
+        Index a ZIP into a new segment. Documents whose URL is already in the index
+        replace the old version, which is tombstoned.
+        Args:
+            zip_path: Path to the ZIP of documents to index, or list of ZIPs, directories and glob patterns
+            simhash_threshold: Maximum simhash distance of near duplicates, 0 disables simhash
+            store_positions: Whether to store token positions for phrase queries
+            store_snippets: Whether to store the text of the documents for search result snippets
+            readers: Number of processes reading the documents, defaults to the number of CPUs up to 4
+        Returns:
+            Name of the new segment, or None if the ZIP held no documents
+        """
+        with self.add_lock:
+            with self.lock:
+                name = self._new_segment_name()
+                base_doc_id = self.manifest['next_doc_id']
+
+            # Build the segment under a temporary name so a crash never leaves a half-written segment
+            build_dir = self.segment_dir(name) + '.tmp'
+            shutil.rmtree(build_dir, ignore_errors=True)
+            index = InvertedIndex(zip_path, simhash_threshold, build_dir, start_doc_id=base_doc_id,
+                                  store_positions=store_positions, store_snippets=store_snippets,
+                                  readers=readers)
+            end_doc_id = index.file_opener.index_manager.current_url_id
+            if end_doc_id == base_doc_id:
+                shutil.rmtree(build_dir, ignore_errors=True)
+                return None
+            os.rename(build_dir, self.segment_dir(name))
+
+            with self.lock:
+                live_urls = self._live_urls()
+                for url in self._load_map(name, 'urls.json').values():
+                    if url in live_urls:
+                        self._tombstone(*live_urls[url])
+                self.manifest['segments'].append({
+                    'name': name,
+                    'base_doc_id': base_doc_id,
+                    'end_doc_id': end_doc_id,
+                    'doc_count': end_doc_id - base_doc_id,
+                    'sources': index.file_opener.source_ranges(base_doc_id),
+                })
+                self.manifest['next_doc_id'] = end_doc_id
+                self._commit()
+            return name
+
+    def delete_urls(self, urls) -> int:
+        """
+        Delete documents from the index by URL.
+        Args:
+            urls: URLs of the documents to delete
+        Returns:
+            int: Number of documents deleted
+        """
+        with self.lock:
+            live_urls = self._live_urls()
+            deleted = 0
+            for url in urls:
+                live = live_urls.pop(urldefrag(url)[0], None)
+                if live is not None:
+                    self._tombstone(*live)
+                    deleted += 1
+            if deleted:
+                self._commit()
+            return deleted
+
+    def _tier(self, live_count: int) -> int:
+        """Get the size tier of a segment, each tier holds segments merge_factor times larger"""
+        return int(math.log(max(live_count, self.floor_segment_size) / self.floor_segment_size,
+                            self.merge_factor))
+
+    def find_merge(self):
+        """
+        Apply the tiered merge policy, must be called while holding the lock.
+        Picks merge_factor adjacent segments of the same tier, so merged segments keep a
+        contiguous document ID range, or else a segment with too many deleted documents.
+        Returns:
+            List of segment entries to merge together, or None if no merge is needed
+        """
+        segments = self.manifest['segments']
+        live_counts = [segment['doc_count'] - len(self.manifest['tombstones'].get(segment['name'], []))
+                       for segment in segments]
+        tiers = [self._tier(live_count) for live_count in live_counts]
+        for i in range(len(segments) - self.merge_factor + 1):
+            if len(set(tiers[i:i + self.merge_factor])) == 1:
+                return segments[i:i + self.merge_factor]
+
+        for segment, live_count in zip(segments, live_counts):
+            if segment['doc_count'] and 1 - live_count / segment['doc_count'] > self.max_deleted_ratio:
+                return [segment]
+        return None
+
+    def merge_segments(self, segments):
+        """
+        Merge segments into one new segment, dropping their deleted documents.
+        Documents deleted while the merge runs are carried over as tombstones of the new segment.
+        Args:
+            segments: Adjacent segment entries to merge, in document ID order
+        Returns:
+            Name of the new segment, or None if all documents were deleted and the segments dropped
+        """
+        names = [segment['name'] for segment in segments]
+        with self.lock:
+            deleted = {n: set(self.manifest['tombstones'].get(n, [])) for n in names}
+            all_deleted = set().union(*deleted.values())
+            if len(all_deleted) == sum(segment['doc_count'] for segment in segments):
+                for n in names:
+                    self.manifest['tombstones'].pop(n, None)
+                self.manifest['segments'] = [segment for segment in self.manifest['segments']
+                                             if segment['name'] not in names]
+                self._commit(retired=names)
+                return None
+            name = self._new_segment_name()
+
+        build_dir = self.segment_dir(name) + '.tmp'
+        shutil.rmtree(build_dir, ignore_errors=True)
+        os.makedirs(build_dir)
+        # Positions are kept only if every merged segment has them
+        positions_files = [os.path.join(self.segment_dir(n), 'positions.bin') for n in names]
+        if not all(os.path.exists(fname) for fname in positions_files):
+            positions_files = None
+        # Document metadata is kept only if every merged segment has it
+        metadata = [DocumentMetadata.open(self.segment_dir(n)) for n in names]
+        documents = {}
+        for segment_metadata in metadata:
+            if segment_metadata is not None:
+                documents.update((doc_id, document) for doc_id, *document in segment_metadata.documents()
+                                 if doc_id not in all_deleted)
+                segment_metadata.close()
+        has_metadata = all(segment_metadata is not None for segment_metadata in metadata)
+        # The postings stay ordered by static score when the segments have static scores
+        static_score = None
+        if has_metadata and any(document[4] for document in documents.values()):
+            static_score = lambda doc_id: documents[doc_id][4]
+        IndexManager().merge_index_files([os.path.join(self.segment_dir(n), 'index.bin') for n in names],
+                                         build_dir, keep_doc=lambda doc_id: doc_id not in all_deleted,
+                                         positions_files=positions_files, static_score=static_score)
+        # Snippets are kept only if every merged segment has them
+        if all(os.path.exists(os.path.join(self.segment_dir(n), 'snippet_offsets.pkl')) for n in names):
+            IndexManager().copy_snippets([self.segment_dir(n) for n in names], build_dir,
+                                         keep_doc=lambda doc_id: doc_id not in all_deleted)
+        if has_metadata:
+            write_document_metadata(build_dir, documents, first_doc_id=segments[0]['base_doc_id'])
+        for file_name in ('urls.json', 'files.json'):
+            merged_map = {}
+            for n in names:
+                merged_map.update({str(doc_id): value for doc_id, value in self._load_map(n, file_name).items()
+                                   if doc_id not in all_deleted})
+            with open(os.path.join(build_dir, file_name), 'w') as f:
+                json.dump(merged_map, f)
+        os.rename(build_dir, self.segment_dir(name))
+
+        with self.lock:
+            tombstones = self.manifest['tombstones']
+            carried = []
+            for n in names:
+                carried.extend(set(tombstones.pop(n, [])) - deleted[n])
+            if carried:
+                tombstones[name] = carried
+
+            merged = {
+                'name': name,
+                'base_doc_id': segments[0]['base_doc_id'],
+                'end_doc_id': segments[-1]['end_doc_id'],
+                'doc_count': sum(segment['doc_count'] for segment in segments) - len(all_deleted),
+                'sources': [source for segment in segments for source in segment['sources']],
+            }
+            current = self.manifest['segments']
+            position = [segment['name'] for segment in current].index(names[0])
+            self.manifest['segments'] = current[:position] + [merged] + current[position + len(names):]
+            self._commit(retired=names)
+        return name
+
+    def maybe_merge(self) -> int:
+        """
+        Run merges chosen by the merge policy until none is needed.
+        Returns:
+            int: Number of merges run
+        """
+        merges = 0
+        with self.merge_lock:
+            while True:
+                with self.lock:
+                    segments = self.find_merge()
+                if segments is None:
+                    return merges
+                self.merge_segments(segments)
+                merges += 1
+
+    def merge_in_background(self) -> threading.Thread:
+        """
+        Run the merge policy in a background thread, the index stays searchable meanwhile.
+        Returns:
+            The started merge thread
+        """
+        thread = threading.Thread(target=self.maybe_merge, name="segment-merger", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,40 @@
+import pickle
+import re
+import zlib
+from array import array
+
+# Only the beginning of long documents is kept for snippets
+MAX_SNIPPET_TEXT = 20000
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def encode_snippet_record(text: str, token_offsets, stems) -> bytes:
+    """
+    Encode what query-biased snippets of a document need: its text, where its sentences
+    start, and where each of its stemmed tokens is, so a snippet can be cut without
+    parsing the HTML again.
+    Args:
+        text: Text of the document, with whitespace collapsed
+        token_offsets: Character offset of each token in the text
+        stems: Stem of each token
+    Returns:
+        bytes: The compressed record
+    """
+    text = text[:MAX_SNIPPET_TEXT]
+    kept = sum(1 for offset in token_offsets if offset < MAX_SNIPPET_TEXT)
+    sentence_starts = array('I', [0])
+    sentence_starts.extend(match.end() for match in SENTENCE_END.finditer(text))
+    record = (text, sentence_starts, array('I', token_offsets[:kept]), ' '.join(stems[:kept]))
+    return zlib.compress(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def decode_snippet_record(data: bytes) -> tuple:
+    """
+    Decode a record encoded by encode_snippet_record.
+    Args:
+        data: The compressed record
+    Returns:
+        tuple: The text, the sentence start offsets, the token offsets and the list of token stems
+    """
+    text, sentence_starts, token_offsets, stems = pickle.loads(zlib.decompress(data))
+    return text, sentence_starts, token_offsets, stems.split()
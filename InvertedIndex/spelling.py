@@ -0,0 +1,44 @@
+import os
+import pickle
+from array import array
+from .suggest import load_term_frequencies
+
+SPELLING_NAME = 'spelling.pkl'
+
+
+def trigrams(term: str) -> set:
+    """
+    Get the trigrams of a term, padded so its first and last characters get their own trigrams.
+    Args:
+        term: The term
+    Returns:
+        set: The distinct trigrams of the term
+    """
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_spelling_index(index_dir: str = '.') -> int:
+    """
+    Build the spelling index of an index: an inverted index from the trigrams of every
+    term of the vocabulary to the terms containing them. Its postings are split by term
+    length, so a lookup only reads the terms whose length is within the edit distance.
+    Args:
+        index_dir: Directory of the index, spelling.pkl is written to it
+    Returns:
+        int: Number of terms in the spelling index
+    """
+    frequencies = load_term_frequencies(index_dir)
+    terms = sorted(frequencies)
+    postings = {}
+    for term_id, term in enumerate(terms):
+        for gram in trigrams(term):
+            postings.setdefault((gram, len(term)), array('I')).append(term_id)
+
+    path = os.path.join(index_dir, SPELLING_NAME)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump({'terms': terms,
+                     'document_frequencies': array('I', (frequencies[term] for term in terms)),
+                     'trigrams': postings}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return len(terms)
@@ -0,0 +1,137 @@
+import json
+import os
+import pickle
+import re
+import struct
+import zlib
+from array import array
+from collections import Counter
+
+SUGGESTIONS_NAME = 'suggest.bin'
+MAGIC = b'SUGG'
+# Magic, version, completions per prefix, longest indexed prefix, number of slots, number of strings,
+# and the offsets of the string offsets, string data, slots and completion lists
+HEADER = struct.Struct('<4sIIIIIQQQQ')
+VERSION = 1
+# A slot holds the CRC32 of its prefix and the offset of its completion list, 0 when empty
+SLOT = struct.Struct('<II')
+
+
+def prefix_hash(prefix_bytes: bytes) -> int:
+    """Hash of a prefix used to find its slot, never 0 so empty slots stand out"""
+    return zlib.crc32(prefix_bytes) or 1
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase a query and collapse its whitespace, so the same query typed twice counts once"""
+    return ' '.join(re.findall(r'[A-Za-z0-9]+', query.lower()))
+
+
+def load_term_frequencies(index_dir: str) -> dict:
+    """
+    Load the document frequency of every term of the index in a directory: a single index,
+    a sharded index (from its global statistics) or a segmented index (summed over its segments).
+    Args:
+        index_dir: Directory of the index
+    Returns:
+        dict: Dictionary mapping terms to their document frequencies
+    """
+    global_stats_path = os.path.join(index_dir, 'global_stats.pkl')
+    if os.path.exists(global_stats_path):
+        with open(global_stats_path, 'rb') as f:
+            return dict(pickle.load(f)['document_frequencies'])
+
+    manifest_path = os.path.join(index_dir, 'segments.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        lexicon_dirs = [os.path.join(index_dir, 'segments', segment['name']) for segment in manifest['segments']]
+    else:
+        lexicon_dirs = [index_dir]
+
+    frequencies = Counter()
+    for directory in lexicon_dirs:
+        lexicon_path = os.path.join(directory, 'lexicon.pkl')
+        if not os.path.exists(lexicon_path):
+            continue
+        with open(lexicon_path, 'rb') as f:
+            lexicon = pickle.load(f)
+        for term, df in zip(lexicon['terms'], lexicon['document_frequencies']):
+            frequencies[term] += df
+    return dict(frequencies)
+
+
+def build_suggestions(index_dir: str = '.', query_log: str = None, k: int = 8, max_prefix_length: int = 12,
+                      min_df: int = 2) -> int:
+    """
+    Build the autocomplete file of an index from its term dictionary and a query log.
+
+    Every prefix, up to max_prefix_length characters, of the indexed terms and logged queries
+    gets its k best completions precomputed: logged queries by popularity first, then terms by
+    document frequency. Prefixes are stored in an open addressing hash table, so a lookup only
+    hashes the prefix and reads its completion list, without sorting anything.
+    Args:
+        index_dir: Directory of the index, suggest.bin is written to it
+        query_log: Optional file of past queries, one per line
+        k: Number of completions stored per prefix
+        max_prefix_length: Longest prefix with its own completions, longer prefixes filter those
+            of their first max_prefix_length characters
+        min_df: Terms in fewer documents are not suggested, which leaves out most typos and noise
+    Returns:
+        int: Number of suggestions
+    """
+    # Score of each suggestion: number of times it was searched, then document frequency
+    scores = {}
+    for term, df in load_term_frequencies(index_dir).items():
+        if df >= min_df and len(term) > 1:
+            scores[term] = (0, df)
+    if query_log is not None and os.path.exists(query_log):
+        with open(query_log, 'r', encoding='utf-8', errors='ignore') as f:
+            query_counts = Counter(normalize_query(line) for line in f)
+        query_counts.pop('', None)
+        for query, count in query_counts.items():
+            scores[query] = (count, scores.get(query, (0, 0))[1])
+
+    # Completions are added best first, so the first k reaching a prefix are its top k
+    strings = sorted(scores, key=lambda s: (scores[s][0], scores[s][1]), reverse=True)
+    completions = {}
+    for string_id, string in enumerate(strings):
+        for length in range(1, min(len(string), max_prefix_length) + 1):
+            node = completions.setdefault(string[:length], [])
+            if len(node) < k:
+                node.append(string_id)
+
+    # Completion lists: prefix length, number of completions, then their string IDs
+    lists = bytearray(b'\0')
+    num_slots = 1
+    while num_slots < 2 * len(completions):
+        num_slots *= 2
+    slots = array('I', bytes(SLOT.size * num_slots))
+    for prefix, string_ids in completions.items():
+        prefix_bytes = prefix.encode('utf-8')
+        slot = prefix_hash(prefix_bytes) % num_slots
+        while slots[2 * slot + 1]:
+            slot = (slot + 1) % num_slots
+        slots[2 * slot] = prefix_hash(prefix_bytes)
+        slots[2 * slot + 1] = len(lists)
+        lists += struct.pack(f'<BB{len(string_ids)}I', len(prefix), len(string_ids), *string_ids)
+
+    encoded = [string.encode('utf-8') for string in strings]
+    string_offsets = array('I', [0])
+    for string_bytes in encoded:
+        string_offsets.append(string_offsets[-1] + len(string_bytes))
+
+    path = os.path.join(index_dir, SUGGESTIONS_NAME)
+    with open(path + '.tmp', 'wb') as f:
+        offsets_start = HEADER.size
+        data_start = offsets_start + len(string_offsets) * 4
+        slots_start = data_start + string_offsets[-1]
+        lists_start = slots_start + len(slots) * 4
+        f.write(HEADER.pack(MAGIC, VERSION, k, max_prefix_length, num_slots, len(strings),
+                            offsets_start, data_start, slots_start, lists_start))
+        f.write(string_offsets.tobytes())
+        f.write(b''.join(encoded))
+        f.write(slots.tobytes())
+        f.write(lists)
+    os.replace(path + '.tmp', path)
+    return len(strings)
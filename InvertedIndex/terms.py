@@ -0,0 +1,56 @@
+from array import array
+
+
+class TermDictionary:
+    """
+    Numbers the terms of an index build in order of first appearance. Partial indexes store
+    these integer IDs instead of the terms, which are only written out by the merge.
+    """
+    def __init__(self, terms=()):
+        """
+        Initialize the dictionary.
+        Args:
+            terms: Optional terms to number first, such as those of an interrupted build
+        """
+        self.terms = []
+        self.term_ids = {}
+        # Rank of each term ID in sorted term order, computed by sort_ranks()
+        self._ranks = None
+        for term in terms:
+            self.get_id(term)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __getitem__(self, term_id: int) -> str:
+        return self.terms[term_id]
+
+    def get_id(self, term: str) -> int:
+        """Get or create the ID of a term"""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def ids(self, terms) -> array:
+        """
+        Map the terms of a dictionary local to a tokenizing worker to global IDs.
+        Args:
+            terms: Terms indexed by their local ID
+        Returns:
+            array: Global ID of each local ID
+        """
+        return array('I', map(self.get_id, terms))
+
+    def sort_ranks(self) -> array:
+        """
+        Get the position of every term in sorted order, so terms can be compared as integers.
+        Returns:
+            array: Rank of each term ID
+        """
+        if self._ranks is None or len(self._ranks) != len(self.terms):
+            self._ranks = array('I', [0]) * len(self.terms)
+            for rank, term_id in enumerate(sorted(range(len(self.terms)), key=self.terms.__getitem__)):
+                self._ranks[term_id] = rank
+        return self._ranks
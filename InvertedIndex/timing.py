@@ -0,0 +1,72 @@
+class StageTimer:
+    """
+    Times nested stages, for the indexing report and the query traces.
+
+    The time of a stage running inside another (duplicate checks while reading the ZIP, reading
+    postings during an intersection) only counts for the inner stage, so the stage times add up
+    to the time spent in timed code. Times are tuples with one value per clock, such as the wall
+    and CPU time.
+    """
+    def __init__(self, clock, record):
+        """
+        Args:
+            clock: Callable returning the tuple of the current reading of each clock
+            record: Callable taking the name of a stage and the tuple of its exclusive times,
+                run when the stage ends or add_time() is called
+        """
+        self.clock = clock
+        self.record = record
+        # Time of the inner stages of each running stage
+        self.inner = []
+
+    def stage(self, name: str):
+        """
+        Time a stage.
+        Args:
+            name: Name of the stage
+        Returns:
+            Context manager timing the code it wraps
+        """
+        return _TimedStage(self, name)
+
+    def add_time(self, name: str, times: tuple):
+        """Add times measured elsewhere to a stage, taking them out of the running stage"""
+        self.record(name, times)
+        self._add_inner(times)
+
+    def _add_inner(self, times: tuple):
+        """Add times to the inner stages of the running stage, if any"""
+        if self.inner:
+            self.inner[-1] = tuple(total + time for total, time in zip(self.inner[-1], times))
+
+
+class _TimedStage:
+    """Context manager timing one stage of a StageTimer"""
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.timer.clock()
+        self.timer.inner.append((0.0,) * len(self.start))
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = tuple(end - start for end, start in zip(self.timer.clock(), self.start))
+        inner = self.timer.inner.pop()
+        self.timer.record(self.name, tuple(time - inner_time for time, inner_time in zip(elapsed, inner)))
+        # The running stage excludes the whole stage, its inner stages included
+        self.timer._add_inner(elapsed)
+        return False
+
+
+class _NullStage:
+    """Stage of a trace or profiler that records nothing"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = _NullStage()
@@ -41,12 +41,24 @@ class ZipHandler:
         """
         try:
             with zipfolder.open(file_name) as file:
-                for line in file:
-                    try:
-                        json_data = json.loads(line.decode('utf-8'))
-                        if 'url' in json_data and 'content' in json_data:
-                            yield json_data['url'], json_data['content']
-                    except json.JSONDecodeError:
-                        print(f"Invalid JSON in file: {file_name}")
+                yield from ZipHandler.parse_json_lines(file, file_name)
         except Exception as e:
             print(f"Error reading {file_name}: {e}")
+
+    @staticmethod
+    def parse_json_lines(file, file_name: str) -> Iterator[Tuple[str, str]]:
+        """
+        Parse the pages of an opened JSON-lines file, yield url and content
+        Args:
+            file: Binary file object, a ZIP member or a file of a directory corpus
+            file_name (str): name of the file, for error messages
+        Yields:
+            Iterator[Tuple[str, str]]: A generator that yields tuples of URL and content from the file.
+        """
+        for line in file:
+            try:
+                json_data = json.loads(line.decode('utf-8'))
+                if 'url' in json_data and 'content' in json_data:
+                    yield json_data['url'], json_data['content']
+            except json.JSONDecodeError:
+                print(f"Invalid JSON in file: {file_name}")
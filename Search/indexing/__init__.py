@@ -1,4 +1,7 @@
 from .cache import LRUCache
 from .index_reader import IndexReader
+from .lexicon import Lexicon
+from .segment_reader import SegmentedIndexReader
+from .suggestions import SuggestionReader
 
-__all__ = ['LRUCache', 'IndexReader']
+__all__ = ['LRUCache', 'IndexReader', 'Lexicon', 'SegmentedIndexReader', 'SuggestionReader']
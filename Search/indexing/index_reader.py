@@ -1,18 +1,24 @@
 import json
 import pickle
 import os
-from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+import threading
 import warnings
-from bs4 import MarkupResemblesLocatorWarning
-import zipfile
+import time
+from InvertedIndex.corpus import load_sources, open_member
+from InvertedIndex.document_metadata import DocumentMetadata
+from InvertedIndex.pairs import PAIR_OFFSETS_NAME, PAIRS_NAME, pair_key
+from InvertedIndex.positions import decode_positions
 from .cache import LRUCache
+from .lexicon import LEXICON_NAME, Lexicon
+from ..metrics import NULL_TRACE, TracedFile, current_trace
 
 class IndexReader:
     """
     Handles disk-based index reading operations with O(1) token lookups.
     """
     def __init__(self, zip_path='zips/developer.zip', index_path='index.bin', urls_path='urls.json', 
-                 positions_path='token_positions.pkl', cache_size=100):
+                 positions_path='token_positions.pkl', cache_size=100, index_dir='.',
+                 files_path='files.json', global_stats_path=None, sources=None):
         """
         Initialize the index reader component.
         
@@ -21,26 +27,152 @@ class IndexReader:
             urls_path: Path to the URLs mapping JSON file
             positions_path: Path to the token positions pickle file
             cache_size: Number of terms to cache in memory
+            index_dir: Directory the other paths are relative to
+            files_path: Path to the file mapping JSON file
+            global_stats_path: Optional path to the global statistics of a sharded index.
+                When given, document frequencies, the document count and the average document
+                length are taken from the whole collection instead of this shard.
+            sources: Optional list of (start_doc_id, end_doc_id, zip_path) for indexes built
+                from several ZIPs or directories, such as merged segments. Defaults to the sources.json
+                written by the indexer, or zip_path for all documents without it.
         """
+        index_path = os.path.join(index_dir, index_path)
+        urls_path = os.path.join(index_dir, urls_path)
+        positions_path = os.path.join(index_dir, positions_path)
+        files_path = os.path.join(index_dir, files_path)
         self.index_path = index_path
         self.zip_path = zip_path
+        self.sources = sources if sources is not None else load_sources(index_dir)
         
         # Initialize term cache
         self.cache = LRUCache(cache_size)
         
-        # Load URL mappings - typically much smaller than the index
-        with open(urls_path, 'r') as f:
-            url_dict = json.load(f)
-            # Convert string keys to integers
-            self.urls = {int(k): v for k, v in url_dict.items()}
+        # Columnar document metadata, read through mmap instead of loading the URL and file maps
+        self.metadata = DocumentMetadata.open(index_dir)
+        self.urls = None
+        self.files = None
+        if self.metadata is None:
+            # Load URL mappings - typically much smaller than the index
+            with open(urls_path, 'r') as f:
+                url_dict = json.load(f)
+                # Convert string keys to integers
+                self.urls = {int(k): v for k, v in url_dict.items()}
 
-        # Load file mappings
-        with open('files.json', 'r') as f:
-            file_dict = json.load(f)
-            # Convert string keys to integers
-            self.files = {int(k): v for k, v in file_dict.items()}
+            # Load file mappings
+            with open(files_path, 'r') as f:
+                file_dict = json.load(f)
+                # Convert string keys to integers
+                self.files = {int(k): v for k, v in file_dict.items()}
             
-        # Load token positions for O(1) lookup
+        # The token positions and the position and snippet offsets are only loaded by load(),
+        # on their first use or ahead of it by preload_in_background(), so opening the index is instant
+        self.token_positions_path = positions_path
+        self.positions_path = os.path.join(index_dir, 'positions.bin')
+        self.position_offsets_path = os.path.join(index_dir, 'position_offsets.pkl')
+        self.snippets_path = os.path.join(index_dir, 'snippets.bin')
+        self.snippet_offsets_path = os.path.join(index_dir, 'snippet_offsets.pkl')
+        self.pairs_path = os.path.join(index_dir, PAIRS_NAME)
+        self.pair_offsets_path = os.path.join(index_dir, PAIR_OFFSETS_NAME)
+        self.loaded = False
+        self.load_lock = threading.Lock()
+        
+        # Average document length, computed by get_average_document_length()
+        self.average_length = None
+
+        # Total number of documents in the collection
+        self.total_documents = self.metadata.num_documents if self.metadata is not None else len(self.urls)
+
+        # Sorted lexicon for prefix queries, loaded on the first one
+        self.lexicon = Lexicon(os.path.join(index_dir, LEXICON_NAME), lambda: self.token_positions)
+
+        # Global statistics shared by the shards of a sharded index
+        self.document_frequencies = None
+        if global_stats_path is not None:
+            with open(global_stats_path, 'rb') as f:
+                global_stats = pickle.load(f)
+            self.total_documents = global_stats['total_documents']
+            self.document_frequencies = global_stats['document_frequencies']
+            # Global statistics written before the average length was added leave it to this shard
+            self.average_length = global_stats.get('average_length')
+
+    def load(self):
+        """
+        Load the token positions, and the position and snippet offsets of indexes that have them.
+        Safe to call from several threads, the structures are loaded once and other callers wait.
+        """
+        with self.load_lock:
+            if self.loaded:
+                return
+            self._token_positions = self._load_token_positions(self.token_positions_path)
+            # Offsets of each term's token positions, only present in positional indexes
+            self._position_offsets = None
+            if os.path.exists(self.position_offsets_path):
+                with open(self.position_offsets_path, 'rb') as f:
+                    self._position_offsets = pickle.load(f)
+            # Offsets of each document's snippet record, only present in indexes built with snippets
+            self._snippet_offsets = None
+            if os.path.exists(self.snippet_offsets_path):
+                with open(self.snippet_offsets_path, 'rb') as f:
+                    self._snippet_offsets = pickle.load(f)
+            # Offsets of each term pair's intersected postings, only present with a pair index
+            self._pair_offsets = None
+            self._pair_frequencies = {}
+            if os.path.exists(self.pair_offsets_path):
+                with open(self.pair_offsets_path, 'rb') as f:
+                    pair_index = pickle.load(f)
+                self._pair_offsets = pair_index['offsets']
+                self._pair_frequencies = pair_index['document_frequencies']
+            self.loaded = True
+
+    def preload_in_background(self):
+        """
+        Load the index structures in a background thread, so the first query doesn't wait for them.
+
+        Returns:
+            The started loading thread
+        """
+        thread = threading.Thread(target=self.load, name="index-preload", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def token_positions(self):
+        """Dictionary mapping tokens to the offset of their postings in the index file"""
+        if not self.loaded:
+            self.load()
+        return self._token_positions
+
+    @property
+    def position_offsets(self):
+        """Dictionary mapping tokens to the offset of their positions, None without positions"""
+        if not self.loaded:
+            self.load()
+        return self._position_offsets
+
+    @property
+    def snippet_offsets(self):
+        """Dictionary mapping document IDs to the offset of their snippet record, None without snippets"""
+        if not self.loaded:
+            self.load()
+        return self._snippet_offsets
+
+    @property
+    def pair_offsets(self):
+        """Dictionary mapping term pairs to the offset of their postings, None without a pair index"""
+        if not self.loaded:
+            self.load()
+        return self._pair_offsets
+
+    @property
+    def pair_frequencies(self):
+        """Dictionary mapping the terms of the pair index to their document frequency in this index"""
+        if not self.loaded:
+            self.load()
+        return self._pair_frequencies
+
+    def _load_token_positions(self, positions_path):
+        """Load the token positions for O(1) lookup, empty if they can't be read"""
+        token_positions = {}
         try:
             # Check if the file exists and its format
             if os.path.exists(positions_path):
@@ -50,8 +182,8 @@ class IndexReader:
                 # Try loading as pickle
                 try:
                     with open(positions_path, 'rb') as f:
-                        self.token_positions = pickle.load(f)
-                    print(f"Successfully loaded {len(self.token_positions)} token positions from pickle")
+                        token_positions = pickle.load(f)
+                    print(f"Successfully loaded {len(token_positions)} token positions from pickle")
                 except Exception as e:
                     print(f"Error loading pickle file: {e}")
                     
@@ -59,20 +191,15 @@ class IndexReader:
                     if os.path.exists('token_positions.json'):
                         print("Attempting to load token_positions.json as fallback")
                         with open('token_positions.json', 'r') as f:
-                            self.token_positions = json.load(f)
-                        print(f"Loaded {len(self.token_positions)} token positions from JSON")
+                            token_positions = json.load(f)
+                        print(f"Loaded {len(token_positions)} token positions from JSON")
                     else:
                         print("No fallback token positions file found")
-                        self.token_positions = {}
             else:
                 print(f"Warning: Token positions file {positions_path} not found.")
-                self.token_positions = {}
         except Exception as e:
             print(f"Error loading token positions: {e}")
-            self.token_positions = {}
-        
-        # Total number of documents in the collection
-        self.total_documents = len(self.urls)
+        return token_positions
     
     def get_postings_for_terms(self, terms):
         """
@@ -86,6 +213,7 @@ class IndexReader:
         """
         # Initialize results dictionary
         result = {}
+        trace = current_trace()
         
         # Check which terms are already in cache
         terms_to_fetch = []
@@ -93,6 +221,7 @@ class IndexReader:
             cached_postings = self.cache.get(term)
             if cached_postings is not None:
                 result[term] = cached_postings
+                trace.count('cache_hits')
             elif term in self.token_positions:  # Only add terms that exist in the index
                 terms_to_fetch.append(term)
             else:
@@ -100,12 +229,19 @@ class IndexReader:
         
         if not terms_to_fetch:
             return result
+        # Segment readers are uncached, the segmented reader counts their misses once
+        if self.cache.capacity > 0:
+            trace.count('cache_misses', len(terms_to_fetch))
         
         # Sort terms by their position in the file to minimize seeking
         terms_to_fetch.sort(key=lambda t: self.token_positions[t])
         
+        start = time.perf_counter()
+        f = None
         try:
-            with open(self.index_path, 'rb') as f:
+            with open(self.index_path, 'rb') as index_file:
+                # Reads are timed apart from unpickling when the query is traced
+                f = index_file if trace is NULL_TRACE else TracedFile(index_file, trace)
                 for term in terms_to_fetch:
                     position = self.token_positions[term]
                     f.seek(position)
@@ -132,6 +268,10 @@ class IndexReader:
                 if term not in result:
                     result[term] = []
         
+        if trace is not NULL_TRACE:
+            read_seconds = f.seconds if isinstance(f, TracedFile) else 0.0
+            trace.add_time('postings_io', read_seconds)
+            trace.add_time('decode', time.perf_counter() - start - read_seconds)
         return result
     
     def get_postings_for_term(self, term):
@@ -146,6 +286,137 @@ class IndexReader:
         """
         return self.get_postings_for_terms([term]).get(term, [])
     
+    def has_pair(self, term_a, term_b):
+        """
+        Check if the pair index holds the intersected postings of two terms.
+        
+        Args:
+            term_a: First term
+            term_b: Second term, in either order
+            
+        Returns:
+            Boolean indicating if get_pair_postings() can be used for the pair
+        """
+        return self.pair_offsets is not None and pair_key(term_a, term_b) in self.pair_offsets
+
+    def get_pair_postings(self, term_a, term_b):
+        """
+        Retrieve the postings of two terms in the documents containing both, with a single read
+        of the pair index instead of reading and intersecting the postings of both terms.
+        
+        Args:
+            term_a: First term
+            term_b: Second term, see has_pair()
+            
+        Returns:
+            Dictionary mapping both terms to their postings in the documents containing both,
+            in the order of their postings lists, or None if the pair isn't in the pair index
+        """
+        if not self.has_pair(term_a, term_b):
+            return None
+        key = pair_key(term_a, term_b)
+        trace = current_trace()
+        cached_postings = self.cache.get(('pair',) + key)
+        if cached_postings is not None:
+            trace.count('cache_hits')
+            return cached_postings
+        if self.cache.capacity > 0:
+            trace.count('cache_misses')
+
+        start = time.perf_counter()
+        f = None
+        postings = None
+        try:
+            with open(self.pairs_path, 'rb') as pairs_file:
+                f = pairs_file if trace is NULL_TRACE else TracedFile(pairs_file, trace)
+                f.seek(self.pair_offsets[key])
+                stored_key, pair_postings = pickle.load(f)
+                if stored_key == key:
+                    postings = pair_postings
+                    self.cache.put(('pair',) + key, postings)
+        except (IOError, pickle.PickleError, EOFError) as e:
+            print(f"Error reading pair {key}: {e}")
+
+        if trace is not NULL_TRACE:
+            read_seconds = f.seconds if isinstance(f, TracedFile) else 0.0
+            trace.add_time('postings_io', read_seconds)
+            trace.add_time('decode', time.perf_counter() - start - read_seconds)
+        return postings
+
+    def get_positions_for_terms(self, terms, doc_ids):
+        """
+        Retrieve the token positions of terms in some documents. Positions are stored apart
+        from the postings, so they are only read for the documents of a phrase query.
+        
+        Args:
+            terms: List of terms to retrieve positions for
+            doc_ids: Set of document IDs to decode positions for
+            
+        Returns:
+            Dictionary mapping terms to dictionaries mapping document IDs to their sorted
+            positions, or None if the index has no positions
+        """
+        if self.position_offsets is None:
+            return None
+        
+        unique_terms = set(terms)
+        all_postings = self.get_postings_for_terms(list(unique_terms))
+        result = {term: {} for term in unique_terms}
+        terms_to_fetch = sorted((term for term in unique_terms if term in self.position_offsets),
+                                key=lambda t: self.position_offsets[t])
+        
+        with open(self.positions_path, 'rb') as f:
+            for term in terms_to_fetch:
+                f.seek(self.position_offsets[term])
+                stored_term, encoded_positions = pickle.load(f)
+                if stored_term != term:
+                    continue
+                # Encoded positions are stored in the same order as the term's postings
+                for posting, encoded in zip(all_postings[term], encoded_positions):
+                    if posting['doc_id'] in doc_ids:
+                        result[term][posting['doc_id']] = decode_positions(encoded)
+        return result
+    
+    def get_snippet_records(self, doc_ids):
+        """
+        Retrieve the snippet records of some documents.
+        
+        Args:
+            doc_ids: List of document IDs
+            
+        Returns:
+            Dictionary mapping document IDs to their encoded snippet records, without the
+            documents that have none
+        """
+        if self.snippet_offsets is None:
+            return {}
+        records = {}
+        with open(self.snippets_path, 'rb') as f:
+            for doc_id in sorted((doc_id for doc_id in doc_ids if doc_id in self.snippet_offsets),
+                                 key=self.snippet_offsets.get):
+                f.seek(self.snippet_offsets[doc_id])
+                records[doc_id] = pickle.load(f)
+        return records
+
+    def _lexicon_frequency(self, term):
+        """Get the document frequency of a term from the lexicon, None without one"""
+        return self.lexicon.frequency(term)
+
+    def prefix_terms(self, prefix, max_terms):
+        """
+        Find the terms starting with a prefix by binary search in the sorted lexicon.
+        
+        Args:
+            prefix: Prefix of the terms
+            max_terms: Maximum number of terms to return, the most frequent are kept
+            
+        Returns:
+            List of (term, document frequency) tuples, most frequent first
+        """
+        # A shard ranks its expansions by their global frequencies, though its lexicon only holds
+        # its own terms. The coordinator expands wildcard terms once when it has the global lexicon
+        return self.lexicon.prefix_terms(prefix, max_terms, self.document_frequencies)
+
     def has_term(self, term):
         """
         Check if a term exists in the index using O(1) lookup.
@@ -173,6 +444,13 @@ class IndexReader:
         Returns:
             Document frequency of the term
         """
+        if self.document_frequencies is not None:
+            return self.document_frequencies.get(term, 0)
+        if term in self.pair_frequencies:
+            return self.pair_frequencies[term]
+        frequency = self._lexicon_frequency(term)
+        if frequency is not None:
+            return frequency
         postings = self.get_postings_for_term(term)
         return len(postings)
     
@@ -185,10 +463,20 @@ class IndexReader:
         Returns:
             Dictionary mapping terms to their document frequencies
         """
-        # Convert to set to remove duplicates before processing
-        unique_terms = set(query_terms)
-        postings_dict = self.get_postings_for_terms(list(unique_terms))
-        return {term: len(postings) for term, postings in postings_dict.items()}
+        with current_trace().stage('lexicon'):
+            # Convert to set to remove duplicates before processing
+            unique_terms = set(query_terms)
+            if self.document_frequencies is not None:
+                return {term: self.document_frequencies.get(term, 0) for term in unique_terms}
+            frequencies = {term: self.pair_frequencies[term] for term in unique_terms if term in self.pair_frequencies}
+            # The lexicon spares reading the postings, so the search can read them rarest first
+            for term in unique_terms - frequencies.keys():
+                frequency = self._lexicon_frequency(term)
+                if frequency is not None:
+                    frequencies[term] = frequency
+            postings_dict = self.get_postings_for_terms([term for term in unique_terms if term not in frequencies])
+            frequencies.update((term, len(postings)) for term, postings in postings_dict.items())
+            return frequencies
 
     def get_url(self, doc_id):
         """
@@ -200,8 +488,83 @@ class IndexReader:
         Returns:
             URL string for the document
         """
+        if self.metadata is not None:
+            return self.metadata.get_url(doc_id)
         return self.urls.get(doc_id, None)
+
+    def get_file(self, doc_id):
+        """
+        Get the name of the ZIP member a document was read from.
+        
+        Args:
+            doc_id: Document ID
+            
+        Returns:
+            File name of the document, or None for unknown documents
+        """
+        if self.metadata is not None:
+            return self.metadata.get_file(doc_id)
+        return self.files.get(doc_id)
+
+    def get_document_length(self, doc_id):
+        """
+        Get the number of tokens of a document.
+        
+        Args:
+            doc_id: Document ID
+            
+        Returns:
+            Number of tokens, or 0 if unknown
+        """
+        return self.metadata.get_length(doc_id) if self.metadata is not None else 0
+
+    def get_average_document_length(self):
+        """
+        Get the average number of tokens of the documents, computed once. A shard of a sharded
+        index uses the average of the whole collection, so its scores can be merged with the other shards'.
+        
+        Returns:
+            Average number of tokens, or 0 if the index doesn't record document lengths
+        """
+        if self.average_length is None:
+            self.average_length = 0.0
+            if self.metadata is not None and self.metadata.num_documents:
+                self.average_length = sum(self.metadata.lengths) / self.metadata.num_documents
+        return self.average_length
+
+    def get_static_score(self, doc_id):
+        """
+        Get the query-independent quality score of a document.
+        
+        Args:
+            doc_id: Document ID
+            
+        Returns:
+            Static score, or 0 if unknown
+        """
+        return self.metadata.get_static_score(doc_id) if self.metadata is not None else 0.0
+
+    def get_zip_path(self, doc_id):
+        """
+        Get the path of the ZIP or directory a document was indexed from.
+        
+        Args:
+            doc_id: Document ID
+            
+        Returns:
+            Path to the ZIP or directory holding the document
+        """
+        if self.sources is not None:
+            for start_doc_id, end_doc_id, zip_path in self.sources:
+                if start_doc_id <= doc_id < end_doc_id:
+                    return zip_path
+        return self.zip_path
     
+    def close(self):
+        """Release the memory-mapped document metadata"""
+        if self.metadata is not None:
+            self.metadata.close()
+
     def get_document_contents(self, doc_id):
         """
         Get the contents of a document by its ID.
@@ -212,18 +575,19 @@ class IndexReader:
         Returns:
             Document contents as a string
         """
-        file_name = self.files.get(int(doc_id))
+        file_name = self.get_file(int(doc_id))
         if file_name is None:
             return None
-        with zipfile.ZipFile(self.zip_path) as z:
-            with z.open(file_name) as f:
-                for line in f:
-                    try:
-                        json_data = json.loads(line.decode('utf-8'))
-                        if 'content' in json_data:
-                            content = json_data['content']
-                    except json.JSONDecodeError:
-                        print(f"Invalid JSON in file: {file_name}")
+        with open_member(self.get_zip_path(int(doc_id)), file_name) as f:
+            for line in f:
+                try:
+                    json_data = json.loads(line.decode('utf-8'))
+                    if 'content' in json_data:
+                        content = json_data['content']
+                except json.JSONDecodeError:
+                    print(f"Invalid JSON in file: {file_name}")
+        # The HTML parser is only imported by the summaries, not on every server start
+        from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning, XMLParsedAsHTMLWarning
         warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
         warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
         soup = BeautifulSoup(content, features='lxml')
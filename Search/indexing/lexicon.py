@@ -0,0 +1,106 @@
+import bisect
+import heapq
+import os
+import pickle
+
+LEXICON_NAME = 'lexicon.pkl'
+
+
+class Lexicon:
+    """
+    The sorted terms of an index and their document frequencies, from the lexicon.pkl written
+    by the indexer. The terms starting with a prefix are a range of it found by binary search,
+    and the document frequency of a term is found without reading its postings.
+    It is loaded on first use.
+    """
+    def __init__(self, path, fallback_terms=None):
+        """
+        Initialize the lexicon without loading it.
+
+        Args:
+            path: Path to lexicon.pkl
+            fallback_terms: Optional callable returning the terms of an index built without
+                a lexicon file, which then has no document frequencies
+        """
+        self.path = path
+        self.fallback_terms = fallback_terms
+        self.terms = None
+        self.frequencies = None
+
+    @classmethod
+    def open(cls, index_dir):
+        """
+        Open the lexicon of an index if it has one, such as the global lexicon of a sharded index.
+
+        Args:
+            index_dir: Directory of the index
+
+        Returns:
+            Lexicon, or None if the directory has no lexicon file
+        """
+        path = os.path.join(index_dir, LEXICON_NAME)
+        return cls(path) if os.path.exists(path) else None
+
+    def load(self):
+        """Load the lexicon file, or sort the fallback terms of indexes built without one"""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                lexicon = pickle.load(f)
+            # The frequencies are set first, other threads check the terms to know the lexicon is loaded
+            self.frequencies = lexicon['document_frequencies']
+            self.terms = lexicon['terms']
+        else:
+            self.terms = sorted(self.fallback_terms()) if self.fallback_terms is not None else []
+
+    def frequency(self, term):
+        """
+        Get the document frequency of a term by binary search.
+
+        Args:
+            term: The term to look up
+
+        Returns:
+            Document frequency of the term, 0 if it isn't in the lexicon, or None if the
+            lexicon has no frequencies
+        """
+        if self.terms is None:
+            self.load()
+        if self.frequencies is None:
+            return None
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return self.frequencies[i]
+        return 0
+
+    def prefix_terms(self, prefix, max_terms, frequencies=None):
+        """
+        Find the terms starting with a prefix.
+
+        Args:
+            prefix: Prefix of the terms
+            max_terms: Maximum number of terms to return, the most frequent are kept
+            frequencies: Optional dictionary of document frequencies to rank the terms by
+                instead of the lexicon's, such as the global frequencies of a shard
+
+        Returns:
+            List of (term, document frequency) tuples, most frequent first
+        """
+        if self.terms is None:
+            self.load()
+        terms = self.terms
+        # Every term with the prefix sorts between the prefix and the prefix followed by the largest character
+        start = bisect.bisect_left(terms, prefix)
+        end = bisect.bisect_left(terms, prefix + '\U0010ffff', start)
+
+        if frequencies is not None:
+            frequency = lambda i: frequencies.get(terms[i], 0)
+        elif self.frequencies is not None:
+            frequency = self.frequencies.__getitem__
+        else:
+            frequency = lambda i: 0
+
+        if end - start > max_terms:
+            matches = heapq.nlargest(max_terms, range(start, end), key=frequency)
+        else:
+            matches = sorted(range(start, end), key=frequency, reverse=True)
+        return [(terms[i], frequency(i)) for i in matches]
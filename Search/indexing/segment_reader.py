@@ -0,0 +1,253 @@
+import bisect
+import heapq
+import json
+import os
+import threading
+from .cache import LRUCache
+from .index_reader import IndexReader
+from ..metrics import current_trace
+
+MANIFEST_NAME = 'segments.json'
+
+
+class SegmentedIndexReader(IndexReader):
+    """
+    Reads an incrementally built index made of immutable segments (see InvertedIndex/segments.py).
+    Postings of all live segments are concatenated in segment order, each segment's in order of
+    decreasing static score, with tombstoned documents filtered out, so the rest of the search
+    component sees one index.
+    """
+    def __init__(self, index_dir='.', cache_size=100):
+        """
+        Open the segments listed in the manifest of a segmented index.
+
+        Args:
+            index_dir: Directory of the segmented index
+            cache_size: Number of terms to cache in memory
+        """
+        with open(os.path.join(index_dir, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+        self.generation = manifest['generation']
+        self.index_dir = index_dir
+        self.zip_path = None
+        self.sources = None
+        self.document_frequencies = None
+        self.cache = LRUCache(cache_size)
+
+        # Segments are ordered by their document ID range
+        self.segments = []
+        self.segment_bases = []
+        self.deleted = set()
+        for segment in manifest['segments']:
+            # The merged postings are cached here, segment readers don't need their own cache
+            reader = IndexReader(index_dir=os.path.join(index_dir, 'segments', segment['name']),
+                                 cache_size=0, sources=segment['sources'])
+            self.segments.append(reader)
+            self.segment_bases.append(segment['base_doc_id'])
+            self.deleted.update(manifest['tombstones'].get(segment['name'], []))
+
+        self.total_documents = sum(reader.total_documents for reader in self.segments) - len(self.deleted)
+
+    def load(self):
+        """Load the index structures of every segment"""
+        for reader in self.segments:
+            reader.load()
+
+    def preload_in_background(self):
+        """Load the index structures of every segment in a background thread"""
+        thread = threading.Thread(target=self.load, name="index-preload", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def loaded(self):
+        """Whether the index structures of every segment are loaded"""
+        return all(reader.loaded for reader in self.segments)
+
+    @property
+    def pair_offsets(self):
+        """Segmented indexes have no pair index, their segments change with every merge"""
+        return None
+
+    @property
+    def pair_frequencies(self):
+        """Segmented indexes have no pair index"""
+        return {}
+
+    def _lexicon_frequency(self, term):
+        """The lexicons of the segments count the deleted documents, the postings are read instead"""
+        return None
+
+    @staticmethod
+    def is_segmented(index_dir):
+        """Check whether an index directory holds a segmented index"""
+        return os.path.exists(os.path.join(index_dir, MANIFEST_NAME))
+
+    def _segment_for(self, doc_id):
+        """Get the reader of the segment whose document ID range holds a document"""
+        position = bisect.bisect_right(self.segment_bases, doc_id) - 1
+        return self.segments[position] if position >= 0 else None
+
+    def get_postings_for_terms(self, terms):
+        """
+        Retrieve postings for a list of terms from every live segment.
+
+        Args:
+            terms: List of terms to retrieve postings for
+
+        Returns:
+            Dictionary mapping terms to their postings lists, without deleted documents
+        """
+        result = {}
+        trace = current_trace()
+        terms_to_fetch = []
+        for term in terms:
+            cached_postings = self.cache.get(term)
+            if cached_postings is not None:
+                result[term] = cached_postings
+                trace.count('cache_hits')
+            else:
+                terms_to_fetch.append(term)
+
+        if not terms_to_fetch:
+            return result
+        trace.count('cache_misses', len(terms_to_fetch))
+
+        for term in terms_to_fetch:
+            result[term] = []
+        for reader in self.segments:
+            for term, postings in reader.get_postings_for_terms(terms_to_fetch).items():
+                result[term].extend(p for p in postings if p['doc_id'] not in self.deleted)
+        for term in terms_to_fetch:
+            if result[term]:
+                self.cache.put(term, result[term])
+        return result
+
+    def get_positions_for_terms(self, terms, doc_ids):
+        """
+        Retrieve the token positions of terms in some documents of every live segment.
+
+        Args:
+            terms: List of terms to retrieve positions for
+            doc_ids: Set of document IDs to decode positions for
+
+        Returns:
+            Dictionary mapping terms to dictionaries mapping document IDs to their sorted
+            positions, or None unless every segment has positions
+        """
+        if not self.segments or any(reader.position_offsets is None for reader in self.segments):
+            return None
+        live_doc_ids = set(doc_ids) - self.deleted
+        result = {term: {} for term in terms}
+        for reader in self.segments:
+            for term, doc_positions in reader.get_positions_for_terms(terms, live_doc_ids).items():
+                result[term].update(doc_positions)
+        return result
+
+    def get_snippet_records(self, doc_ids):
+        """
+        Retrieve the snippet records of some documents from their segments.
+        
+        Args:
+            doc_ids: List of document IDs
+            
+        Returns:
+            Dictionary mapping document IDs to their encoded snippet records
+        """
+        by_segment = {}
+        for doc_id in doc_ids:
+            reader = self._segment_for(doc_id)
+            if reader is not None and doc_id not in self.deleted:
+                by_segment.setdefault(id(reader), (reader, []))[1].append(doc_id)
+        records = {}
+        for reader, segment_doc_ids in by_segment.values():
+            records.update(reader.get_snippet_records(segment_doc_ids))
+        return records
+
+    def prefix_terms(self, prefix, max_terms):
+        """
+        Find the terms starting with a prefix in the lexicons of every live segment.
+        
+        Args:
+            prefix: Prefix of the terms
+            max_terms: Maximum number of terms to return, the most frequent are kept
+            
+        Returns:
+            List of (term, document frequency) tuples, most frequent first
+        """
+        frequencies = {}
+        for reader in self.segments:
+            for term, df in reader.prefix_terms(prefix, max_terms):
+                frequencies[term] = frequencies.get(term, 0) + df
+        return heapq.nlargest(max_terms, frequencies.items(), key=lambda item: item[1])
+
+    def has_term(self, term):
+        """
+        Check if a term exists in any live segment.
+
+        Args:
+            term: The term to check
+
+        Returns:
+            Boolean indicating if the term exists in the index
+        """
+        if self.cache.get(term) is not None:
+            return True
+        return any(reader.has_term(term) for reader in self.segments)
+
+    def get_url(self, doc_id):
+        """
+        Get the URL for a document ID.
+
+        Args:
+            doc_id: Document ID
+
+        Returns:
+            URL string for the document, or None for unknown or deleted documents
+        """
+        reader = self._segment_for(doc_id)
+        if reader is None or doc_id in self.deleted:
+            return None
+        return reader.get_url(doc_id)
+
+    def get_document_length(self, doc_id):
+        """Get the number of tokens of a document, 0 for unknown or deleted documents"""
+        reader = self._segment_for(doc_id)
+        if reader is None or doc_id in self.deleted:
+            return 0
+        return reader.get_document_length(doc_id)
+
+    def get_average_document_length(self):
+        """Get the average number of tokens of the documents of all segments"""
+        documents = sum(reader.total_documents for reader in self.segments)
+        if not documents:
+            return 0.0
+        return sum(reader.get_average_document_length() * reader.total_documents
+                   for reader in self.segments) / documents
+
+    def get_static_score(self, doc_id):
+        """Get the query-independent quality score of a document, 0 for unknown or deleted documents"""
+        reader = self._segment_for(doc_id)
+        if reader is None or doc_id in self.deleted:
+            return 0.0
+        return reader.get_static_score(doc_id)
+
+    def close(self):
+        """Release the readers of the segments"""
+        for reader in self.segments:
+            reader.close()
+
+    def get_document_contents(self, doc_id):
+        """
+        Get the contents of a document by its ID.
+
+        Args:
+            doc_id: Document ID
+
+        Returns:
+            Document contents as a string
+        """
+        reader = self._segment_for(int(doc_id))
+        if reader is None or int(doc_id) in self.deleted:
+            return None
+        return reader.get_document_contents(doc_id)
@@ -0,0 +1,93 @@
+import mmap
+import os
+import struct
+from InvertedIndex.suggest import HEADER, MAGIC, SUGGESTIONS_NAME, normalize_query, prefix_hash
+
+
+class SuggestionReader:
+    """
+    Answers autocomplete lookups from the suggest.bin file built by InvertedIndex/suggest.py.
+    The file is memory-mapped, so opening it is instant and processes serving the same
+    index share its pages. A lookup hashes the prefix, probes its slot and decodes the
+    precomputed completions: O(prefix length), with no sorting per request.
+    """
+    def __init__(self, path):
+        """
+        Map a suggestions file.
+
+        Args:
+            path: Path to suggest.bin
+        """
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, _, self.k, self.max_prefix_length, self.num_slots, self.num_strings,
+         offsets_start, self.data_start, slots_start, self.lists_start) = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a suggestions file")
+        view = memoryview(self.data)
+        self.string_offsets = view[offsets_start:self.data_start].cast('I')
+        self.slots = view[slots_start:self.lists_start].cast('I')
+
+    @classmethod
+    def open(cls, index_dir):
+        """
+        Open the suggestions of an index if it has them.
+
+        Args:
+            index_dir: Directory of the index
+
+        Returns:
+            SuggestionReader, or None if the index has no suggestions file
+        """
+        path = os.path.join(index_dir, SUGGESTIONS_NAME)
+        return cls(path) if os.path.exists(path) else None
+
+    def _string(self, string_id):
+        """Decode a suggestion from the string table"""
+        start = self.data_start + self.string_offsets[string_id]
+        end = self.data_start + self.string_offsets[string_id + 1]
+        return self.data[start:end].decode('utf-8')
+
+    def _completions(self, prefix):
+        """Get the precomputed completions of a prefix of at most max_prefix_length characters"""
+        prefix_bytes = prefix.encode('utf-8')
+        hash_value = prefix_hash(prefix_bytes)
+        slot = hash_value % self.num_slots
+        while True:
+            list_offset = self.slots[2 * slot + 1]
+            if not list_offset:
+                return []
+            if self.slots[2 * slot] == hash_value:
+                prefix_length, count = struct.unpack_from('<BB', self.data, self.lists_start + list_offset)
+                string_ids = struct.unpack_from(f'<{count}I', self.data, self.lists_start + list_offset + 2)
+                completions = [self._string(string_id) for string_id in string_ids]
+                # A hash collision is told apart by the prefix of the completions
+                if prefix_length == len(prefix) and completions and completions[0].startswith(prefix):
+                    return completions
+            slot = (slot + 1) % self.num_slots
+
+    def suggest(self, prefix, limit=None):
+        """
+        Get the best completions of a prefix, such as the text typed so far in the search box.
+
+        Args:
+            prefix: Text to complete
+            limit: Maximum number of completions, at most the number stored per prefix
+
+        Returns:
+            List of completions, best first
+        """
+        prefix = normalize_query(prefix) + (' ' if prefix[-1:].isspace() and prefix.strip() else '')
+        if not prefix:
+            return []
+        completions = self._completions(prefix[:self.max_prefix_length])
+        if len(prefix) > self.max_prefix_length:
+            # Longer prefixes filter the completions of their indexed part
+            completions = [completion for completion in completions if completion.startswith(prefix)]
+        return completions[:limit or self.k]
+
+    def close(self):
+        """Unmap the suggestions file"""
+        self.string_offsets.release()
+        self.slots.release()
+        self.data.close()
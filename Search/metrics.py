@@ -0,0 +1,337 @@
+import bisect
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from InvertedIndex.timing import NULL_STAGE, StageTimer
+
+# Stages of a query, in the order they run
+STAGES = ('tokenize', 'spelling', 'lexicon', 'postings_io', 'decode', 'intersect', 'phrase',
+          'score', 'sort', 'shards', 'snippets', 'serialize')
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+# Counters every query trace keeps
+COUNTERS = ('cache_hits', 'cache_misses', 'bytes_read')
+# Seconds between two writes of the metrics of a worker process to the shared metrics directory
+SNAPSHOT_INTERVAL = 1.0
+
+
+class QueryTrace:
+    """
+    Times the stages of one query and counts its postings cache hits and misses and bytes read.
+
+    Stages nest: the time of a stage running inside another (reading postings during the
+    intersection, say) is only counted for the inner stage, so the stage times add up to
+    the time spent in traced code.
+    """
+    def __init__(self):
+        """Start an empty trace"""
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.timer = StageTimer(lambda: (time.perf_counter(),), self._record)
+
+    def stage(self, name):
+        """
+        Time a stage of the query.
+
+        Args:
+            name: Name of the stage, one of STAGES
+
+        Returns:
+            Context manager timing the code it wraps
+        """
+        return self.timer.stage(name)
+
+    def add_time(self, name, seconds):
+        """Add time measured elsewhere to a stage, taking it out of the running stage"""
+        self.timer.add_time(name, (seconds,))
+
+    def _record(self, name, times):
+        """Add the exclusive time of a stage measured by the stage timer"""
+        self.stages[name] = self.stages.get(name, 0.0) + times[0]
+
+    def count(self, counter, amount=1):
+        """Add to one of the counters of the trace"""
+        self.counters[counter] += amount
+
+    def elapsed(self):
+        """Get the time since the trace started, in seconds"""
+        return time.perf_counter() - self.start
+
+    def breakdown(self):
+        """
+        Get the debug breakdown of the query.
+
+        Returns:
+            Dictionary with the time of each stage in milliseconds, the total time and the counters
+        """
+        return {
+            'stages_ms': {name: self.stages[name] * 1000 for name in STAGES if name in self.stages},
+            'total_ms': self.elapsed() * 1000,
+            **self.counters,
+        }
+
+
+class _NullTrace:
+    """Trace used outside of traced queries, which records nothing"""
+    def stage(self, name):
+        return NULL_STAGE
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, counter, amount=1):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+_current_trace = contextvars.ContextVar('query_trace', default=NULL_TRACE)
+
+
+def current_trace():
+    """Get the trace of the query running in this thread, or a trace that records nothing"""
+    return _current_trace.get()
+
+
+def start_trace():
+    """
+    Start tracing a query in this thread.
+
+    Returns:
+        Tuple of the new QueryTrace and the token to pass to end_trace
+    """
+    trace = QueryTrace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    """Stop tracing the query started with the token returned by start_trace"""
+    _current_trace.reset(token)
+
+
+class TracedFile:
+    """
+    Wraps a binary file to time its reads and count the bytes read in the current trace,
+    so pickle.load from it splits into postings I/O and decoding.
+    """
+    def __init__(self, f, trace):
+        self.f = f
+        self.trace = trace
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.f.read(size)
+        self.seconds += time.perf_counter() - start
+        self.trace.count('bytes_read', len(data))
+        return data
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        size = self.f.readinto(buffer)
+        self.seconds += time.perf_counter() - start
+        self.trace.count('bytes_read', size)
+        return size
+
+    def readline(self, size=-1):
+        start = time.perf_counter()
+        line = self.f.readline(size)
+        self.seconds += time.perf_counter() - start
+        self.trace.count('bytes_read', len(line))
+        return line
+
+    def seek(self, position):
+        return self.f.seek(position)
+
+
+class Histogram:
+    """Cumulative histogram of measurements in seconds, as exposed by Prometheus"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Add a measurement"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, total):
+        """Add the bucket counts and sum of another histogram with the same buckets"""
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.sum += total
+        self.count += sum(counts)
+
+    def render(self, name, labels=''):
+        """
+        Format the histogram as Prometheus text exposition lines.
+
+        Args:
+            name: Name of the metric
+            labels: Labels of the histogram, formatted as 'key="value",' pairs
+
+        Returns:
+            List of lines
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        braces = f'{{{labels.rstrip(",")}}}' if labels else ''
+        lines.append(f'{name}_sum{braces} {self.sum}')
+        lines.append(f'{name}_count{braces} {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Aggregates the traces of all queries into latency histograms and counters,
+    served in the Prometheus text format by the /metrics endpoint.
+    """
+    def __init__(self):
+        """Initialize empty metrics"""
+        self.lock = threading.Lock()
+        self.query_latency = Histogram()
+        self.stage_latency = {name: Histogram() for name in STAGES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.queries = 0
+        # Directory shared by the worker processes of a pre-fork server, see share()
+        self.directory = None
+
+    def observe(self, trace):
+        """Add the stage times and counters of a finished query trace"""
+        total = trace.elapsed()
+        with self.lock:
+            self.queries += 1
+            self.query_latency.observe(total)
+            for name, seconds in trace.stages.items():
+                self.stage_latency[name].observe(seconds)
+            for counter, amount in trace.counters.items():
+                self.counters[counter] += amount
+
+    def share(self, directory):
+        """
+        Share the metrics of this process with the other worker processes of a pre-fork server.
+        Each worker writes its metrics to the directory every SNAPSHOT_INTERVAL seconds when
+        they changed, and render() adds up the metrics of all of them, whichever worker serves /metrics.
+
+        Args:
+            directory: Directory shared by the workers
+
+        Returns:
+            The started thread writing the snapshots
+        """
+        self.directory = directory
+        self.write_snapshot()
+
+        def snapshot_loop():
+            written = self.queries
+            while True:
+                time.sleep(SNAPSHOT_INTERVAL)
+                if self.queries != written:
+                    written = self.queries
+                    self.write_snapshot()
+
+        thread = threading.Thread(target=snapshot_loop, name="metrics-snapshot", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self):
+        """
+        Get the metrics of this process as a JSON serializable dictionary.
+
+        Returns:
+            Dictionary of the query count, the histogram bucket counts and sums and the counters
+        """
+        with self.lock:
+            return {
+                'queries': self.queries,
+                'query_latency': [self.query_latency.counts[:], self.query_latency.sum],
+                'stage_latency': {name: [histogram.counts[:], histogram.sum]
+                                  for name, histogram in self.stage_latency.items()},
+                'counters': dict(self.counters),
+            }
+
+    def write_snapshot(self):
+        """Write the snapshot of this process to the shared directory, replacing its previous one"""
+        path = os.path.join(self.directory, f'worker_{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def merge(self, snapshot):
+        """Add the metrics of a snapshot, taken by another process, to these metrics"""
+        with self.lock:
+            self.queries += snapshot['queries']
+            self.query_latency.merge(*snapshot['query_latency'])
+            for name, (counts, total) in snapshot['stage_latency'].items():
+                self.stage_latency[name].merge(counts, total)
+            for counter, amount in snapshot['counters'].items():
+                self.counters[counter] += amount
+
+    def _worker_snapshots(self):
+        """Get the latest snapshot of every worker that shares the directory, this process' up to date"""
+        snapshots = {}
+        for path in glob.glob(os.path.join(self.directory, 'worker_*.json')):
+            pid = os.path.basename(path)[len('worker_'):-len('.json')]
+            try:
+                with open(path, 'r') as f:
+                    snapshots[pid] = json.load(f)
+            except (OSError, ValueError):
+                # Replaced while reading, or the worker's first snapshot isn't complete yet
+                continue
+        snapshots[str(os.getpid())] = self.snapshot()
+        return snapshots
+
+    def render(self):
+        """
+        Format all metrics in the Prometheus text exposition format. When the metrics are shared,
+        they are added up over all worker processes, and the queries of each worker are listed.
+
+        Returns:
+            The metrics text
+        """
+        if self.directory is None:
+            return self._render()
+        snapshots = self._worker_snapshots()
+        total = MetricsRegistry()
+        for snapshot in snapshots.values():
+            total.merge(snapshot)
+        lines = ['# HELP anteater_worker_queries_total Number of search queries served by each worker process.',
+                 '# TYPE anteater_worker_queries_total counter']
+        lines += [f'anteater_worker_queries_total{{pid="{pid}"}} {snapshot["queries"]}'
+                  for pid, snapshot in sorted(snapshots.items())]
+        return total._render() + '\n'.join(lines) + '\n'
+
+    def _render(self):
+        """Format the metrics of this registry in the Prometheus text exposition format"""
+        with self.lock:
+            lines = ['# HELP anteater_queries_total Number of search queries served.',
+                     '# TYPE anteater_queries_total counter',
+                     f'anteater_queries_total {self.queries}',
+                     '# HELP anteater_query_duration_seconds Latency of search queries.',
+                     '# TYPE anteater_query_duration_seconds histogram']
+            lines += self.query_latency.render('anteater_query_duration_seconds')
+            lines += ['# HELP anteater_query_stage_duration_seconds Time spent in each stage of search queries.',
+                      '# TYPE anteater_query_stage_duration_seconds histogram']
+            for name, histogram in self.stage_latency.items():
+                lines += histogram.render('anteater_query_stage_duration_seconds', f'stage="{name}",')
+            descriptions = {'cache_hits': 'Postings lists found in the term cache.',
+                            'cache_misses': 'Postings lists read from the index file.',
+                            'bytes_read': 'Bytes of postings read from the index file.'}
+            for counter, amount in self.counters.items():
+                name = f'anteater_postings_{counter}_total'
+                lines += [f'# HELP {name} {descriptions[counter]}', f'# TYPE {name} counter', f'{name} {amount}']
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics of every query served by this process, or by all workers once shared
+METRICS = MetricsRegistry()
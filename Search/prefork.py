@@ -0,0 +1,201 @@
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+from werkzeug.serving import make_server
+
+# Seconds between two checks of the master process for exited workers and signals
+POLL_INTERVAL = 0.2
+# Seconds stopped workers get to finish their requests before they are killed
+STOP_TIMEOUT = 10
+
+
+class PreforkServer:
+    """
+    Serves a WSGI application from several worker processes forked from one master process,
+    all accepting connections from the same listening socket.
+
+    The master loads the index before forking, so the workers share its memory copy-on-write,
+    and its memory-mapped files through the page cache, instead of each holding a copy. The
+    master replaces workers that exit, forks a new generation of workers on SIGHUP or
+    restart(), and stops them all on SIGTERM or SIGINT.
+    """
+    def __init__(self, app, host='0.0.0.0', port=5000, workers=2, before_fork=None, after_fork=None,
+                 on_reload=None):
+        """
+        Initialize the server without starting it.
+
+        Args:
+            app: WSGI application, such as the Flask app
+            host: Address to listen on
+            port: Port to listen on, 0 for any free port
+            workers: Number of worker processes
+            before_fork: Optional callable run by the master before forking each generation
+                of workers, loading everything the workers share
+            after_fork: Optional callable run by each worker after it is forked
+            on_reload: Optional callable run by the master on SIGHUP before the workers are
+                restarted, such as reopening the index
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.before_fork = before_fork
+        self.after_fork = after_fork
+        self.on_reload = on_reload
+        self.socket = None
+        # Process IDs of the live workers of the current generation
+        self.workers = set()
+        self.stopping = False
+        self.reload_requested = False
+        self.restart_requested = False
+
+    def bind(self):
+        """
+        Open the listening socket shared by the workers.
+
+        Returns:
+            The (host, port) address the server listens on
+        """
+        self.socket = socket.create_server((self.host, self.port), backlog=128)
+        self.port = self.socket.getsockname()[1]
+        return self.socket.getsockname()[:2]
+
+    def restart(self):
+        """Replace all workers by newly forked ones, from any thread of the master process"""
+        self.restart_requested = True
+
+    def run(self):
+        """Fork the workers and supervise them until SIGTERM or SIGINT, then stop them"""
+        if self.socket is None:
+            self.bind()
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        print(f"Serving on {self.host}:{self.port} with {self.num_workers} worker processes")
+        self._prepare_fork()
+        for _ in range(self.num_workers):
+            self._spawn()
+        try:
+            while not self.stopping:
+                time.sleep(POLL_INTERVAL)
+                if self.reload_requested:
+                    self.reload_requested = False
+                    if self.on_reload is not None:
+                        self.on_reload()
+                    self.restart_requested = True
+                if self.restart_requested:
+                    self.restart_requested = False
+                    self._replace_workers()
+                self._reap()
+        finally:
+            self._stop_workers(self.workers)
+            self.socket.close()
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _prepare_fork(self):
+        """Load the shared structures, then keep the garbage collector off the objects the workers share"""
+        if self.before_fork is not None:
+            self.before_fork()
+        # A collection in a worker would write to the header of every object it visits, copying
+        # the pages of the whole index. Frozen objects are never visited.
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self):
+        """Fork a worker process"""
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self._serve_worker()
+            except BaseException as e:
+                print(f"Worker {os.getpid()} failed: {e}")
+                status = 1
+            finally:
+                # Never return into the master's code
+                os._exit(status)
+        self.workers.add(pid)
+
+    def _serve_worker(self):
+        """Serve requests in a worker process until it receives SIGTERM"""
+        # Interrupts are handled by the master, which stops the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        if self.after_fork is not None:
+            self.after_fork()
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever() to return, it can't be called from its thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, stop)
+        server.serve_forever()
+
+    def _reap(self):
+        """Collect exited workers and fork replacements"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.workers:
+                self.workers.discard(pid)
+                if not self.stopping:
+                    print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, replacing it")
+                    self._spawn()
+
+    def _replace_workers(self):
+        """Fork a new generation of workers, then stop the previous one"""
+        old_workers = set(self.workers)
+        self.workers = set()
+        gc.unfreeze()
+        self._prepare_fork()
+        for _ in range(self.num_workers):
+            self._spawn()
+        self._stop_workers(old_workers)
+
+    def _stop_workers(self, workers):
+        """Ask workers to stop, and kill those still running after STOP_TIMEOUT seconds"""
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + STOP_TIMEOUT
+        remaining = set(workers)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0] != 0:
+                        remaining.discard(pid)
+                except ChildProcessError:
+                    remaining.discard(pid)
+            time.sleep(0.05)
+        for pid in remaining:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+
+def worker_cache_size(cache_budget, workers, shards=1):
+    """
+    Split a global postings cache budget between the caches of the worker processes.
+
+    Args:
+        cache_budget: Number of postings lists cached by all workers together
+        workers: Number of worker processes
+        shards: Number of shards each worker searches, each with its own cache
+
+    Returns:
+        int: Number of postings lists each cache holds, at least 1
+    """
+    return max(1, cache_budget // (workers * max(1, shards)))
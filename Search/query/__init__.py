@@ -1,4 +1,6 @@
-from .query_processor import QueryProcessor
+from .query_processor import QueryProcessor, ParsedQuery
 from .ranking import Ranking
+from .snippets import make_snippet
+from .spelling import SpellingCorrector
 
-__all__ = ['QueryProcessor', 'Ranking']
+__all__ = ['QueryProcessor', 'ParsedQuery', 'Ranking', 'SpellingCorrector', 'make_snippet']
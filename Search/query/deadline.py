@@ -0,0 +1,101 @@
+import threading
+import time
+
+# Number of postings scored between two checks of the deadline
+CHECK_INTERVAL = 1024
+# Number of documents scored between two checks of the deadline, a document costs a dozen postings
+DOCUMENT_CHECK_INTERVAL = 128
+
+
+class Deadline:
+    """
+    The time budget of a query, and the work skipped once it is spent. The search checks it
+    between terms, read rarest first, and between blocks of postings, scored in their index order
+    (best static score first), so the work cut by the deadline is the work least likely to change
+    the top results. Each shard gets a child deadline ending at the same time.
+    """
+    def __init__(self, timeout_ms=None):
+        """
+        Start the deadline.
+
+        Args:
+            timeout_ms: Time budget of the query in milliseconds, None for no deadline
+        """
+        self.timeout_ms = timeout_ms
+        self.end = time.perf_counter() + timeout_ms / 1000 if timeout_ms is not None else None
+        # Amount of each kind of work skipped, see skip()
+        self.skipped = {}
+        # Terms whose postings the search didn't read, the ranking skips them too
+        self.skipped_terms = set()
+        self.lock = threading.Lock()
+
+    @property
+    def bounded(self):
+        """Whether the query has a time budget"""
+        return self.end is not None
+
+    def expired(self):
+        """Check if the time budget is spent"""
+        return self.end is not None and time.perf_counter() >= self.end
+
+    def remaining_ms(self):
+        """Get the time left in milliseconds, None for no deadline"""
+        if self.end is None:
+            return None
+        return max(0.0, (self.end - time.perf_counter()) * 1000)
+
+    def skip(self, work, amount=1):
+        """
+        Record work skipped because the deadline passed.
+
+        Args:
+            work: Kind of work: 'terms' (postings lists not read), 'postings' (postings not read or scored),
+                'documents' (matching documents left unscored) or 'phrases' (phrases not checked)
+            amount: Amount of work skipped
+        """
+        if amount:
+            with self.lock:
+                self.skipped[work] = self.skipped.get(work, 0) + amount
+
+    def skip_terms(self, terms, num_postings):
+        """
+        Record terms whose postings are left unread because the deadline passed.
+
+        Args:
+            terms: List of the skipped terms
+            num_postings: Number of postings of the skipped terms
+        """
+        with self.lock:
+            self.skipped_terms.update(terms)
+        self.skip('terms', len(terms))
+        self.skip('postings', num_postings)
+
+    def child(self):
+        """
+        Get a deadline ending at the same time for a part of the query searched apart, such as
+        a shard, whose skipped work is added back with add_skipped().
+        """
+        child = Deadline()
+        child.timeout_ms = self.timeout_ms
+        child.end = self.end
+        return child
+
+    def add_skipped(self, skipped):
+        """Add the work skipped by a shard searched in another process or server"""
+        for work, amount in skipped.items():
+            self.skip(work, amount)
+
+    @property
+    def partial(self):
+        """Whether some work was skipped, so the results may not be the exact top results"""
+        return bool(self.skipped)
+
+    def stats(self):
+        """
+        Get the statistics of the work skipped, for the response of a partial query.
+
+        Returns:
+            Dictionary with the time budget and the amount of each kind of work skipped
+        """
+        with self.lock:
+            return {'timeout_ms': self.timeout_ms, 'skipped': dict(self.skipped)}
@@ -1,20 +1,66 @@
-from nltk.stem import PorterStemmer
-from nltk.tokenize import RegexpTokenizer
+import bisect
+import re
+import threading
+from itertools import combinations
+from ..metrics import current_trace
+
+# A quoted phrase, optionally followed by ~N to allow N extra tokens between its terms
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+# Shortest prefix of a wildcard term such as inform*, shorter ones are searched as plain terms
+MIN_PREFIX_LENGTH = 2
+# Query tokens, words optionally ending with * for wildcard terms
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9]+\*?')
+
+
+class ParsedQuery:
+    """
+    A parsed search query.
+    """
+    def __init__(self, terms, phrases):
+        """
+        Args:
+            terms: List of stemmed query terms, including the terms of the phrases,
+                and unstemmed prefixes followed by * for wildcard terms
+            phrases: List of (stemmed phrase terms, slop) tuples for the quoted phrases,
+                which can hold wildcard terms too
+        """
+        self.terms = terms
+        self.phrases = phrases
+
 
 class QueryProcessor:
     """
     Handles query processing, tokenization, and boolean operations.
     """
-    def __init__(self, index_reader):
+    def __init__(self, index_reader, max_expansions=50):
         """
         Initialize the query processor.
         
         Args:
-            index_reader: IndexReader instance for retrieving document information
+            index_reader: IndexReader instance for retrieving document information, or the global
+                Lexicon of a sharded index, only used to expand wildcard terms (see expand_prefixes())
+            max_expansions: Maximum number of terms a wildcard term expands to, the
+                terms in the most documents are kept
         """
-        self.stemmer = PorterStemmer()
-        self.tokenizer = RegexpTokenizer(r'[A-Za-z0-9]+')
         self.index_reader = index_reader
+        self.max_expansions = max_expansions
+        # NLTK takes a third of a second to import, the stemmer is created on first use or by load()
+        self._stemmer = None
+        self.stemmer_lock = threading.Lock()
+
+    @property
+    def stemmer(self):
+        """The Porter stemmer the indexer stems tokens with"""
+        if self._stemmer is None:
+            self.load()
+        return self._stemmer
+
+    def load(self):
+        """Import NLTK and create the stemmer, if not done yet"""
+        with self.stemmer_lock:
+            if self._stemmer is None:
+                from nltk.stem import PorterStemmer
+                self._stemmer = PorterStemmer()
 
     def tokenize_query(self, query):
         """
@@ -24,57 +70,339 @@ class QueryProcessor:
             query: The search query string
             
         Returns:
-            List of stemmed query terms
+            List of stemmed query terms, wildcard terms such as inform* are kept unstemmed
         """
         # Tokenize
-        tokens = self.tokenizer.tokenize(query.lower())
+        tokens = TOKEN_PATTERN.findall(query.lower())
         
-        # Stem tokens
-        stemmed_tokens = [self.stemmer.stem(token) for token in tokens]
+        # Stem tokens, a prefix can't be stemmed as it isn't a whole word
+        stemmed_tokens = [token if self.is_prefix(token) else self.stemmer.stem(token.rstrip('*'))
+                          for token in tokens]
         
         return stemmed_tokens
 
-    def boolean_and_search(self, query_terms):
+    def is_prefix(self, term):
+        """Check if a query term is a wildcard term, matching every term starting with its prefix"""
+        return isinstance(term, str) and term.endswith('*') and len(term) > MIN_PREFIX_LENGTH
+
+    def expand_terms(self, query_terms):
+        """
+        Expand the wildcard terms of a query to the indexed terms starting with their prefix.
+        
+        Args:
+            query_terms: List of processed query terms, the wildcard terms already expanded by
+                expand_prefixes() being tuples of their expansions
+            
+        Returns:
+            List with a list of terms for each query term: the term itself, or the expansions
+            of a wildcard term (empty if no term has its prefix)
+        """
+        with current_trace().stage('lexicon'):
+            return [list(term) if isinstance(term, tuple)
+                    else [term for term, _ in self.index_reader.prefix_terms(term[:-1], self.max_expansions)]
+                    if self.is_prefix(term) else [term]
+                    for term in query_terms]
+
+    def expand_prefixes(self, query_terms):
+        """
+        Replace the wildcard terms of a query by the tuple of their expansions, so that the shards
+        of a sharded index search the expansions of the whole collection instead of their own.
+        
+        Args:
+            query_terms: List of processed query terms
+            
+        Returns:
+            List of query terms with tuples for the wildcard terms, or the query terms unchanged
+            without a lexicon to expand them, each shard then expands them itself
+        """
+        if self.index_reader is None:
+            return query_terms
+        groups = self.expand_terms(query_terms)
+        return [tuple(group) if self.is_prefix(term) else term for term, group in zip(query_terms, groups)]
+
+    def expand_query(self, query_terms):
+        """
+        Get the query terms with the wildcard terms replaced by their expansions, for ranking.
+        
+        Args:
+            query_terms: List of processed query terms
+            
+        Returns:
+            List of stemmed terms
+        """
+        return [term for group in self.expand_terms(query_terms) for term in group]
+
+    def parse_query(self, query):
+        """
+        Parse a query into its terms and quoted phrases. "machine learning" matches the
+        terms next to each other, "machine learning"~2 allows up to 2 other tokens between them.
+        
+        Args:
+            query: The search query string
+            
+        Returns:
+            ParsedQuery with the stemmed terms and phrases of the query
+        """
+        phrases = []
+        for match in PHRASE_PATTERN.finditer(query):
+            # Wildcard phrase terms match the positions of any of their expansions, see phrase_search()
+            phrase_terms = self.tokenize_query(match.group(1))
+            # A single term phrase is just a term
+            if len(phrase_terms) > 1:
+                phrases.append((phrase_terms, int(match.group(2) or 0)))
+        terms = self.tokenize_query(PHRASE_PATTERN.sub(lambda match: f" {match.group(1)} ", query))
+        return ParsedQuery(terms, phrases)
+
+    def correct_query(self, parsed_query, corrections):
+        """
+        Replace misspelled terms of a parsed query by their corrections.
+        
+        Args:
+            parsed_query: ParsedQuery to correct
+            corrections: Dictionary mapping misspelled terms to their corrections
+            
+        Returns:
+            ParsedQuery with the corrected terms and phrases
+        """
+        terms = [corrections.get(term, term) for term in parsed_query.terms]
+        phrases = [([corrections.get(term, term) for term in phrase_terms], slop)
+                   for phrase_terms, slop in parsed_query.phrases]
+        return ParsedQuery(terms, phrases)
+
+    def rewrite_query(self, query, corrections):
+        """
+        Rewrite a query with the corrections of its misspelled words, for "did you mean".
+        
+        Args:
+            query: The search query string
+            corrections: Dictionary mapping misspelled terms to their corrections
+            
+        Returns:
+            The query with the misspelled words replaced
+        """
+        def replace(match):
+            word = match.group(0)
+            return corrections.get(self.stemmer.stem(word.lower()), word)
+        return re.sub(r'[A-Za-z0-9]+(?!\*)', replace, query)
+
+    def phrase_search(self, phrase_terms, slop, doc_ids):
+        """
+        Keep the documents containing a phrase. Positions are only read and decoded for the
+        given documents, which should already contain all the phrase terms.
+        
+        A wildcard phrase term matches any of its expansions.
+        
+        Args:
+            phrase_terms: List of stemmed phrase terms, in order, the wildcard terms possibly
+                already expanded by expand_prefixes()
+            slop: Number of other tokens allowed between the phrase terms
+            doc_ids: Set of candidate document IDs, usually the boolean AND result
+            
+        Returns:
+            Set of document IDs containing the phrase, or doc_ids unchanged if the index
+            has no positions
+        """
+        groups = self.expand_terms(phrase_terms)
+        positions = self.index_reader.get_positions_for_terms([term for group in groups for term in group], doc_ids)
+        if positions is None:
+            return doc_ids
+
+        # Largest distance allowed between the first and the last phrase term
+        window = len(phrase_terms) - 1 + slop
+        matches = set()
+        for doc_id in doc_ids:
+            term_positions = [self._group_positions(group, positions, doc_id) for group in groups]
+            if all(term_positions) and self._in_order_within(term_positions, window):
+                matches.add(doc_id)
+        return matches
+
+    def _group_positions(self, terms, positions, doc_id):
+        """Get the sorted positions of any of the terms in a document, None if it has none"""
+        if len(terms) == 1:
+            return positions[terms[0]].get(doc_id)
+        return sorted(position for term in terms for position in positions[term].get(doc_id, ())) or None
+
+    def _in_order_within(self, term_positions, window):
+        """
+        Check if the terms occur in order within a window of tokens.
+        
+        Args:
+            term_positions: Sorted positions of each term, in phrase order
+            window: Largest distance allowed between the first and the last term
+            
+        Returns:
+            Boolean indicating if the terms occur in order within the window
+        """
+        for start in term_positions[0]:
+            current = start
+            for positions in term_positions[1:]:
+                # The earliest following occurrence gives the tightest match from this start
+                i = bisect.bisect_right(positions, current)
+                if i == len(positions):
+                    # No later start can be followed by this term either
+                    return False
+                current = positions[i]
+                if current - start > window:
+                    break
+            else:
+                return True
+        return False
+
+    def pair_postings(self, query_terms):
+        """
+        Get the postings of the query terms covered by the pair index, restricted to the documents
+        containing both terms of their pair. Pairs are chosen greedily, those whose terms are in
+        the most documents first as they save the most intersection work, each term in one pair.
+        
+        Args:
+            query_terms: List of processed query terms
+            
+        Returns:
+            Dictionary mapping the covered terms to their restricted postings, empty if no pair
+            of the query terms is in the pair index
+        """
+        # Wildcard terms, expanded or not, are left out
+        terms = list(dict.fromkeys(term for term in query_terms
+                                   if isinstance(term, str) and not self.is_prefix(term)))
+        if len(terms) < 2 or not self.index_reader.pair_offsets:
+            return {}
+        pairs = [pair for pair in combinations(terms, 2) if self.index_reader.has_pair(*pair)]
+        if not pairs:
+            return {}
+        frequencies = self.index_reader.get_document_frequencies([term for pair in pairs for term in pair])
+        pairs.sort(key=lambda pair: frequencies[pair[0]] + frequencies[pair[1]], reverse=True)
+        
+        postings = {}
+        for term_a, term_b in pairs:
+            if term_a in postings or term_b in postings:
+                continue
+            pair_postings = self.index_reader.get_pair_postings(term_a, term_b)
+            if pair_postings is not None:
+                postings.update(pair_postings)
+        return postings
+
+    def boolean_and_search(self, query_terms, pair_postings=None, deadline=None):
         """
         Perform a boolean AND search using the provided query terms.
+        The expansions of a wildcard term are merged as a union before the intersection.
+        Terms covered by the pair index are intersected through their pair's postings, which
+        only hold the documents containing both terms, instead of their full postings.
         
         Args:
-            query_terms: List of processed (stemmed) query terms
+            query_terms: List of processed query terms
+            pair_postings: Optional postings of the covered terms, see pair_postings(),
+                looked up when not given
+            deadline: Optional Deadline of the query. Postings are then read one term at a time,
+                rarest first, and once it passes the remaining terms are skipped
             
         Returns:
-            Set of document IDs that contain all query terms
+            Set of document IDs that contain all query terms, or all the terms read before
+            the deadline
         """
         if not query_terms:
             return set()
         
+        if pair_postings is None:
+            pair_postings = self.pair_postings(query_terms)
+        groups = self.expand_terms(query_terms)
+        
         # Batch retrieve all term frequencies in one go
         # (assuming index_reader supports batch operations, or implement if needed)
-        term_frequencies = self.index_reader.get_document_frequencies(query_terms)
+        term_frequencies = self.index_reader.get_document_frequencies([term for group in groups for term in group])
         
-        # Filter out terms that don't exist in the index
-        valid_terms = [(term, freq) for term, freq in term_frequencies.items() if freq > 0]
+        # Filter out terms that don't exist in the index, a group's frequency bounds its union
+        # The pair postings of a term are only used for the term itself, not as a wildcard expansion
+        valid_groups = []
+        for group in groups:
+            terms = [term for term in group if term_frequencies[term] > 0]
+            if len(terms) == 1 and terms[0] in pair_postings:
+                valid_groups.append((terms, len(pair_postings[terms[0]]), pair_postings))
+            elif terms:
+                valid_groups.append((terms, sum(term_frequencies[term] for term in terms), None))
         
-        if not valid_terms:
+        if not valid_groups:
             return set()
         
         # Sort by frequency for optimal processing
-        valid_terms.sort(key=lambda x: x[1])
-        
-        # Batch retrieve postings for all terms
-        terms = [term for term, _ in valid_terms]
-        all_postings = self.index_reader.get_postings_for_terms(terms)
+        valid_groups.sort(key=lambda x: x[1])
         
-        # Start with the smallest set
-        first_term = valid_terms[0][0]
-        result_docs = set(posting['doc_id'] for posting in all_postings[first_term])
+        # Batch retrieve postings for all terms not read from the pair index, or with a deadline,
+        # each term's when it is reached, so the common terms cut by the deadline are never read
+        bounded = deadline is not None and deadline.bounded
+        all_postings = {} if bounded else self.index_reader.get_postings_for_terms(
+            [term for terms, _, postings in valid_groups if postings is None for term in terms])
         
-        # Intersect with remaining terms
-        for term, _ in valid_terms[1:]:
-            term_docs = set(posting['doc_id'] for posting in all_postings[term])
-            result_docs &= term_docs
+        # Start with the smallest set and intersect with remaining terms
+        result_docs = None
+        for i, (terms, _, postings) in enumerate(valid_groups):
+            if i and bounded and deadline.expired():
+                self._skip_groups(valid_groups[i:], deadline)
+                break
+            if postings is None:
+                postings = self.index_reader.get_postings_for_terms(terms) if bounded else all_postings
+            documents = self._group_documents(terms, postings)
+            result_docs = documents if result_docs is None else result_docs & documents
             
             # Early termination if intersection becomes empty
             if not result_docs:
                 break
                 
         return result_docs
+
+    def _skip_groups(self, groups, deadline):
+        """Record the term groups left unread when the deadline passed"""
+        deadline.skip_terms([term for group in groups for term in group[0]],
+                            sum(group[1] for group in groups))
+
+    def _group_documents(self, terms, all_postings):
+        """Get the set of documents containing any of the terms"""
+        return set(posting['doc_id'] for term in terms for posting in all_postings[term])
+
+    def disjunctive_search(self, query_terms, deadline=None):
+        """
+        Perform a boolean OR search using term-at-a-time accumulators: one pass over the
+        postings of every query term counts how many of the terms each document contains.
+        A wildcard term counts once for the documents containing any of its expansions.
+        
+        Args:
+            query_terms: List of processed query terms
+            deadline: Optional Deadline of the query. Postings are then read one term at a time,
+                rarest first, and once it passes the remaining terms are skipped
+            
+        Returns:
+            Tuple of a dictionary mapping document IDs to the number of query terms they
+            contain, and the number of query terms found in the index (and read before the deadline)
+        """
+        if not query_terms:
+            return {}, 0
+        
+        groups = self.expand_terms(query_terms)
+        term_frequencies = self.index_reader.get_document_frequencies([term for group in groups for term in group])
+        groups = [[term for term in group if term_frequencies[term] > 0] for group in groups]
+        # Duplicate query terms count once, like the AND search
+        groups = [terms for i, terms in enumerate(groups) if terms and terms not in groups[:i]]
+        if not groups:
+            return {}, 0
+        
+        bounded = deadline is not None and deadline.bounded
+        if bounded:
+            # The rarest terms are read first, the common ones are the first cut by the deadline
+            groups.sort(key=lambda terms: sum(term_frequencies[term] for term in terms))
+            all_postings = {}
+        else:
+            all_postings = self.index_reader.get_postings_for_terms([term for terms in groups for term in terms])
+        accumulators = {}
+        for i, terms in enumerate(groups):
+            if bounded:
+                if i and deadline.expired():
+                    self._skip_groups([(group, sum(term_frequencies[term] for term in group)) for group in groups[i:]],
+                                      deadline)
+                    return accumulators, i
+                all_postings = self.index_reader.get_postings_for_terms(terms)
+            if len(terms) == 1:
+                doc_ids = (posting['doc_id'] for posting in all_postings[terms[0]])
+            else:
+                doc_ids = self._group_documents(terms, all_postings)
+            for doc_id in doc_ids:
+                accumulators[doc_id] = accumulators.get(doc_id, 0) + 1
+        return accumulators, len(groups)
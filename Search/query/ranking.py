@@ -1,4 +1,26 @@
+import heapq
 import math
+from InvertedIndex.fields import DEFAULT_FIELD_WEIGHTS, field_boost
+from .deadline import CHECK_INTERVAL, DOCUMENT_CHECK_INTERVAL
+from ..metrics import current_trace
+
+# Exponent of the static score of a document in its score, 0 ignores the static scores
+DEFAULT_STATIC_WEIGHT = 0.2
+
+
+def count_matched_groups(doc_vector, term_groups):
+    """
+    Count the query terms a document contains, a wildcard term counting once however many
+    of its expansions the document contains.
+
+    Args:
+        doc_vector: Dictionary mapping the terms of the document to their TF-IDF values
+        term_groups: List of the terms of each query term, see QueryProcessor.expand_terms()
+
+    Returns:
+        Number of distinct query terms with at least one of their terms in the document
+    """
+    return len({tuple(group) for group in term_groups if any(term in doc_vector for term in group)})
 
 class Ranking:
     """
@@ -6,31 +28,69 @@ class Ranking:
     
     This class works with the IndexReader to retrieve document information and
     compute similarity scores between queries and documents.
+
+    The weight of a term in a document is BM25F-style: its occurrences in the text plus the
+    weight of each field (title, headings, bold) it appears in, saturated by k1 and normalized
+    by the document length. The field weights are applied at query time, changing them
+    doesn't need a reindex. The score of a document is then multiplied by its static score
+    (its PageRank, 1 on average) to the power of static_weight.
     """
-    def __init__(self, total_documents, index_reader):
+    def __init__(self, total_documents, index_reader, field_weights=None, k1=1.2, b=0.75,
+                 static_weight=DEFAULT_STATIC_WEIGHT):
+        """
+        Args:
+            total_documents: Number of documents in the collection
+            index_reader: IndexReader of the index
+            field_weights: Optional weight of each field in occurrences, see DEFAULT_FIELD_WEIGHTS
+            k1: Saturation of the term weights, higher values let repeated occurrences count longer
+            b: Strength of the document length normalization, between 0 and 1
+            static_weight: Influence of the static scores of the documents, 0 to ignore them
+        """
         self.total_documents = total_documents
         self.index_reader = index_reader
         self.idf_dict = {}
+        self.field_weights = dict(DEFAULT_FIELD_WEIGHTS if field_weights is None else field_weights)
+        self.k1 = k1
+        self.b = b
+        self.static_weight = static_weight
+        # Average number of tokens of the documents, read from the index on first use
+        self.average_length = None
 
-    def rank_results(self, results, query_terms):
+    def rank_results(self, results, query_terms, postings=None, deadline=None, k=None, term_groups=None):
         """Rank documents based on relevance to query
         Args:
             results: collection of documents
             query_terms: collection of query terms
+            postings: Optional postings to use instead of reading them from the index, holding
+                at least the postings of the terms in the results, such as pair postings
+            deadline: Optional Deadline of the query, see calculate_document_vectors(). Documents
+                none of whose postings were scored before it passed are left out, and the documents
+                are then scored in the order their postings were, until it passes
+            k: Optional number of results to return, the best k are selected with a heap
+                and only their URLs are looked up
+            term_groups: Optional list of the terms of each query term (see QueryProcessor.expand_terms()).
+                When given, documents containing more of the query terms come first, see
+                count_matched_groups(), documents with as many terms being ordered by score
         Returns:
-            List of tuples: doc id, doc url, combined score (cosine x tf-idf), doc vector
+            List of tuples: doc id, doc url, combined score (cosine x tf-idf x static prior), doc vector
         """
 
         # Calculate query vector
         query_vector = self.calculate_query_vector(query_terms)
         
         # Calculate document vectors
-        doc_vectors = self.calculate_document_vectors(results, query_terms)
+        doc_vectors = self.calculate_document_vectors(results, query_terms, postings, deadline)
+        bounded = deadline is not None and deadline.bounded
+        if bounded:
+            deadline.skip('documents', len(results) - len(doc_vectors))
         
         # Calculate scores using both metrics
         scores = []
         
-        for doc_id, doc_vector in doc_vectors.items():
+        for i, (doc_id, doc_vector) in enumerate(doc_vectors.items()):
+            if bounded and i and i % DOCUMENT_CHECK_INTERVAL == 0 and deadline.expired():
+                deadline.skip('documents', len(doc_vectors) - i)
+                break
             # Calculate cosine similarity (primary sort criteria)
             cosine_sim = self.cosine_similarity(query_vector, doc_vector)
             
@@ -39,10 +99,23 @@ class Ranking:
             
             # Store combined score for sorting
             combined_score = cosine_sim * tf_idf_total
+            if self.static_weight:
+                # Indexes without static scores have 0 for every document, and are left as is
+                static_score = self.index_reader.get_static_score(doc_id)
+                if static_score > 0:
+                    combined_score *= static_score ** self.static_weight
             scores.append((doc_id, combined_score, doc_vector))
         
         # Sort by combined score
-        scores.sort(key=lambda x: x[1], reverse=True)
+        if term_groups is not None:
+            key = lambda x: (count_matched_groups(x[2], term_groups), x[1])
+        else:
+            key = lambda x: x[1]
+        with current_trace().stage('sort'):
+            if k is not None and k < len(scores):
+                scores = heapq.nlargest(k, scores, key=key)
+            else:
+                scores.sort(key=key, reverse=True)
         
         # Create a composite score that combines both metrics for display
         results = [(doc_id, self.index_reader.get_url(doc_id), combined_score, doc_vector) 
@@ -91,31 +164,81 @@ class Ranking:
             query_vector[term] = tf * idf
         return query_vector
 
-    def calculate_document_vectors(self, doc_ids, query_terms):
+    def calculate_document_vectors(self, doc_ids, query_terms, postings=None, deadline=None):
         """
         Calculate document vectors (limited to query terms) for the given document IDs.
 
         Args:
             doc_ids: Set of document IDs
             query_terms: List of processed query terms
+            postings: Optional dictionary of postings used for the terms it holds, see rank_results()
+            deadline: Optional Deadline of the query. The terms are then scored rarest first, their
+                postings by blocks in their index order (best static score first), until it passes.
+                The first block of the rarest term is always scored, terms the search skipped never are.
 
         Returns:
-            Dictionary mapping document IDs to their partial TF-IDF vectors
+            Dictionary mapping document IDs to their partial TF-IDF vectors, with a deadline
+            only the documents with a scored posting, in the order of their first one
         """
-        doc_vectors = {doc_id: {} for doc_id in doc_ids}
+        lengths = {}
+        bounded = deadline is not None and deadline.bounded
+        if not bounded:
+            doc_vectors = {doc_id: {} for doc_id in doc_ids}
+        else:
+            doc_vectors = {}
+            # The rarest terms weigh the most in the scores
+            query_terms = sorted((term for term in dict.fromkeys(query_terms) if term not in deadline.skipped_terms),
+                                 key=self.get_idf, reverse=True)
 
-        for term in query_terms:
+        for i, term in enumerate(query_terms):
+            if i and bounded and deadline.expired():
+                deadline.skip('terms', len(query_terms) - i)
+                break
             idf = self.get_idf(term)
-            postings = self.index_reader.get_postings_for_term(term)
-            for posting in postings:
-                doc_id = posting['doc_id']
-                if doc_id in doc_ids:
+            if postings is not None and term in postings:
+                term_postings = postings[term]
+            else:
+                term_postings = self.index_reader.get_postings_for_term(term)
+            block_size = CHECK_INTERVAL if bounded else max(len(term_postings), 1)
+            for start in range(0, len(term_postings), block_size):
+                if start and deadline.expired():
+                    deadline.skip('postings', len(term_postings) - start)
+                    break
+                block = term_postings[start:start + block_size] if bounded else term_postings
+                for posting in block:
+                    doc_id = posting['doc_id']
+                    if doc_id in doc_ids:
+                        if doc_id not in lengths:
+                            lengths[doc_id] = self.index_reader.get_document_length(doc_id)
 
-                    # Store TF-IDF instead of just TF
-                    doc_vectors[doc_id][term] = posting['tf'] * idf
+                        # Store the field weighted TF-IDF instead of just TF
+                        doc_vectors.setdefault(doc_id, {})[term] = self.term_weight(posting, lengths[doc_id]) * idf
 
         return doc_vectors
 
+    def term_weight(self, posting, length):
+        """
+        Calculate the BM25F-style weight of a term in a document.
+
+        Args:
+            posting: Posting of the term in the document, with its TF and field flags
+            length: Number of tokens of the document, 0 if the index doesn't record it
+
+        Returns:
+            Saturated, length normalized number of weighted occurrences
+        """
+        # TFs are relative to the document length, indexes without lengths keep the relative TF
+        occurrences = posting['tf'] * length if length else posting['tf']
+        fields = posting.get('fields', 0)
+        if fields:
+            occurrences += field_boost(fields, self.field_weights)
+        if self.average_length is None:
+            self.average_length = self.index_reader.get_average_document_length()
+        normalization = 1.0
+        if length and self.average_length:
+            normalization = 1 - self.b + self.b * length / self.average_length
+        return occurrences * (self.k1 + 1) / (occurrences + self.k1 * normalization)
+
     def cosine_similarity(self, query_vector, doc_vector):
         """
         Calculate cosine similarity between query and document vectors.
@@ -0,0 +1,55 @@
+import bisect
+from InvertedIndex.snippets import decode_snippet_record
+
+
+def make_snippet(record, query_terms, max_length=200):
+    """
+    Cut the query-biased snippet of a document: the sentence containing the most distinct
+    query terms (then the most query term occurrences), shortened around its first match.
+
+    Args:
+        record: Encoded snippet record of the document (see InvertedIndex/snippets.py)
+        query_terms: List of stemmed query terms
+        max_length: Maximum length of the snippet in characters, without ellipses
+
+    Returns:
+        The snippet text
+    """
+    text, sentence_starts, token_offsets, stems = decode_snippet_record(record)
+    query_terms = set(query_terms)
+
+    # Distinct query terms, occurrences and first match offset of each sentence with a match
+    sentences = {}
+    for token_offset, stem in zip(token_offsets, stems):
+        if stem in query_terms:
+            sentence = bisect.bisect_right(sentence_starts, token_offset) - 1
+            terms, count, first = sentences.get(sentence, (set(), 0, token_offset))
+            terms.add(stem)
+            sentences[sentence] = (terms, count + 1, first)
+
+    if not sentences:
+        return _shorten(text, 0, len(text), 0, max_length)
+    best = max(sentences, key=lambda sentence: (len(sentences[sentence][0]), sentences[sentence][1], -sentence))
+    start = sentence_starts[best]
+    end = sentence_starts[best + 1] if best + 1 < len(sentence_starts) else len(text)
+    return _shorten(text, start, end, sentences[best][2], max_length)
+
+
+def _shorten(text, start, end, match, max_length):
+    """Cut text[start:end] to at most max_length characters at word boundaries, keeping match in view"""
+    sentence = text[start:end].strip()
+    if len(sentence) <= max_length:
+        return sentence
+    # Start a little before the match, so it has some context
+    window_start = max(start, min(match - max_length // 4, end - max_length))
+    window_end = min(end, window_start + max_length)
+    if window_start > start:
+        space = text.find(' ', window_start, match if match > window_start else window_end)
+        if space != -1:
+            window_start = space + 1
+    if window_end < end:
+        space = text.rfind(' ', window_start, window_end)
+        if space > window_start:
+            window_end = space
+    snippet = text[window_start:window_end].strip()
+    return ('...' if window_start > start else '') + snippet + ('...' if window_end < end else '')
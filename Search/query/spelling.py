@@ -0,0 +1,183 @@
+import bisect
+import heapq
+import os
+import pickle
+import threading
+import time
+from InvertedIndex.spelling import SPELLING_NAME, trigrams
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance between two strings: insertions, deletions,
+    substitutions and transpositions of adjacent characters each cost 1. Only a band of
+    max_distance cells around the diagonal is computed.
+
+    Args:
+        a: First string
+        b: Second string
+        max_distance: Largest distance of interest
+
+    Returns:
+        The distance, or max_distance + 1 if it is larger than max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    too_far = max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = min(value, too_far)
+        if min(current) > max_distance:
+            return too_far
+        previous_previous, previous = previous, current
+    return previous[len(b)]
+
+
+class SpellingCorrector:
+    """
+    Finds the indexed terms closest to a misspelled term using the trigram index built by
+    InvertedIndex/spelling.py, without scanning the vocabulary. Only terms sharing enough
+    trigrams with the misspelled term, and with a length within the edit distance, are read,
+    and at most max_candidates of them are compared, which bounds the time of a lookup.
+    """
+    def __init__(self, path, max_distance=2, max_candidates=100):
+        """
+        Initialize the corrector. The spelling index is loaded on the first lookup.
+
+        Args:
+            path: Path to spelling.pkl
+            max_distance: Largest edit distance of a correction
+            max_candidates: Number of terms sharing the most trigrams compared by edit distance
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.max_candidates = max_candidates
+        self.terms = None
+        self.lock = threading.Lock()
+        # Lookup latency, so the cost of corrections can be monitored
+        self.lookups = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @classmethod
+    def open(cls, index_dir, **kwargs):
+        """
+        Get the corrector of an index if it has a spelling index.
+
+        Args:
+            index_dir: Directory of the index
+            kwargs: Keyword arguments for the corrector
+
+        Returns:
+            SpellingCorrector, or None if the index has no spelling index
+        """
+        path = os.path.join(index_dir, SPELLING_NAME)
+        return cls(path, **kwargs) if os.path.exists(path) else None
+
+    def load(self):
+        """Load the spelling index, once"""
+        with self.lock:
+            if self.terms is not None:
+                return
+            with open(self.path, 'rb') as f:
+                spelling_index = pickle.load(f)
+            self.document_frequencies = spelling_index['document_frequencies']
+            self.trigrams = spelling_index['trigrams']
+            self.terms = spelling_index['terms']
+
+    def has_term(self, term):
+        """
+        Check if a term is in the vocabulary.
+
+        Args:
+            term: The stemmed term
+
+        Returns:
+            Boolean indicating if the term is indexed
+        """
+        if self.terms is None:
+            self.load()
+        i = bisect.bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def correct(self, term):
+        """
+        Find the indexed term closest to a term, preferring the most frequent among equally close ones.
+
+        Args:
+            term: The stemmed term
+
+        Returns:
+            The correction, or None if no term is within max_distance
+        """
+        if self.terms is None:
+            self.load()
+        start_time = time.perf_counter()
+
+        # Every edit changes at most 3 trigrams of the term
+        grams = trigrams(term)
+        min_shared = max(1, len(grams) - 3 * self.max_distance)
+        shared = {}
+        for length in range(max(1, len(term) - self.max_distance), len(term) + self.max_distance + 1):
+            for gram in grams:
+                for term_id in self.trigrams.get((gram, length), ()):
+                    shared[term_id] = shared.get(term_id, 0) + 1
+        candidates = heapq.nlargest(self.max_candidates,
+                                    (term_id for term_id, count in shared.items() if count >= min_shared),
+                                    key=lambda term_id: (shared[term_id], self.document_frequencies[term_id]))
+
+        best = None
+        best_key = None
+        for term_id in candidates:
+            candidate = self.terms[term_id]
+            distance = edit_distance(term, candidate, self.max_distance)
+            if distance > self.max_distance or candidate == term:
+                continue
+            key = (distance, -self.document_frequencies[term_id])
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+
+        elapsed = time.perf_counter() - start_time
+        self.lookups += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        return best
+
+    def correct_terms(self, query_terms):
+        """
+        Replace the query terms missing from the index by their corrections.
+
+        Args:
+            query_terms: List of stemmed query terms, wildcard terms are left alone
+
+        Returns:
+            Dictionary mapping each corrected term to its correction
+        """
+        corrections = {}
+        for term in set(query_terms):
+            if term.endswith('*') or self.has_term(term):
+                continue
+            correction = self.correct(term)
+            if correction is not None:
+                corrections[term] = correction
+        return corrections
+
+    def stats(self):
+        """
+        Get the lookup latency of the corrector.
+
+        Returns:
+            Dictionary with the number of lookups and their mean and maximum time in milliseconds
+        """
+        return {'lookups': self.lookups,
+                'mean_ms': self.total_time / self.lookups * 1000 if self.lookups else 0.0,
+                'max_ms': self.max_time * 1000}
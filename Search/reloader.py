@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Files whose change signals a new index in the watched directory
+WATCHED_FILES = ['segments.json', 'token_positions.pkl', 'global_stats.pkl', 'suggest.bin']
+
+
+class SearchReloader:
+    """
+    Holds the live Search instance and replaces it with a freshly opened one without downtime.
+
+    A reload opens the new index in a background thread, warms its cache with the terms
+    and queries the live instance is serving, then swaps the reference. Requests that
+    already got the old instance finish on it, new requests get the new one. Requests
+    acquire the instance they use, and a replaced instance is closed once the last one
+    releases it.
+    """
+    def __init__(self, factory, index_dir='.', warmup_queries=200, on_reload=None):
+        """
+        Open the initial Search instance.
+
+        Args:
+            factory: Callable taking an index directory and returning a new Search instance
+            index_dir: Directory of the index to open
+            warmup_queries: Number of recent queries replayed on the new instance before the swap
+            on_reload: Optional callable run with the new generation number after each swap,
+                such as restarting the workers of a pre-fork server on the new index
+        """
+        self.factory = factory
+        self.index_dir = index_dir
+        self.warmup_queries = warmup_queries
+        self.on_reload = on_reload
+        self.search_engine = factory(index_dir)
+        self.generation = 0
+        self.reload_lock = threading.Lock()
+        # Recently searched query terms, most recent last, updated by concurrent requests
+        self.recent_queries = OrderedDict()
+        self.queries_lock = threading.Lock()
+        # Number of requests using each instance, and the replaced instances still in use
+        self.users = {}
+        self.retired = set()
+        self.users_lock = threading.Lock()
+        self.watch_thread = None
+
+    def get(self):
+        """
+        Get the live Search instance, without keeping it open. Requests use acquire() instead.
+
+        Returns:
+            The current Search instance
+        """
+        return self.search_engine
+
+    def acquire(self):
+        """
+        Get the live Search instance for a request, which must release() it once done.
+        The instance stays open until then, even if a reload replaces it meanwhile.
+
+        Returns:
+            The current Search instance
+        """
+        with self.users_lock:
+            search_engine = self.search_engine
+            self.users[search_engine] = self.users.get(search_engine, 0) + 1
+        return search_engine
+
+    def release(self, search_engine):
+        """
+        Release an instance got from acquire(), closing it if it was replaced and this was its last user.
+
+        Args:
+            search_engine: The Search instance to release
+        """
+        with self.users_lock:
+            self.users[search_engine] -= 1
+            if self.users[search_engine]:
+                return
+            del self.users[search_engine]
+            if search_engine not in self.retired:
+                return
+            self.retired.remove(search_engine)
+        search_engine.close()
+
+    @contextmanager
+    def using(self):
+        """Acquire the live Search instance for the duration of a with block"""
+        search_engine = self.acquire()
+        try:
+            yield search_engine
+        finally:
+            self.release(search_engine)
+
+    def record_query(self, query_terms):
+        """
+        Remember the terms of a served query so a reload can warm the new index with them.
+
+        Args:
+            query_terms: List of processed (stemmed) query terms
+        """
+        key = tuple(query_terms)
+        with self.queries_lock:
+            self.recent_queries[key] = None
+            self.recent_queries.move_to_end(key)
+            while len(self.recent_queries) > self.warmup_queries:
+                self.recent_queries.popitem(last=False)
+
+    def warm_up(self, old_engine, new_engine):
+        """
+        Load the terms cached by the old instance and replay recent queries on the new one,
+        so the swap doesn't start from a cold cache.
+
+        Args:
+            old_engine: The Search instance being replaced
+            new_engine: The newly opened Search instance
+        """
+        if old_engine.index_reader is not None and new_engine.index_reader is not None:
+            # Pair postings are cached under tuple keys, the replayed queries load them again
+            cached_terms = [key for key in list(old_engine.index_reader.cache.cache.keys()) if isinstance(key, str)]
+            new_engine.index_reader.get_postings_for_terms(cached_terms)
+        # The queries are replayed from a copy, requests keep recording new ones meanwhile
+        with self.queries_lock:
+            recent_queries = list(self.recent_queries)
+        for query_terms in recent_queries:
+            new_engine.top_k(list(query_terms), 5)
+
+    def reload(self, index_dir=None):
+        """
+        Open, warm up and swap in a new Search instance.
+
+        Args:
+            index_dir: Directory of the new index, defaults to the current one
+
+        Returns:
+            int: Generation number of the new instance
+        """
+        with self.reload_lock:
+            if index_dir is not None:
+                self.index_dir = index_dir
+            new_engine = self.factory(self.index_dir)
+            old_engine = self.search_engine
+            self.warm_up(old_engine, new_engine)
+
+            # Requests holding the old instance keep using it, the last one to release it closes it
+            with self.users_lock:
+                self.search_engine = new_engine
+                self.generation += 1
+                in_use = old_engine in self.users
+                if in_use:
+                    self.retired.add(old_engine)
+            if not in_use:
+                old_engine.close()
+            if self.on_reload is not None:
+                self.on_reload(self.generation)
+            return self.generation
+
+    def reload_in_background(self, index_dir=None):
+        """
+        Reload in a background thread.
+
+        Args:
+            index_dir: Directory of the new index, defaults to the current one
+
+        Returns:
+            The started reload thread
+        """
+        thread = threading.Thread(target=self.reload, args=(index_dir,), name="search-reloader", daemon=True)
+        thread.start()
+        return thread
+
+    def _index_signature(self):
+        """Get the resolved index directory and the modification times of its watched files"""
+        index_dir = os.path.realpath(self.index_dir)
+        mtimes = []
+        for file_name in WATCHED_FILES:
+            path = os.path.join(index_dir, file_name)
+            mtimes.append(os.path.getmtime(path) if os.path.exists(path) else None)
+        return index_dir, tuple(mtimes)
+
+    def watch(self, interval=5):
+        """
+        Reload whenever the index changes: when a watched file of the index directory is
+        rewritten, or when the index directory is a symlink that is switched to a new index.
+
+        Args:
+            interval: Seconds between checks
+
+        Returns:
+            The started watch thread
+        """
+        def watch_loop():
+            signature = self._index_signature()
+            while True:
+                time.sleep(interval)
+                new_signature = self._index_signature()
+                if new_signature == signature:
+                    continue
+                # Wait until the files stop changing before opening them
+                time.sleep(interval)
+                if self._index_signature() != new_signature:
+                    continue
+                try:
+                    self.reload()
+                    signature = new_signature
+                except Exception as e:
+                    print(f"Error reloading index: {e}")
+
+        self.watch_thread = threading.Thread(target=watch_loop, name="index-watcher", daemon=True)
+        self.watch_thread.start()
+        return self.watch_thread
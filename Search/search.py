@@ -1,8 +1,12 @@
-import time
+import threading
 from flask import Response
 from .summarizer import summarize
-from .query import Ranking, QueryProcessor
-from .indexing import IndexReader
+from .query import Ranking, QueryProcessor, SpellingCorrector, make_snippet
+from .query.deadline import Deadline
+from .query.ranking import DEFAULT_STATIC_WEIGHT
+from .indexing import IndexReader, Lexicon, SegmentedIndexReader, SuggestionReader
+from .shards import ShardCoordinator
+from .metrics import METRICS, current_trace, end_trace, start_trace
 #from nltk.corpus import stopwords
 
 
@@ -14,7 +18,8 @@ class Search:
     Uses a disk-based approach with O(1) token lookups.
     """
     def __init__(self, zip_path='zips/developer.zip', index_path='index.bin', urls_path='urls.json', 
-                 positions_path='token_positions.pkl', cache_size=100):
+                 positions_path='token_positions.pkl', cache_size=100, index_dir='.',
+                 global_stats_path=None, shards=None, field_weights=None, static_weight=DEFAULT_STATIC_WEIGHT):
         """
         Initialize the search component without loading the entire index.
         
@@ -23,61 +28,265 @@ class Search:
             urls_path: Path to the URLs mapping JSON file
             positions_path: Path to the token positions file
             cache_size: Number of terms to cache in memory
+            index_dir: Directory holding the index files, or the segments of an incremental index
+            global_stats_path: Path to the global statistics when searching a single shard
+            shards: Optional list of shard clients (see shards.py). When given, queries are
+                scattered to the shards and their top results gathered instead of
+                searching a local index. Wildcard terms are then expanded with the global
+                lexicon in index_dir, when the sharded index has one.
+            field_weights: Optional weight of each field (title, h1, h2, h3, bold) in the ranking,
+                see InvertedIndex/fields.py
+            static_weight: Influence of the static scores (PageRank) of the documents on their rank
         """
+        self.shard_coordinator = None
+        # Set once load() has loaded everything queries need, see is_ready()
+        self.ready = threading.Event()
+        # Autocomplete suggestions, when the index was built with them
+        self.suggestions = SuggestionReader.open(index_dir)
+        # Corrections of misspelled query terms, when the index was built with a spelling index
+        self.spelling = SpellingCorrector.open(index_dir)
+        if shards:
+            self.index_reader = None
+            self.query_processor = QueryProcessor(Lexicon.open(index_dir))
+            self.shard_coordinator = ShardCoordinator(shards)
+            return
+
         # Initialize components
-        self.index_reader = IndexReader(zip_path, index_path, urls_path, positions_path, cache_size)
+        if SegmentedIndexReader.is_segmented(index_dir):
+            self.index_reader = SegmentedIndexReader(index_dir, cache_size)
+        else:
+            self.index_reader = IndexReader(zip_path, index_path, urls_path, positions_path, cache_size,
+                                            index_dir=index_dir, global_stats_path=global_stats_path)
         self.query_processor = QueryProcessor(self.index_reader)
-        self.ranking = Ranking(self.index_reader.total_documents, self.index_reader)
+        self.ranking = Ranking(self.index_reader.total_documents, self.index_reader, field_weights,
+                               static_weight=static_weight)
 
-    def search(self, query_terms):
+    def search(self, query_terms, phrases=None, mode='and', min_results=1, timeout_ms=None):
         """
         Search for documents matching the query.
         
         Args:
-            query: The search query string
+            query_terms: List of processed (stemmed) query terms
+            phrases: Optional list of (phrase terms, slop) tuples the documents must also contain
+            mode: 'and' for documents containing all terms, 'or' for documents containing any,
+                'auto' for AND relaxed to the documents containing the most terms when fewer
+                than min_results documents contain them all
+            min_results: Number of results the 'auto' mode tries to reach
+            timeout_ms: Optional time budget in milliseconds. The terms are read rarest first,
+                and once the budget is spent the remaining terms and phrases are skipped
             
         Returns:
-            
+            Set of matching document IDs
         """
+        return self._search(query_terms, phrases, mode, min_results, Deadline(timeout_ms))[0]
+
+    def _search(self, query_terms, phrases, mode, min_results, deadline):
+        """
+        Search for documents matching the query, see search().
         
+        Returns:
+            Tuple of the matching document IDs and the pair postings of the query terms they
+            were found with, empty unless the documents are the AND result
+        """
         if not query_terms:
-            return []
+            return [], {}
 
-        # Get matching documents using boolean AND
-        matching_doc_ids = self.query_processor.boolean_and_search(query_terms)
+        with current_trace().stage('intersect'):
+            pair_postings = self.query_processor.pair_postings(query_terms) if mode != 'or' else {}
+        if mode == 'and' or pair_postings:
+            # Get matching documents using boolean AND, with a pair index the AND result of
+            # the 'auto' mode reads the small pair postings and is usually enough
+            with current_trace().stage('intersect'):
+                matching_doc_ids = self.query_processor.boolean_and_search(query_terms, pair_postings, deadline)
+            matching_doc_ids = self._phrase_filter(matching_doc_ids, phrases, deadline)
+            if mode == 'auto' and len(matching_doc_ids) < min_results:
+                # The pair postings only hold the documents containing both terms of their pair, the
+                # partial matches need the full postings. The AND result is reused, phrases included
+                pair_postings = {}
+                matching_doc_ids = self._relaxed_search(query_terms, phrases, mode, min_results, deadline,
+                                                        and_doc_ids=matching_doc_ids)
+        else:
+            matching_doc_ids = self._relaxed_search(query_terms, phrases, mode, min_results, deadline)
         
         if not matching_doc_ids:
-            return []
+            return [], {}
+        
+        return matching_doc_ids, pair_postings
+
+    def _phrase_filter(self, doc_ids, phrases, deadline):
+        """
+        Keep the documents containing every phrase, positions are only read for these documents.
+        The phrases left once the deadline passes aren't checked.
+        """
+        phrases = phrases or []
+        with current_trace().stage('phrase'):
+            for i, (phrase_terms, slop) in enumerate(phrases):
+                if not doc_ids:
+                    break
+                if deadline.expired():
+                    deadline.skip('phrases', len(phrases) - i)
+                    break
+                doc_ids = self.query_processor.phrase_search(phrase_terms, slop, doc_ids)
+        return doc_ids
+
+    def _relaxed_search(self, query_terms, phrases, mode, min_results, deadline, and_doc_ids=None):
+        """
+        Search for documents containing any of the terms, in a single pass over the postings.
         
+        Args:
+            query_terms: List of processed (stemmed) query terms
+            phrases: Optional list of (phrase terms, slop) tuples the documents must also contain
+            mode: 'or' to keep every matching document, 'auto' to keep only the documents
+                containing all terms unless fewer than min_results do
+            min_results: Number of results the 'auto' mode tries to reach
+            deadline: Deadline of the query
+            and_doc_ids: Optional AND result already found with the phrases checked, which has
+                fewer than min_results documents, so only the partial matches are added to it
+            
+        Returns:
+            Set of matching document IDs
+        """
+        with current_trace().stage('intersect'):
+            coverage, num_terms = self.query_processor.disjunctive_search(query_terms, deadline)
+        if mode == 'or':
+            return self._phrase_filter(set(coverage), phrases, deadline)
+
+        if and_doc_ids is not None:
+            matching_doc_ids = set(and_doc_ids)
+        else:
+            # The documents containing every term are the AND result
+            matching_doc_ids = self._phrase_filter({doc_id for doc_id, count in coverage.items()
+                                                    if count == num_terms}, phrases, deadline)
+            if len(matching_doc_ids) >= min_results:
+                return matching_doc_ids
+
+        # Relax to the best partial matches, adding documents by decreasing number of terms
+        by_count = {}
+        for doc_id, count in coverage.items():
+            if count < num_terms:
+                by_count.setdefault(count, set()).add(doc_id)
+        for count in sorted(by_count, reverse=True):
+            if len(matching_doc_ids) >= min_results:
+                break
+            matching_doc_ids |= self._phrase_filter(by_count[count], phrases, deadline)
         return matching_doc_ids
+
+    def top_k(self, query_terms, k, phrases=None, mode='and', deadline=None):
+        """
+        Get the k best ranked results for the query, from the local index or gathered from the shards.
+
+        Args:
+            query_terms: List of processed (stemmed) query terms
+            k: Number of results to return
+            phrases: Optional list of (phrase terms, slop) tuples the documents must contain
+            mode: 'and', 'or' or 'auto', see search()
+            deadline: Optional Deadline of the query. Once it passes, the best results scored
+                so far are returned and the work skipped is recorded in it
+
+        Returns:
+            Tuple of the total number of matching documents and a list of
+            (doc_id, url, score, tf_idf_info) tuples
+        """
+        deadline = deadline if deadline is not None else Deadline()
+        if self.shard_coordinator is not None:
+            # Wildcard terms are expanded once, so every shard scores the same terms
+            query_terms = self.query_processor.expand_prefixes(query_terms)
+            phrases = [(self.query_processor.expand_prefixes(phrase_terms), slop)
+                       for phrase_terms, slop in phrases or []]
+            with current_trace().stage('shards'):
+                return self.shard_coordinator.top_k(query_terms, k, phrases, mode, deadline)
+
+        results, pair_postings = self._search(query_terms, phrases, mode, k, deadline)
+        if not results:
+            return 0, []
+        term_groups = self.query_processor.expand_terms(query_terms)
+        expanded_terms = [term for group in term_groups for term in group]
+        with current_trace().stage('score'):
+            # Outside of the AND mode, documents containing more of the query terms come first
+            ranked_results = self.ranking.rank_results(results, expanded_terms, pair_postings, deadline, k,
+                                                       term_groups=term_groups if mode != 'and' else None)
+        return len(results), ranked_results
     
-    def get_formatted_results(self, query, jsonify, offset=0, limit=5) -> Response: # Add offset and limit parameters
+    def get_formatted_results(self, query, jsonify, offset=0, limit=5, mode='auto', debug=False,
+                              timeout_ms=None) -> Response: # Add offset and limit parameters
         """
         Get search results in a formatted manner for display.
+        Every stage of the query is timed and added to the /metrics histograms.
         
         Args:
             query: The search query string
             offset: Starting index for results (for pagination)
             limit: Maximum number of results to display
+            mode: 'and', 'or' or 'auto' (AND relaxed to the best partial matches), see search()
+            debug: Whether to add the time of each stage and the postings I/O of the query to the response
+            timeout_ms: Optional time budget of the query in milliseconds. When it runs out, the best
+                results found so far are returned with partial set and the work skipped
         """
-        # Process query
-        query_terms = self.query_processor.tokenize_query(query)
-        start_time = time.time()
-        results = self.search(query_terms)
-        query_time = time.time() - start_time
-        ranked_results = self.ranking.rank_results(results, query_terms) # Renamed to avoid confusion
-        
-        # Apply pagination using offset and limit
-        paginated_results = ranked_results[offset : offset + limit]
-        
-        formatted_results = [ {
-            "doc_id": doc_id,
-            "url": url,
-            "score": score,
-            "tf_idf_info": tf_idf_info
-        } for doc_id, url, score, tf_idf_info in paginated_results
-        ]
-        return jsonify({"results": formatted_results, "total": len(ranked_results), "query_time": query_time})
+        deadline = Deadline(timeout_ms)
+        trace, token = start_trace()
+        try:
+            # Process query
+            with trace.stage('tokenize'):
+                parsed_query = self.query_processor.parse_query(query)
+
+            # Terms missing from the index are replaced by their closest indexed term
+            did_you_mean = None
+            if self.spelling is not None:
+                with trace.stage('spelling'):
+                    corrections = self.spelling.correct_terms(parsed_query.terms)
+                if corrections:
+                    parsed_query = self.query_processor.correct_query(parsed_query, corrections)
+                    did_you_mean = self.query_processor.rewrite_query(query, corrections)
+            total, ranked_results = self.top_k(parsed_query.terms, offset + limit, parsed_query.phrases, mode,
+                                               deadline)
+            
+            # Apply pagination using offset and limit
+            paginated_results = ranked_results[offset : offset + limit]
+            # Snippets are only cut for the displayed results
+            with trace.stage('snippets'):
+                snippets = self.get_snippets([doc_id for doc_id, _, _, _ in paginated_results], parsed_query.terms)
+            
+            formatted_results = [ {
+                "doc_id": doc_id,
+                "url": url,
+                "score": score,
+                "tf_idf_info": tf_idf_info,
+                "snippet": snippets.get(doc_id)
+            } for doc_id, url, score, tf_idf_info in paginated_results
+            ]
+            # The query time covers everything but the serialization of the response
+            response = {"results": formatted_results, "total": total, "query_time": trace.elapsed(),
+                        "did_you_mean": did_you_mean, "partial": deadline.partial}
+            if deadline.partial:
+                response["deadline"] = deadline.stats()
+            if debug:
+                response["debug"] = trace.breakdown()
+            with trace.stage('serialize'):
+                response = jsonify(response)
+        finally:
+            end_trace(token)
+        METRICS.observe(trace)
+        return response
+
+    def get_snippets(self, doc_ids, query_terms):
+        """
+        Get the query-biased snippets of some documents, from the text stored at index time.
+
+        Args:
+            doc_ids: List of document IDs
+            query_terms: List of processed query terms
+
+        Returns:
+            Dictionary mapping document IDs to their snippets, without the documents
+            indexed without snippets
+        """
+        if self.shard_coordinator is not None:
+            query_terms = self.query_processor.expand_prefixes(query_terms)
+            with current_trace().stage('shards'):
+                return self.shard_coordinator.get_snippets(doc_ids, query_terms)
+        query_terms = self.query_processor.expand_query(query_terms)
+        return {doc_id: make_snippet(record, query_terms)
+                for doc_id, record in self.index_reader.get_snippet_records(doc_ids).items()}
 
     def print_results(self, results, limit=10):
         """
@@ -103,6 +312,61 @@ class Search:
         if len(results) > limit:
             print(f"... and {len(results) - limit} more results.")
 
+    def load(self):
+        """
+        Load everything queries need: the stemmer, the index structures and the spelling index.
+        Opening a Search instance only maps its files, these are otherwise loaded by the first query.
+        """
+        self.query_processor.load()
+        if self.shard_coordinator is not None:
+            self.shard_coordinator.load()
+        if self.index_reader is not None:
+            self.index_reader.load()
+        if self.spelling is not None:
+            self.spelling.load()
+        self.ready.set()
+
+    def preload_in_background(self):
+        """
+        Run load() in a background thread, so the instance can be served before it finishes.
+
+        Returns:
+            The started loading thread
+        """
+        thread = threading.Thread(target=self.load, name="search-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self):
+        """Check whether load() has finished, so queries won't wait for any structure to load"""
+        return self.ready.is_set()
+
+    def close(self):
+        """
+        Release the resources held by this instance, such as shard processes.
+        """
+        if self.shard_coordinator is not None:
+            self.shard_coordinator.close()
+        if self.index_reader is not None:
+            self.index_reader.close()
+        if self.suggestions is not None:
+            self.suggestions.close()
+
+    def suggest(self, prefix, limit=None):
+        """
+        Get autocomplete suggestions for the text typed so far.
+
+        Args:
+            prefix: Text to complete
+            limit: Maximum number of suggestions
+
+        Returns:
+            List of suggested queries, best first, empty if the index has no suggestions
+        """
+        if self.suggestions is None:
+            return []
+        return self.suggestions.suggest(prefix, limit)
+
     def get_summary(self, site_id, api_key, jsonify):
         """
         Get a summary of the indexed site using the OpenAI API.
@@ -112,7 +376,10 @@ class Search:
             api_key: The OpenAI API key for authentication
             jsonify: Function to jsonify the response
         """
-        file_content = self.index_reader.get_document_contents(site_id)
+        if self.shard_coordinator is not None:
+            file_content = self.shard_coordinator.get_document_contents(site_id)
+        else:
+            file_content = self.index_reader.get_document_contents(site_id)
         summary = summarize(file_content, api_key)
         if summary:
             return jsonify({"summary": summary})
@@ -0,0 +1,327 @@
+import glob
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from .query.deadline import Deadline
+from .query.ranking import DEFAULT_STATIC_WEIGHT, count_matched_groups
+
+
+class LocalShard:
+    """
+    A shard searched in-process by its own Search instance.
+    """
+    def __init__(self, **search_kwargs):
+        """
+        Initialize the shard.
+
+        Args:
+            search_kwargs: Keyword arguments for the shard's Search instance
+        """
+        from .search import Search
+        self.search = Search(**search_kwargs)
+
+    def top_k(self, query_terms, k, phrases=None, mode='and', deadline=None):
+        """Get the total number of matches and the k best results of the shard"""
+        return self.search.top_k(query_terms, k, phrases, mode, deadline)
+
+    def get_snippets(self, doc_ids, query_terms):
+        """Get the snippets of documents stored in the shard"""
+        return self.search.get_snippets(doc_ids, query_terms)
+
+    def get_document_contents(self, doc_id):
+        """Get the contents of a document stored in the shard"""
+        return self.search.index_reader.get_document_contents(doc_id)
+
+    def load(self):
+        """Load the index structures of the shard"""
+        self.search.load()
+
+    def close(self):
+        """Nothing to release for an in-process shard"""
+
+
+def _shard_worker(conn, search_kwargs):
+    """
+    Worker loop of a ProcessShard: opens the shard and answers requests from the pipe
+    until it receives None.
+
+    Args:
+        conn: Child end of the pipe
+        search_kwargs: Keyword arguments for the shard's Search instance
+    """
+    from .search import Search
+    search = Search(**search_kwargs)
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            if method == 'top_k':
+                # The last argument is the time left to the deadline, the work skipped is sent back
+                *top_k_args, timeout_ms = args
+                deadline = Deadline(timeout_ms)
+                conn.send((True, search.top_k(*top_k_args, deadline=deadline) + (deadline.skipped,)))
+            elif method == 'get_snippets':
+                conn.send((True, search.get_snippets(*args)))
+            elif method == 'load':
+                conn.send((True, search.load()))
+            else:
+                conn.send((True, search.index_reader.get_document_contents(*args)))
+        except Exception as e:
+            conn.send((False, repr(e)))
+    conn.close()
+
+
+class ProcessShard:
+    """
+    A shard searched by a dedicated local process, so shards rank in parallel
+    instead of sharing one interpreter.
+    """
+    def __init__(self, **search_kwargs):
+        """
+        Start the shard process.
+
+        Args:
+            search_kwargs: Keyword arguments for the shard's Search instance
+        """
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_shard_worker, args=(child_conn, search_kwargs),
+                                               daemon=True)
+        self.process.start()
+        child_conn.close()
+        # One request at a time may use the pipe
+        self.lock = threading.Lock()
+
+    def _call(self, method, *args):
+        """Send a request to the shard process and wait for its answer"""
+        with self.lock:
+            self.conn.send((method, args))
+            ok, value = self.conn.recv()
+        if not ok:
+            raise RuntimeError(f"Shard process failed: {value}")
+        return value
+
+    def top_k(self, query_terms, k, phrases=None, mode='and', deadline=None):
+        """Get the total number of matches and the k best results of the shard"""
+        timeout_ms = deadline.remaining_ms() if deadline is not None else None
+        total, results, skipped = self._call('top_k', query_terms, k, phrases, mode, timeout_ms)
+        if deadline is not None:
+            deadline.add_skipped(skipped)
+        return total, results
+
+    def get_snippets(self, doc_ids, query_terms):
+        """Get the snippets of documents stored in the shard"""
+        return self._call('get_snippets', doc_ids, query_terms)
+
+    def get_document_contents(self, doc_id):
+        """Get the contents of a document stored in the shard"""
+        return self._call('get_document_contents', doc_id)
+
+    def load(self):
+        """Load the index structures of the shard process, returning once they are loaded"""
+        self._call('load')
+
+    def close(self):
+        """Stop the shard process"""
+        with self.lock:
+            self.conn.send(None)
+        self.process.join()
+
+
+class HttpShard:
+    """
+    A shard served by another search server (see the /shard_search endpoint of search_server.py).
+    """
+    def __init__(self, base_url, timeout=5):
+        """
+        Initialize the shard client.
+
+        Args:
+            base_url: Base URL of the shard's search server, e.g. http://localhost:5001
+            timeout: Request timeout in seconds
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _get(self, path, params):
+        """Send a GET request to the shard and decode its JSON response"""
+        url = f"{self.base_url}{path}?{urllib.parse.urlencode(params)}"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def top_k(self, query_terms, k, phrases=None, mode='and', deadline=None):
+        """Get the total number of matches and the k best results of the shard"""
+        # The wildcard terms expanded by the coordinator are sent as lists of terms
+        params = {'terms': json.dumps(query_terms), 'k': k, 'phrases': json.dumps(phrases or []), 'mode': mode}
+        if deadline is not None and deadline.bounded:
+            # The shard server gets the time left, its own processing is bounded like a local shard's
+            params['timeout_ms'] = deadline.remaining_ms()
+        data = self._get('/shard_search', params)
+        if deadline is not None:
+            deadline.add_skipped(data.get('skipped', {}))
+        return data['total'], [tuple(result) for result in data['results']]
+
+    def get_snippets(self, doc_ids, query_terms):
+        """Get the snippets of documents stored in the shard"""
+        data = self._get('/shard_snippets', {'ids': ','.join(map(str, doc_ids)), 'terms': json.dumps(query_terms)})
+        # JSON object keys are strings
+        return {int(doc_id): snippet for doc_id, snippet in data['snippets'].items()}
+
+    def get_document_contents(self, doc_id):
+        """Get the contents of a document stored in the shard"""
+        return self._get('/shard_document', {'id': doc_id}).get('content')
+
+    def load(self):
+        """Nothing to load, the shard server loads its own index"""
+
+    def close(self):
+        """Nothing to release for an HTTP shard"""
+
+
+class ShardCoordinator:
+    """
+    Scatter-gather execution over document-partitioned shards: every query is sent to
+    all shards in parallel and their top-k lists are merged into the global top-k.
+    """
+    def __init__(self, shards):
+        """
+        Initialize the coordinator.
+
+        Args:
+            shards: List of shard clients, in shard order (document ID % number of shards)
+        """
+        self.shards = shards
+        self.executor = ThreadPoolExecutor(max_workers=len(shards))
+
+    def top_k(self, query_terms, k, phrases=None, mode='and', deadline=None):
+        """
+        Get the k best results over all shards.
+
+        Args:
+            query_terms: List of processed (stemmed) query terms, the wildcard terms expanded
+                with the global lexicon (see QueryProcessor.expand_prefixes())
+            k: Number of results to return
+            phrases: Optional list of (phrase terms, slop) tuples the documents must contain
+            mode: 'and', 'or' or 'auto', see Search.search()
+            deadline: Optional Deadline of the query, every shard stops at the same time
+                and the work they skipped is added to it
+
+        Returns:
+            Tuple of the total number of matches and a list of the k best
+            (doc_id, url, score, tf_idf_info) tuples
+        """
+        deadline = deadline if deadline is not None else Deadline()
+        # Each shard skips the terms it didn't read itself
+        shard_deadlines = [deadline.child() for _ in self.shards]
+        shard_results = list(self.executor.map(lambda shard, shard_deadline: shard.top_k(query_terms, k, phrases,
+                                                                                         mode, shard_deadline),
+                                               self.shards, shard_deadlines))
+        for shard_deadline in shard_deadlines:
+            deadline.add_skipped(shard_deadline.skipped)
+        total = sum(shard_total for shard_total, _ in shard_results)
+        all_results = list(itertools.chain.from_iterable(results for _, results in shard_results))
+        if mode == 'and':
+            merged = heapq.nlargest(k, all_results, key=lambda result: result[2])
+        else:
+            # Like a single index, documents containing more of the query terms come first
+            term_groups = self._term_groups(query_terms, all_results)
+            merged = heapq.nlargest(k, all_results,
+                                    key=lambda result: (count_matched_groups(result[3], term_groups), result[2]))
+        return total, merged
+
+    def _term_groups(self, query_terms, results):
+        """
+        Get the terms of each query term, to count the query terms of the results like the shards do.
+        A wildcard term left for the shards to expand, without a global lexicon, gets the terms
+        of the results starting with its prefix.
+        """
+        result_terms = {term for result in results for term in result[3]}
+        term_groups = []
+        for term in query_terms:
+            if isinstance(term, tuple):
+                term_groups.append(list(term))
+            elif term.endswith('*'):
+                term_groups.append([result_term for result_term in result_terms if result_term.startswith(term[:-1])])
+            else:
+                term_groups.append([term])
+        return term_groups
+
+    def get_snippets(self, doc_ids, query_terms):
+        """
+        Get the snippets of documents from the shards they are partitioned to, in parallel.
+
+        Args:
+            doc_ids: List of document IDs
+            query_terms: List of processed query terms
+
+        Returns:
+            Dictionary mapping document IDs to their snippets
+        """
+        by_shard = {}
+        for doc_id in doc_ids:
+            by_shard.setdefault(int(doc_id) % len(self.shards), []).append(doc_id)
+        snippets = {}
+        for shard_snippets in self.executor.map(lambda item: self.shards[item[0]].get_snippets(item[1], query_terms),
+                                                by_shard.items()):
+            snippets.update(shard_snippets)
+        return snippets
+
+    def get_document_contents(self, doc_id):
+        """Get the contents of a document from the shard it is partitioned to"""
+        return self.shards[int(doc_id) % len(self.shards)].get_document_contents(doc_id)
+
+    def load(self):
+        """Load the index structures of every shard, in parallel"""
+        list(self.executor.map(lambda shard: shard.load(), self.shards))
+
+    def close(self):
+        """Release all shards"""
+        for shard in self.shards:
+            shard.close()
+        self.executor.shutdown()
+
+
+def find_shard_dirs(index_dir):
+    """
+    Find the shard directories of a sharded index, in shard order.
+
+    Args:
+        index_dir: Directory of the sharded index
+
+    Returns:
+        List of shard directory paths
+    """
+    shard_dirs = glob.glob(os.path.join(index_dir, 'shard_*'))
+    return sorted(shard_dirs, key=lambda path: int(re.search(r'shard_(\d+)$', path).group(1)))
+
+
+def open_shards(index_dir, zip_path, mode='thread', cache_size=100, field_weights=None,
+                static_weight=DEFAULT_STATIC_WEIGHT):
+    """
+    Open every shard of a sharded index built with start_index.py --shards.
+
+    Args:
+        index_dir: Directory of the sharded index
+        zip_path: Path to the ZIP of indexed documents
+        mode: 'thread' to search shards in this process, 'process' for one local process per shard
+        cache_size: Number of terms each shard caches in memory
+        field_weights: Optional weight of each field in the ranking of every shard
+        static_weight: Influence of the static scores in the ranking of every shard
+
+    Returns:
+        List of shard clients
+    """
+    shard_class = ProcessShard if mode == 'process' else LocalShard
+    global_stats_path = os.path.join(index_dir, 'global_stats.pkl')
+    return [shard_class(zip_path=zip_path, index_dir=shard_dir, cache_size=cache_size,
+                        global_stats_path=global_stats_path, field_weights=field_weights,
+                        static_weight=static_weight)
+            for shard_dir in find_shard_dirs(index_dir)]
@@ -1,5 +1,3 @@
-from google import genai
-
 def truncate_text(text, max_tokens=50000):
     """Truncate text to stay within token limit"""
     char_limit = max_tokens * 4  # Rough estimate of chars per token
@@ -12,6 +10,8 @@ def summarize(text_context, api_key):
     truncated_text = truncate_text(text_context)
     
     prompt = f"\n\n{truncated_text}"
+    # Imported here, the client library takes most of a second to import and few requests need it
+    from google import genai
     client = genai.Client(api_key=api_key)
     response = client.models.generate_content(
         model="gemini-2.0-flash",
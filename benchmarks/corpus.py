@@ -0,0 +1,92 @@
+import argparse
+import itertools
+import json
+import random
+import zipfile
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vi', 'so', 'pe', 'da', 'gu', 'zo', 'fi', 'ba', 'xe',
+             'cor', 'tin', 'mar', 'pol', 'sen', 'dra', 'qui', 'hel', 'ost', 'ven']
+
+
+def make_vocabulary(size, rng):
+    """
+    Make a vocabulary of distinct pseudo-words.
+    Args:
+        size: Number of words
+        rng: random.Random instance
+    Returns:
+        List of words, the most frequent first
+    """
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def generate_corpus(path, num_docs=1000, vocab_size=20000, doc_length=300, zipf_exponent=1.1,
+                    links_per_doc=5, seed=0):
+    """
+    Write a deterministic synthetic crawl to a ZIP in the format read by ZipHandler: one JSON
+    line per page, holding its URL and HTML content, in its own file like the real crawls. Words follow a Zipfian distribution, so
+    postings sizes look like those of a real crawl, with a few huge and many tiny lists.
+    The same arguments always produce the same ZIP.
+    Args:
+        path: Path of the ZIP to write
+        num_docs: Number of pages
+        vocab_size: Number of distinct words
+        doc_length: Average number of words per page
+        zipf_exponent: Exponent of the word frequency distribution
+        links_per_doc: Number of links from each page to other pages
+        seed: Random seed
+    Returns:
+        dict: The parameters of the corpus
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocab_size, rng)
+    cumulative_weights = list(itertools.accumulate(1 / rank ** zipf_exponent for rank in range(1, vocab_size + 1)))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for doc_id in range(num_docs):
+            length = max(10, int(rng.gauss(doc_length, doc_length / 3)))
+            words = rng.choices(vocabulary, cum_weights=cumulative_weights, k=length)
+            title = ' '.join(words[:4])
+            sentences = []
+            for start in range(4, length, 12):
+                sentence = ' '.join(words[start:start + 12])
+                sentences.append(sentence[:1].upper() + sentence[1:] + '.')
+            paragraphs = [' '.join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+            links = ''.join(f'<a href="https://bench.example.com/page{rng.randrange(num_docs)}">{rng.choice(vocabulary)}</a> '
+                            for _ in range(links_per_doc))
+            content = (f"<html><head><title>{title}</title></head><body><h1>{title}</h1>"
+                       + ''.join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+                       + f"<div>{links}</div></body></html>")
+            page = {'url': f"https://bench.example.com/page{doc_id}", 'content': content, 'encoding': 'utf-8'}
+            # A fixed timestamp keeps the ZIP byte for byte identical across runs
+            member = zipfile.ZipInfo(f"bench/page{doc_id:07d}.json", date_time=(1980, 1, 1, 0, 0, 0))
+            member.compress_type = zipfile.ZIP_DEFLATED
+            zip_file.writestr(member, json.dumps(page) + '\n')
+
+    return {'num_docs': num_docs, 'vocab_size': vocab_size, 'doc_length': doc_length,
+            'zipf_exponent': zipf_exponent, 'links_per_doc': links_per_doc, 'seed': seed}
+
+
+def main():
+    """Command-line interface to generate a synthetic corpus"""
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic crawl ZIP.")
+    parser.add_argument('path', help="path of the ZIP to write")
+    parser.add_argument('--docs', type=int, default=1000, help="number of pages")
+    parser.add_argument('--vocab', type=int, default=20000, help="number of distinct words")
+    parser.add_argument('--length', type=int, default=300, help="average number of words per page")
+    parser.add_argument('--zipf', type=float, default=1.1, help="exponent of the word frequency distribution")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    generate_corpus(args.path, args.docs, args.vocab, args.length, args.zipf, seed=args.seed)
+    print(f"Wrote {args.docs} pages to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from statistics import median
+
+# Run from the repository root: python -m benchmarks.run_benchmarks
+from nltk.stem import PorterStemmer
+from InvertedIndex import generate_index
+from InvertedIndex.file import FileOpener
+from InvertedIndex.index import InvertedIndex, tokenize_chunk
+from InvertedIndex.index_manager import IndexManager
+from Search import Search
+from Search.indexing import IndexReader
+from .corpus import generate_corpus, make_vocabulary
+
+# Results whose name ends with one of these are better when higher, all others when lower
+HIGHER_IS_BETTER = ('_per_sec',)
+# Run by a fresh interpreter to measure a cold start: the imports, opening the index and a first query
+COLD_START_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from Search import Search
+imported = time.perf_counter()
+search = Search(index_dir=sys.argv[1])
+opened = time.perf_counter()
+search.get_formatted_results(sys.argv[2], lambda response: response)
+answered = time.perf_counter()
+print(json.dumps([imported - start, opened - start, answered - start]))
+'''
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile of some measurements with the nearest-rank method.
+    Args:
+        values: List of measurements
+        fraction: Percentile as a fraction, 0.99 for p99
+    Returns:
+        The smallest measurement that at least this fraction of the measurements are lower or equal to
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def latency_summary(latencies_ms):
+    """Summarize latencies in milliseconds as their count, mean and p50/p95/p99"""
+    return {
+        'count': len(latencies_ms),
+        'mean_ms': sum(latencies_ms) / len(latencies_ms),
+        'p50_ms': percentile(latencies_ms, 0.50),
+        'p95_ms': percentile(latencies_ms, 0.95),
+        'p99_ms': percentile(latencies_ms, 0.99),
+    }
+
+
+def timed(function, *args, **kwargs):
+    """Call a function, returning its result and how long it took in seconds"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_tokenization(zip_path):
+    """
+    Measure the tokenization throughput, in one process and with the process pool of InvertedIndex.
+    Args:
+        zip_path: Path to the corpus ZIP
+    Returns:
+        dict: Documents per second of each, and the tokenized batch, document lengths and term
+            dictionary for the next benchmarks
+    """
+    file_opener = FileOpener(zip_path, simhash_threshold=0)
+    documents = file_opener.read_zip()
+    file_opener.close()
+
+    _, single_seconds = timed(tokenize_chunk, documents, PorterStemmer(), fields={})
+    index = InvertedIndex()
+    index.documents = documents
+    batch_tfs, pool_seconds = timed(index.tokenize_documents)
+    return {
+        'documents': len(documents),
+        'tokenize_single_process_docs_per_sec': len(documents) / single_seconds,
+        'tokenize_pool_docs_per_sec': len(documents) / pool_seconds,
+    }, batch_tfs, index.document_lengths, index.terms
+
+
+def bench_partial_indexes(batch_tfs, document_lengths, terms, work_dir, partial_index_count=3):
+    """
+    Measure writing partial indexes from tokenized documents and merging them.
+    Args:
+        batch_tfs: Dictionary mapping (URL, file name) to term IDs, frequencies and field flags, from tokenization
+        document_lengths: Dictionary mapping (URL, file name) to the number of tokens of the documents
+        terms: Term dictionary of the term IDs
+        work_dir: Scratch directory for the partial indexes
+        partial_index_count: Number of partial indexes to split the documents into
+    Returns:
+        dict: Time to write the partial indexes and to merge them, and the merge throughput
+    """
+    directory = os.path.join(work_dir, 'partial')
+    os.makedirs(directory)
+    index_manager = IndexManager(directory)
+    index_manager.terms = terms
+    documents = list(batch_tfs.items())
+    batch_size = -(-len(documents) // partial_index_count)
+    write_seconds = 0.0
+    for i in range(partial_index_count):
+        batch = dict(documents[i * batch_size:(i + 1) * batch_size])
+        _, seconds = timed(index_manager.create_and_save_partial_index, batch, i, batch_lengths=document_lengths)
+        write_seconds += seconds
+    _, merge_seconds = timed(index_manager.merge_partial_indexes, partial_index_count)
+    shutil.rmtree(directory)
+    return {
+        'partial_write_ms': write_seconds * 1000,
+        'partial_write_docs_per_sec': len(documents) / write_seconds,
+        'merge_ms': merge_seconds * 1000,
+        'merge_docs_per_sec': len(documents) / merge_seconds,
+    }
+
+
+def bench_generate_index(zip_path, index_dir, num_documents):
+    """Measure building the whole index of the corpus, returning its throughput"""
+    _, seconds = timed(generate_index, zip_path, sim_hash=0, index_dir=index_dir)
+    return {'generate_index_ms': seconds * 1000, 'generate_index_docs_per_sec': num_documents / seconds}
+
+
+def bench_startup(index_dir, repeat=5):
+    """
+    Measure the median time to open an IndexReader and a Search over the index, and to load
+    the structures the reader defers to the first query
+    """
+    reader_times = []
+    load_times = []
+    search_times = []
+    for _ in range(repeat):
+        reader, seconds = timed(IndexReader, index_dir=index_dir)
+        reader_times.append(seconds * 1000)
+        _, seconds = timed(reader.load)
+        load_times.append(seconds * 1000)
+        reader.close()
+        search, seconds = timed(Search, index_dir=index_dir)
+        search.close()
+        search_times.append(seconds * 1000)
+    return {'index_reader_startup_ms': median(reader_times), 'index_load_ms': median(load_times),
+            'search_startup_ms': median(search_times)}
+
+
+def bench_cold_start(index_dir, query, repeat=3):
+    """
+    Measure the cold start of a search worker in fresh interpreters, as the median of a few runs.
+    Args:
+        index_dir: Directory of the index
+        query: Query of the first request
+        repeat: Number of interpreters started
+    Returns:
+        dict: Time to import Search, to open the index and to answer the first query, from the start
+    """
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, os.path.abspath(index_dir), query],
+                                cwd=repository, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'cold_import_ms': median(run[0] for run in runs) * 1000,
+        'cold_open_ms': median(run[1] for run in runs) * 1000,
+        'time_to_first_query_ms': median(run[2] for run in runs) * 1000,
+    }
+
+
+def make_query_sets(corpus, num_queries, seed):
+    """
+    Make the query sets of the benchmark from the corpus vocabulary, which is ordered from the
+    most to the least frequent word.
+    Args:
+        corpus: Parameters of the corpus, as returned by generate_corpus
+        num_queries: Number of queries in each set
+        seed: Random seed
+    Returns:
+        dict: Dictionary mapping query set names to lists of queries
+    """
+    vocabulary = make_vocabulary(corpus['vocab_size'], random.Random(corpus['seed']))
+    rng = random.Random(seed)
+    head = vocabulary[:50]
+    # Words ranked past the first few percent appear in only a handful of documents
+    rare = vocabulary[len(vocabulary) // 20:len(vocabulary) // 10]
+    body = vocabulary[:len(vocabulary) // 20]
+    return {
+        'single_term': [rng.choice(body) for _ in range(num_queries)],
+        'multi_term': [' '.join(rng.sample(body, rng.randint(2, 4))) for _ in range(num_queries)],
+        'head': [' '.join(rng.sample(head, 2)) for _ in range(num_queries)],
+        'rare': [rng.choice(rare) for _ in range(num_queries)],
+    }
+
+
+def bench_queries(index_dir, query_sets, limit=10):
+    """
+    Measure the latency of every query set through Search, formatting the first page of results.
+    The first queries of each set are run once to warm up the caches, then all are timed.
+    Args:
+        index_dir: Directory of the index
+        query_sets: Dictionary mapping query set names to lists of queries
+        limit: Number of results per page
+    Returns:
+        dict: Dictionary mapping query set names to their latency summaries
+    """
+    search = Search(index_dir=index_dir)
+    jsonify = lambda response: response
+    results = {}
+    for name, queries in query_sets.items():
+        for query in queries[:10]:
+            search.get_formatted_results(query, jsonify, limit=limit)
+        latencies = []
+        for query in queries:
+            _, seconds = timed(search.get_formatted_results, query, jsonify, limit=limit)
+            latencies.append(seconds * 1000)
+        results[name] = latency_summary(latencies)
+    search.close()
+    return results
+
+
+def _serving_client(port, queries, seconds):
+    """Send queries to a search server one after the other for some seconds, returning how many were answered"""
+    answered = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        params = urllib.parse.urlencode({'q': queries[answered % len(queries)], 'limit': 10})
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/search?{params}") as response:
+            response.read()
+        answered += 1
+    return answered
+
+
+def process_tree_pss(pid):
+    """
+    Get the proportional set size of a process and its children: the memory they share is
+    divided between them, so it is counted once in the sum.
+    Args:
+        pid: Process ID
+    Returns:
+        int: PSS in bytes, or None where /proc isn't available
+    """
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children', 'r') as f:
+            children = [int(child) for child in f.read().split()]
+        pss = 0
+        for process in [pid] + children:
+            with open(f'/proc/{process}/smaps_rollup', 'r') as f:
+                pss += next(int(line.split()[1]) for line in f if line.startswith('Pss:')) * 1024
+        return pss
+    except (OSError, StopIteration):
+        return None
+
+
+def bench_serving(index_dir, queries, workers, seconds=5, clients_per_worker=2):
+    """
+    Measure the throughput and memory of search_server.py serving the index with some worker processes.
+    Args:
+        index_dir: Directory of the index
+        queries: List of queries the clients send
+        workers: Number of worker processes of the server
+        seconds: Duration of the measurement
+        clients_per_worker: Number of client processes sending queries, per worker
+    Returns:
+        dict: Queries answered per second, and the PSS of the server processes in MB
+    """
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, INDEX_DIR=os.path.abspath(index_dir), WORKERS=str(workers), HOST='127.0.0.1',
+               PORT=str(port))
+    server = subprocess.Popen([sys.executable, 'search_server.py'], cwd=repository, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.perf_counter() + 60
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready") as response:
+                    response.read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if time.perf_counter() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"The search server with {workers} workers didn't start")
+                time.sleep(0.2)
+        clients = workers * clients_per_worker
+        with multiprocessing.Pool(clients) as pool:
+            answered = pool.starmap(_serving_client, [(port, queries, seconds)] * clients)
+        pss = process_tree_pss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return {'queries_per_sec': sum(answered) / seconds, 'pss_mb': pss / 2 ** 20 if pss is not None else None}
+
+
+def run_metadata():
+    """Describe the machine and the code the benchmarks ran on"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def flatten(results, prefix=''):
+    """Flatten nested result dictionaries to {'section.name': value} for comparisons"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(previous, current, threshold=0.1):
+    """
+    Print the change of every measurement since a previous run, flagging regressions.
+    Args:
+        previous: Results of the previous run
+        current: Results of this run
+        threshold: Relative change past which a worse measurement is a regression
+    Returns:
+        List of the names of the regressed measurements
+    """
+    old = flatten({section: previous.get(section, {}) for section in ('indexing', 'queries', 'serving')})
+    new = flatten({section: current.get(section, {}) for section in ('indexing', 'queries', 'serving')})
+    regressions = []
+    for name in sorted(new):
+        if name not in old or not old[name] or name.endswith(('.count', '.documents')):
+            continue
+        change = (new[name] - old[name]) / old[name]
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:55} {old[name]:12.2f} {new[name]:12.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    """
+    Command-line interface to run the indexing and query benchmarks.
+    Usage: python -m benchmarks.run_benchmarks [--docs N] [--output results.json] [--compare previous.json]
+    """
+    parser = argparse.ArgumentParser(description="Benchmark indexing and queries on a synthetic corpus.")
+    parser.add_argument('--docs', type=int, default=2000, help="number of pages of the synthetic corpus")
+    parser.add_argument('--vocab', type=int, default=20000, help="number of distinct words")
+    parser.add_argument('--length', type=int, default=300, help="average number of words per page")
+    parser.add_argument('--zipf', type=float, default=1.1, help="exponent of the word frequency distribution")
+    parser.add_argument('--queries', type=int, default=200, help="number of queries in each query set")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the corpus and queries")
+    parser.add_argument('--output', default='benchmark_results.json', help="file to save the results to")
+    parser.add_argument('--compare', metavar='PREVIOUS', help="results of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="relative slowdown reported as a regression by --compare")
+    parser.add_argument('--serving-workers', metavar='COUNTS',
+                        help="comma separated worker counts to measure the search server with, e.g. 1,2,4")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='anteater_bench_')
+    try:
+        zip_path = os.path.join(work_dir, 'corpus.zip')
+        corpus = generate_corpus(zip_path, args.docs, args.vocab, args.length, args.zipf, seed=args.seed)
+        print(f"Generated {args.docs} pages in {zip_path}")
+
+        indexing, batch_tfs, document_lengths, terms = bench_tokenization(zip_path)
+        indexing.update(bench_partial_indexes(batch_tfs, document_lengths, terms, work_dir))
+        index_dir = os.path.join(work_dir, 'index')
+        indexing.update(bench_generate_index(zip_path, index_dir, indexing['documents']))
+        indexing.update(bench_startup(index_dir))
+        query_sets = make_query_sets(corpus, args.queries, args.seed)
+        indexing.update(bench_cold_start(index_dir, query_sets['multi_term'][0]))
+        queries = bench_queries(index_dir, query_sets)
+        serving = {}
+        for workers in (args.serving_workers.split(',') if args.serving_workers else []):
+            serving[f'workers_{workers}'] = bench_serving(index_dir, query_sets['multi_term'], int(workers))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {'metadata': run_metadata(), 'corpus': corpus, 'indexing': indexing, 'queries': queries,
+               'serving': serving}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for name, value in flatten(indexing).items():
+        print(f"{name:40} {value:12.2f}")
+    for name, summary in queries.items():
+        print(f"{name:15} p50 {summary['p50_ms']:8.2f} ms  p95 {summary['p95_ms']:8.2f} ms  "
+              f"p99 {summary['p99_ms']:8.2f} ms")
+    for name, measurements in serving.items():
+        pss = f"{measurements['pss_mb']:8.1f} MB" if measurements['pss_mb'] is not None else 'n/a'
+        print(f"{name:15} {measurements['queries_per_sec']:8.1f} queries/s  PSS {pss}")
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} measurements regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
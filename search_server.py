@@ -1,8 +1,19 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from Search import Search
+from Search.metrics import METRICS
+from Search.shards import HttpShard, find_shard_dirs, open_shards
+from Search.reloader import SearchReloader
+from Search.prefork import PreforkServer, worker_cache_size
+from Search.query.deadline import Deadline
+from Search.query.ranking import DEFAULT_STATIC_WEIGHT
+from InvertedIndex.fields import parse_field_weights
 from flask_cors import CORS
 import sys
 import os
+import json
+import shutil
+import signal
+import tempfile
 import logging # Import the logging module
 
 app = Flask(__name__)
@@ -20,16 +31,102 @@ CORS(app,
 
 api_key = os.environ.get("OPENAI_API_KEY")
 zip_path = os.environ.get("DOC_PATH")
-search_engine = Search(zip_path)
+index_dir = os.environ.get("INDEX_DIR", ".")
+# Comma separated URLs of shard servers. Without them, the shards of a sharded INDEX_DIR
+# are searched locally by threads or processes depending on SHARD_MODE
+shard_urls = os.environ.get("SHARD_URLS")
+shard_mode = os.environ.get("SHARD_MODE", "thread")
+# Set when this server serves a single shard of a sharded index
+global_stats_path = os.environ.get("GLOBAL_STATS_PATH")
+# Token required by the admin endpoints, which are disabled without it
+admin_token = os.environ.get("ADMIN_TOKEN")
+# File the searched queries are appended to, used to build autocomplete suggestions
+query_log = os.environ.get("QUERY_LOG")
+# Number of worker processes forked by `python search_server.py`, sharing the index loaded before forking
+workers = int(os.environ.get("WORKERS", "1"))
+# Number of postings lists cached by all workers together, split between their caches
+cache_budget = int(os.environ["CACHE_BUDGET"]) if os.environ.get("CACHE_BUDGET") else None
+# Weight of the title, headings and bold text in the ranking, such as "title=8,h1=4,bold=1".
+# Fields left out keep their default weight, no reindex is needed to change them
+field_weights = parse_field_weights(os.environ.get("FIELD_WEIGHTS", ""))
+# Influence of the static scores (PageRank) of the documents on their rank, 0 to ignore them
+static_weight = float(os.environ.get("STATIC_WEIGHT", DEFAULT_STATIC_WEIGHT))
+# Time budget of every search in milliseconds, a request can ask for less with timeout_ms.
+# Past it, the best results found so far are returned with partial set
+search_timeout_ms = float(os.environ["SEARCH_TIMEOUT_MS"]) if os.environ.get("SEARCH_TIMEOUT_MS") else None
+if workers > 1 and shard_mode == 'process' and not shard_urls:
+    sys.exit("SHARD_MODE=process can't be used with several WORKERS, the shard processes can't be shared")
+
+def create_search_engine(index_dir):
+    """Open a Search instance for the index directory, loading its structures in the background"""
+    shard_dirs = [] if shard_urls else find_shard_dirs(index_dir)
+    cache_size = worker_cache_size(cache_budget, workers, len(shard_dirs)) if cache_budget else 100
+    if shard_urls:
+        search_engine = Search(shards=[HttpShard(url) for url in shard_urls.split(',')], index_dir=index_dir)
+    elif shard_dirs:
+        search_engine = Search(shards=open_shards(index_dir, zip_path, mode=shard_mode, cache_size=cache_size,
+                                                  field_weights=field_weights, static_weight=static_weight),
+                               index_dir=index_dir)
+    else:
+        search_engine = Search(zip_path, index_dir=index_dir, global_stats_path=global_stats_path,
+                               cache_size=cache_size, field_weights=field_weights, static_weight=static_weight)
+    # Requests are served right away, the first ones wait for the structures they need. With several
+    # workers, the master process loads everything before forking instead
+    if workers == 1:
+        search_engine.preload_in_background()
+    return search_engine
+
+reloader = SearchReloader(create_search_engine, index_dir)
+# Reload automatically when the index files change, checking every RELOAD_WATCH seconds
+if os.environ.get("RELOAD_WATCH"):
+    reloader.watch(interval=float(os.environ["RELOAD_WATCH"]))
 
 @app.route('/search', methods=['GET'])
 def search():
     query = request.args.get('q', '')
     offset = request.args.get('offset', 0, type=int) # Add offset parameter, default to 0
     limit = request.args.get('limit', 5, type=int) # Add limit parameter, default to 5
+    # 'and', 'or', or by default 'auto': AND relaxed to the best partial matches
+    mode = request.args.get('mode', 'auto')
+    if mode not in ('and', 'or', 'auto'):
+        return jsonify({'error': 'Invalid mode'}), 400
     if not query:
         return jsonify({'error': 'No query provided'}), 400
-    return search_engine.get_formatted_results(query, jsonify, offset=offset, limit=limit) # Pass offset and limit
+    timeout_ms = request.args.get('timeout_ms', type=float)
+    if timeout_ms is not None and timeout_ms <= 0:
+        return jsonify({'error': 'Invalid timeout_ms'}), 400
+    if search_timeout_ms is not None:
+        timeout_ms = min(timeout_ms or search_timeout_ms, search_timeout_ms)
+    if query_log and offset == 0:
+        with open(query_log, 'a', encoding='utf-8') as f:
+            f.write(' '.join(query.split()) + '\n')
+    # debug=1 adds the time of each stage of the query to the response
+    debug = request.args.get('debug', '') not in ('', '0', 'false')
+    # Keep the same instance for the whole request, even if a reload swaps it meanwhile
+    with reloader.using() as search_engine:
+        reloader.record_query(search_engine.query_processor.tokenize_query(query))
+        return search_engine.get_formatted_results(query, jsonify, offset=offset, limit=limit, mode=mode,
+                                                   debug=debug, timeout_ms=timeout_ms) # Pass offset and limit
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the index is fully loaded, 503 while it is still loading"""
+    if reloader.get().is_ready():
+        return jsonify({'status': 'ready', 'generation': reloader.generation})
+    return jsonify({'status': 'loading'}), 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Query latency histograms by stage and postings cache and I/O counters, in the Prometheus text format"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    """Autocomplete suggestions for the text typed so far"""
+    prefix = request.args.get('q', '')
+    limit = request.args.get('limit', 8, type=int)
+    with reloader.using() as search_engine:
+        return jsonify({'suggestions': search_engine.suggest(prefix, limit)})
 
 @app.route('/summary', methods=['GET'])
 def summary():
@@ -38,7 +135,105 @@ def summary():
         return jsonify({'error': 'No URL provided'}), 400
     if not api_key:
         return jsonify({'error': 'No API key provided'}), 400
-    return search_engine.get_summary(site_id, api_key, jsonify)
+    with reloader.using() as search_engine:
+        return search_engine.get_summary(site_id, api_key, jsonify)
+
+def shard_query_terms(query_terms):
+    """
+    Convert terms sent by HttpShard: a list of processed query terms, the wildcard terms
+    expanded by the coordinator being lists of terms. Returns None if they are malformed.
+    """
+    if not isinstance(query_terms, list):
+        return None
+    return [tuple(term) if isinstance(term, list) else term for term in query_terms]
+
+def shard_json_arg(name):
+    """Decode a JSON list parameter of a shard request, None if it is malformed"""
+    try:
+        value = json.loads(request.args.get(name, '[]'))
+    except ValueError:
+        return None
+    return value if isinstance(value, list) else None
+
+@app.route('/shard_search', methods=['GET'])
+def shard_search():
+    """Top-k results of this server's index for already processed query terms, used by HttpShard"""
+    query_terms = shard_query_terms(shard_json_arg('terms'))
+    if query_terms is None:
+        return jsonify({'error': 'Invalid terms'}), 400
+    k = request.args.get('k', 5, type=int)
+    phrases = shard_json_arg('phrases')
+    try:
+        # Like the query terms, the wildcard phrase terms are expanded by the coordinator
+        phrases = [(shard_query_terms(phrase_terms), int(slop)) for phrase_terms, slop in phrases]
+    except (TypeError, ValueError):
+        phrases = None
+    if phrases is None or any(phrase_terms is None for phrase_terms, _ in phrases):
+        return jsonify({'error': 'Invalid phrases'}), 400
+    mode = request.args.get('mode', 'and')
+    deadline = Deadline(request.args.get('timeout_ms', type=float))
+    with reloader.using() as search_engine:
+        total, results = search_engine.top_k(query_terms, k, phrases, mode, deadline)
+    return jsonify({'total': total, 'results': results, 'skipped': deadline.skipped})
+
+@app.route('/shard_snippets', methods=['GET'])
+def shard_snippets():
+    """Snippets of documents of this server's index for already processed query terms, used by HttpShard"""
+    doc_ids = [int(doc_id) for doc_id in request.args.get('ids', '').split(',') if doc_id]
+    query_terms = shard_query_terms(shard_json_arg('terms'))
+    if query_terms is None:
+        return jsonify({'error': 'Invalid terms'}), 400
+    with reloader.using() as search_engine:
+        return jsonify({'snippets': search_engine.get_snippets(doc_ids, query_terms)})
+
+@app.route('/shard_document', methods=['GET'])
+def shard_document():
+    """Contents of a document of this server's index, used by HttpShard"""
+    doc_id = request.args.get('id', type=int)
+    if doc_id is None:
+        return jsonify({'error': 'No document ID provided'}), 400
+    with reloader.using() as search_engine:
+        return jsonify({'content': search_engine.index_reader.get_document_contents(doc_id)})
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """Open the index again (or the index in the index_dir parameter) and swap it in without downtime"""
+    if not admin_token or request.headers.get('Authorization') != f'Bearer {admin_token}':
+        return jsonify({'error': 'Unauthorized'}), 403
+    new_index_dir = request.args.get('index_dir')
+    if workers > 1:
+        # The master process reopens the index and forks new workers sharing it
+        if new_index_dir:
+            return jsonify({'error': 'index_dir is not supported with several workers, '
+                                     'switch the INDEX_DIR symlink instead'}), 400
+        os.kill(os.getppid(), signal.SIGHUP)
+        return jsonify({'status': 'reloading'}), 202
+    if request.args.get('wait'):
+        generation = reloader.reload(new_index_dir)
+        return jsonify({'status': 'reloaded', 'generation': generation})
+    reloader.reload_in_background(new_index_dir)
+    return jsonify({'status': 'reloading'}), 202
+
+def main():
+    """Serve the app on HOST:PORT, from WORKERS pre-forked processes when there are several"""
+    host = os.environ.get("HOST", "0.0.0.0")
+    port = int(os.environ.get("PORT", "5000"))
+    if workers == 1:
+        app.run(host=host, port=port, threaded=True)
+        return
+
+    # The workers add up their metrics through files in a shared directory
+    metrics_dir = tempfile.mkdtemp(prefix='anteater-metrics-')
+    server = PreforkServer(app, host, port, workers,
+                           before_fork=lambda: reloader.get().load(),
+                           after_fork=lambda: METRICS.share(metrics_dir),
+                           on_reload=reloader.reload)
+    # Reloads by the index watcher of the master replace the workers too
+    reloader.on_reload = lambda generation: server.restart()
+    try:
+        server.run()
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
 
-#def main():
-#    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
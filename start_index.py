@@ -1,22 +1,81 @@
-import sys
+import argparse
 from InvertedIndex import generate_index
+from InvertedIndex.pairs import build_pair_index
+from InvertedIndex.segments import SegmentManager
+from InvertedIndex.spelling import build_spelling_index
+from InvertedIndex.suggest import build_suggestions
 
 def main():
     """
     Command-line interface to generate an inverted index.
-    Usage: python start_index.py <path_to_documents>
+    Usage: python start_index.py <path_to_documents>... [-s] [--positions] [--no-snippets] [--shards N] [--index-dir DIR] [--report FILE] [--resume] [--readers N] [--keep-duplicates] [--pairs N]
+           python start_index.py <path_to_documents>... --segment [-s] [--positions] [--no-snippets] [--index-dir DIR]
+           python start_index.py --delete-urls <path_to_url_list> [--index-dir DIR]
+           python start_index.py --query-log <path_to_query_log> [--index-dir DIR] [--pairs N]
+           python start_index.py --pairs N [--query-log <path_to_query_log>] [--index-dir DIR]
     """
-    if len(sys.argv) < 2:
-        print("Usage: python start_index.py <path_to_documents> (optional: -s for simhash indexing)")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Generate an inverted index.")
+    parser.add_argument('path', nargs='*',
+                        help="paths to the ZIPs or directories of JSON-lines documents to index, or glob patterns")
+    parser.add_argument('-s', action='store_true', help="eliminate near duplicates with simhash")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="number of document-partitioned shards to build")
+    parser.add_argument('--index-dir', default='.', help="directory to write the index to")
+    parser.add_argument('--positions', action='store_true',
+                        help="store token positions to support phrase queries")
+    parser.add_argument('--segment', action='store_true',
+                        help="add the documents as a new segment of an incremental index")
+    parser.add_argument('--delete-urls', metavar='URL_FILE',
+                        help="delete the URLs listed in a file (one per line) from an incremental index")
+    parser.add_argument('--no-snippets', action='store_true',
+                        help="don't store the text of the documents for search result snippets")
+    parser.add_argument('--query-log', help="file of past queries (one per line) to suggest in autocomplete")
+    parser.add_argument('--report', metavar='REPORT_FILE',
+                        help="write a JSON report of the time, throughput and memory of each indexing stage")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted build from its last checkpoint in the index directory")
+    parser.add_argument('--readers', type=int,
+                        help="number of processes reading the documents, defaults to the number of CPUs up to 4")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="index documents with the same text as a document already read")
+    parser.add_argument('--pairs', type=int, default=0, metavar='N',
+                        help="precompute the intersected postings of the N most frequent term pairs, "
+                             "chosen from the query log when given")
+    args = parser.parse_args()
+    sim_hash = 5 if args.s else 0
 
-    path = sys.argv[1]
-    if '-s' in sys.argv:
-        generate_index(path)
-    else:
-        generate_index(path, sim_hash=0)
+    if args.segment or args.delete_urls:
+        segment_manager = SegmentManager(args.index_dir)
+        if args.delete_urls:
+            with open(args.delete_urls, 'r') as f:
+                deleted = segment_manager.delete_urls(line.strip() for line in f if line.strip())
+            print(f"Deleted {deleted} documents.")
+        if args.segment and args.path:
+            if segment_manager.add_segment(args.path, sim_hash, args.positions,
+                                           store_snippets=not args.no_snippets, readers=args.readers) is None:
+                print("No documents to index.")
+        # The new segment is already searchable, compact segments before exiting
+        segment_manager.merge_in_background().join()
+        build_suggestions(args.index_dir, args.query_log)
+        build_spelling_index(args.index_dir)
+        print("Incremental index updated successfully.")
+        return
+
+    if not args.path:
+        if args.query_log:
+            # Only rebuild the autocomplete suggestions with the latest queries
+            print(f"Built {build_suggestions(args.index_dir, args.query_log)} suggestions.")
+        if args.pairs:
+            # Only rebuild the pair index, from the latest queries if given
+            print(f"Built {build_pair_index(args.index_dir, args.query_log, args.pairs)} pairs.")
+        if args.query_log or args.pairs:
+            return
+        parser.error("the path to the documents is required")
+    generate_index(args.path, sim_hash=sim_hash, index_dir=args.index_dir, num_shards=args.shards,
+                   store_positions=args.positions, query_log=args.query_log,
+                   store_snippets=not args.no_snippets, report_path=args.report, resume=args.resume,
+                   readers=args.readers, exact_duplicates=not args.keep_duplicates, num_pairs=args.pairs)
     print("Inverted index generated successfully.")
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from collections import Counter
+from InvertedIndex.zip_handler import ZipHandler
+from benchmarks.corpus import generate_corpus
+from benchmarks.run_benchmarks import percentile
+
+
+class TestCorpus(unittest.TestCase):
+    def test_deterministic(self):
+        """Test that the same arguments write the same ZIP, and another seed a different one"""
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f"{name}.zip") for name in ('a', 'b', 'c')]
+            generate_corpus(paths[0], num_docs=20, vocab_size=500, doc_length=50, seed=1)
+            generate_corpus(paths[1], num_docs=20, vocab_size=500, doc_length=50, seed=1)
+            generate_corpus(paths[2], num_docs=20, vocab_size=500, doc_length=50, seed=2)
+            contents = []
+            for path in paths:
+                with open(path, 'rb') as f:
+                    contents.append(f.read())
+            self.assertEqual(contents[0], contents[1])
+            self.assertNotEqual(contents[0], contents[2])
+
+    def test_zip_handler_format(self):
+        """Test that ZipHandler reads every page, with Zipf distributed words"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "corpus.zip")
+            generate_corpus(path, num_docs=30, vocab_size=1000, doc_length=100)
+            pages = []
+            with zipfile.ZipFile(path, 'r') as zip_file:
+                for file_name in ZipHandler.get_json_file_list(path):
+                    pages.extend(ZipHandler.parse_json_file(zip_file, file_name))
+            self.assertEqual(len(pages), 30)
+            self.assertEqual(len({url for url, _ in pages}), 30)
+            words = Counter(word for _, content in pages for word in content.split())
+            # The most common words are far more frequent than the typical word
+            counts = sorted(words.values(), reverse=True)
+            self.assertGreater(counts[0], 10 * counts[len(counts) // 2])
+
+
+class TestPercentile(unittest.TestCase):
+    def test_nearest_rank(self):
+        """Test the nearest-rank percentiles used in latency summaries"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
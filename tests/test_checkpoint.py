@@ -0,0 +1,116 @@
+import os
+import pickle
+import tempfile
+import unittest
+from InvertedIndex.checkpoint import CHECKPOINT_NAME, atomic_write
+from InvertedIndex.index import InvertedIndex
+from InvertedIndex.index_manager import IndexManager
+from benchmarks.corpus import generate_corpus
+
+
+class CrashingIndex(InvertedIndex):
+    """Index build that dies while tokenizing one of its batches"""
+    def __init__(self, *args, crash_at_batch=None, **kwargs):
+        self.crash_at_batch = crash_at_batch
+        self.batches = 0
+        super().__init__(*args, **kwargs)
+
+    def tokenize_documents(self):
+        if self.batches == self.crash_at_batch:
+            raise KeyboardInterrupt
+        self.batches += 1
+        return super().tokenize_documents()
+
+
+def read_index(index_dir):
+    """Get the token offsets, lexicon and URLs of a built index"""
+    contents = []
+    for name in ('token_positions.pkl', 'lexicon.pkl', 'global_stats.pkl'):
+        path = os.path.join(index_dir, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                contents.append(pickle.load(f))
+    with open(os.path.join(index_dir, 'urls.json'), 'r') as f:
+        contents.append(f.read())
+    return contents
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.zip_path = os.path.join(self.directory.name, 'corpus.zip')
+        generate_corpus(self.zip_path, num_docs=30, vocab_size=300, doc_length=40)
+        self.expected_dir = os.path.join(self.directory.name, 'expected')
+        InvertedIndex(self.zip_path, 0, self.expected_dir, store_snippets=True)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume_after_crash(self):
+        """Test that a build killed during its second batch resumes into the same index"""
+        index_dir = os.path.join(self.directory.name, 'index')
+        with self.assertRaises(KeyboardInterrupt):
+            CrashingIndex(self.zip_path, 0, index_dir, store_snippets=True, checkpoint=True, crash_at_batch=1)
+        self.assertTrue(os.path.exists(os.path.join(index_dir, CHECKPOINT_NAME)))
+        self.assertTrue(os.path.exists(os.path.join(index_dir, 'partial_index_0.bin')))
+        self.assertFalse(os.path.exists(os.path.join(index_dir, 'index.bin')))
+
+        index = CrashingIndex(self.zip_path, 0, index_dir, store_snippets=True, checkpoint=True, resume=True)
+        self.assertEqual(index.batches, 2)
+        self.assertEqual(index.total_documents, 30)
+        self.assertEqual(read_index(index_dir), read_index(self.expected_dir))
+        with open(os.path.join(index_dir, 'snippets.bin'), 'rb') as a, \
+                open(os.path.join(self.expected_dir, 'snippets.bin'), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_resume_merge(self):
+        """Test that a merge killed after its first shard resumes with the other shard"""
+        index_dir = os.path.join(self.directory.name, 'index')
+        expected_dir = os.path.join(self.directory.name, 'expected_shards')
+        InvertedIndex(self.zip_path, 0, expected_dir, num_shards=2)
+        original = IndexManager._merge_shard
+
+        def crash_on_second_shard(index_manager, directory, *args):
+            if directory.endswith('shard_1'):
+                raise KeyboardInterrupt
+            return original(index_manager, directory, *args)
+        IndexManager._merge_shard = crash_on_second_shard
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                InvertedIndex(self.zip_path, 0, index_dir, num_shards=2, checkpoint=True)
+        finally:
+            IndexManager._merge_shard = original
+        self.assertFalse(os.path.exists(os.path.join(index_dir, 'shard_0', 'partial_index_0.bin')))
+
+        InvertedIndex(self.zip_path, 0, index_dir, num_shards=2, checkpoint=True, resume=True)
+        for name in ('shard_0', 'shard_1'):
+            self.assertEqual(read_index(os.path.join(index_dir, name)),
+                             read_index(os.path.join(expected_dir, name)))
+        with open(os.path.join(index_dir, 'global_stats.pkl'), 'rb') as a, \
+                open(os.path.join(expected_dir, 'global_stats.pkl'), 'rb') as b:
+            self.assertEqual(pickle.load(a), pickle.load(b))
+
+    def test_other_options(self):
+        """Test that a checkpoint isn't resumed by a build with other options"""
+        index_dir = os.path.join(self.directory.name, 'index')
+        with self.assertRaises(KeyboardInterrupt):
+            CrashingIndex(self.zip_path, 0, index_dir, checkpoint=True, crash_at_batch=1)
+        with self.assertRaises(ValueError):
+            InvertedIndex(self.zip_path, 0, index_dir, store_positions=True, checkpoint=True, resume=True)
+
+    def test_atomic_write(self):
+        """Test that a failed write leaves the previous file, and no temporary file"""
+        path = os.path.join(self.directory.name, 'file.bin')
+        with atomic_write(path) as f:
+            f.write(b'old')
+        with self.assertRaises(RuntimeError):
+            with atomic_write(path) as f:
+                f.write(b'new')
+                raise RuntimeError
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import unittest
+from InvertedIndex.corpus import CorpusSource, load_sources, open_member
+from InvertedIndex.index import InvertedIndex
+from Search.indexing import IndexReader
+from benchmarks.corpus import generate_corpus
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Pages 0 to 19, then pages 0 to 29 of another crawl, the first 20 already read
+        self.first_zip = os.path.join(self.directory.name, 'crawl_1.zip')
+        self.second_zip = os.path.join(self.directory.name, 'crawl_2.zip')
+        generate_corpus(self.first_zip, num_docs=20, vocab_size=200, doc_length=30)
+        generate_corpus(self.second_zip, num_docs=30, vocab_size=200, doc_length=30, seed=1)
+        # A directory of JSON-lines files, one of them holding several pages
+        self.pages_dir = os.path.join(self.directory.name, 'pages')
+        os.makedirs(os.path.join(self.pages_dir, 'sub'))
+        with open(os.path.join(self.pages_dir, 'sub', 'pages.jsonl'), 'w') as f:
+            for i in range(3):
+                f.write(json.dumps({'url': f"https://dir.example.com/{i}",
+                                    'content': f"<p>anteater page {i}</p>"}) + '\n')
+        self.paths = [os.path.join(self.directory.name, 'crawl_*.zip'), self.pages_dir]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_urls(self, index_dir):
+        with open(os.path.join(index_dir, 'urls.json'), 'r') as f:
+            return json.load(f)
+
+    def test_several_sources(self):
+        """Test that ZIPs matched by a glob and a directory are indexed with URLs deduplicated across them"""
+        index_dir = os.path.join(self.directory.name, 'index')
+        InvertedIndex(self.paths, 0, index_dir, readers=1)
+
+        urls = self.read_urls(index_dir)
+        self.assertEqual(len(urls), 20 + 10 + 3)
+        self.assertEqual(len(set(urls.values())), len(urls))
+        sources = load_sources(index_dir)
+        self.assertEqual(sources, [(0, 20, self.first_zip), (20, 30, self.second_zip), (30, 33, self.pages_dir)])
+
+        reader = IndexReader(index_dir=index_dir)
+        self.assertEqual(reader.get_zip_path(31), self.pages_dir)
+        self.assertEqual(reader.get_file(31), os.path.join('sub', 'pages.jsonl'))
+        with open_member(reader.get_zip_path(25), reader.get_file(25)) as f:
+            self.assertIn(urls['25'], f.read().decode('utf-8'))
+
+    def test_parallel_readers(self):
+        """Test that reader processes give the documents the same IDs as reading in one process"""
+        serial_dir = os.path.join(self.directory.name, 'serial')
+        parallel_dir = os.path.join(self.directory.name, 'parallel')
+        InvertedIndex(self.paths, 0, serial_dir, readers=1)
+        InvertedIndex(self.paths, 0, parallel_dir, readers=2)
+        self.assertEqual(self.read_urls(serial_dir), self.read_urls(parallel_dir))
+        for name in ('index.bin', 'files.json'):
+            with open(os.path.join(serial_dir, name), 'rb') as serial, \
+                    open(os.path.join(parallel_dir, name), 'rb') as parallel:
+                self.assertEqual(serial.read(), parallel.read())
+
+    def test_missing_source(self):
+        """Test that a path or pattern matching nothing is reported"""
+        with self.assertRaises(FileNotFoundError):
+            CorpusSource([self.first_zip, os.path.join(self.directory.name, 'missing_*.zip')])
+
+
+if __name__ == '__main__':
+    unittest.main()
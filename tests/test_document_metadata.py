@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+from InvertedIndex.document_metadata import DocumentMetadata, write_document_metadata
+
+
+class TestDocumentMetadata(unittest.TestCase):
+    def test_round_trip(self):
+        """Test that every column reads back by document ID, across front-coding blocks"""
+        documents = {doc_id: (f"https://ics.uci.edu/page{doc_id}", f"ics/{doc_id:04x}.json", doc_id * 10, 0.5, 0.25)
+                     for doc_id in range(2, 100, 3)}
+        with tempfile.TemporaryDirectory() as index_dir:
+            write_document_metadata(index_dir, documents, first_doc_id=2, stride=3)
+            metadata = DocumentMetadata.open(index_dir)
+            try:
+                self.assertEqual(metadata.num_documents, len(documents))
+                for doc_id, (url, file_name, length, norm, static_score) in documents.items():
+                    self.assertEqual(metadata.get_url(doc_id), url)
+                    self.assertEqual(metadata.get_file(doc_id), file_name)
+                    self.assertEqual(metadata.get_length(doc_id), length)
+                    self.assertEqual(metadata.get_norm(doc_id), norm)
+                    self.assertEqual(metadata.get_static_score(doc_id), static_score)
+                # IDs of other shards and out of range IDs are unknown
+                self.assertIsNone(metadata.get_url(3))
+                self.assertIsNone(metadata.get_url(1000))
+                self.assertEqual(len(list(metadata.documents())), len(documents))
+            finally:
+                metadata.close()
+
+    def test_missing_documents(self):
+        """Test that IDs without a document inside the range have no URL"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            write_document_metadata(index_dir, {5: ("a", "a.json", 1, 1.0, 0.0), 7: ("b", "b.json", 2, 1.0, 0.0)})
+            metadata = DocumentMetadata.open(index_dir)
+            try:
+                self.assertEqual((metadata.first_doc_id, metadata.num_rows), (5, 3))
+                self.assertIsNone(metadata.get_url(6))
+                self.assertEqual(metadata.get_url(7), "b")
+            finally:
+                metadata.close()
+        self.assertIsNone(DocumentMetadata.open(index_dir))
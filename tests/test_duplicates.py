@@ -0,0 +1,96 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+import zipfile
+from InvertedIndex.duplicates import DigestSet, FingerprintIndex, content_digest
+from InvertedIndex.file import FileOpener
+from InvertedIndex.index import InvertedIndex
+
+
+class TestDuplicates(unittest.TestCase):
+    def test_digest_set(self):
+        """Test that the digest set keeps every digest added while it grows"""
+        digests = DigestSet()
+        for digest in range(1, 5000, 3):
+            self.assertTrue(digests.add(digest * 0x9E3779B97F4A7C15 % 2 ** 64 or 1))
+        self.assertFalse(digests.add(0x9E3779B97F4A7C15))
+        self.assertEqual(len(digests), len(range(1, 5000, 3)))
+        self.assertGreater(len(digests.slots), 1024)
+        self.assertIn(4 * 0x9E3779B97F4A7C15 % 2 ** 64, digests)
+        self.assertNotIn(2 * 0x9E3779B97F4A7C15 % 2 ** 64, digests)
+        self.assertEqual(sorted(DigestSet(digests)), sorted(digests))
+
+    def test_content_digest(self):
+        """Test that the digest ignores markup, case and whitespace only"""
+        self.assertEqual(content_digest("<p>Anteater  Find</p>\n"), content_digest("<p>anteater find</p>"))
+        self.assertNotEqual(content_digest("<p>anteater find</p>"), content_digest("<p>anteater found</p>"))
+        # Mirrors differing in their tags, links or scripts have the same text
+        self.assertEqual(content_digest("<p>a</p>"), content_digest("<div>a</div>"))
+        self.assertEqual(content_digest('<a href="/?ref=1">anteater</a> find'),
+                         content_digest('<!-- mirror --><a href="https://b.example.com/">anteater</a>'
+                                        '<script>track("b")</script> find'))
+        self.assertNotEqual(content_digest("<p>anteater</p><p>find</p>"), content_digest("<p>anteaterfind</p>"))
+
+    def test_exact_duplicates_dropped(self):
+        """Test that pages with the text of a page already read are dropped, unless kept"""
+        with tempfile.TemporaryDirectory() as directory:
+            zip_path = os.path.join(directory, 'crawl.zip')
+            pages = [('https://a.example.com/', '<p>Anteater page</p>'),
+                     ('https://a.example.com/?ref=1', '<p>anteater   page</p>'),
+                     ('https://a.example.com/#top', '<p>other page</p>'),
+                     ('https://b.example.com/', '<p>other page</p>')]
+            with zipfile.ZipFile(zip_path, 'w') as zip_file:
+                for i, (url, content) in enumerate(pages):
+                    zip_file.writestr(f'page{i}.json', json.dumps({'url': url, 'content': content}))
+
+            file_opener = FileOpener(zip_path, simhash_threshold=0, readers=1)
+            documents = file_opener.read_zip()
+            file_opener.close()
+            self.assertEqual([url for url, _ in documents], ['https://a.example.com/', 'https://b.example.com/'])
+            self.assertEqual(file_opener.duplicates, {'url': 1, 'exact': 1, 'near': 0})
+
+            file_opener = FileOpener(zip_path, simhash_threshold=0, readers=1, exact_duplicates=False)
+            self.assertEqual(len(file_opener.read_zip()), 3)
+            file_opener.close()
+
+    def test_fingerprint_index(self):
+        """Test that the fingerprint index finds the same near duplicates as comparing all fingerprints"""
+        rng = random.Random(0)
+        fingerprints = [rng.getrandbits(64) for _ in range(200)]
+        # Fingerprints a few bits away from some of the others
+        queries = [fingerprint ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for fingerprint in fingerprints[:50]]
+        queries += [rng.getrandbits(64) for _ in range(50)]
+        for threshold in (0, 3, 5):
+            index = FingerprintIndex(threshold, fingerprints)
+            for query in queries:
+                expected = any(bin(query ^ fingerprint).count('1') <= threshold for fingerprint in fingerprints)
+                self.assertEqual(index.near_duplicate(query), expected)
+
+    def test_near_duplicates_dropped(self):
+        """Test that a page with nearly the same words under other markup is dropped by its simhash"""
+        with tempfile.TemporaryDirectory() as directory:
+            zip_path = os.path.join(directory, 'crawl.zip')
+            words = ' '.join(f'word{i}' for i in range(100))
+            # Not an exact duplicate, one of the words differs
+            pages = [('https://a.example.com/', f'<p>{words}</p>'),
+                     ('https://b.example.com/', f'<div><span>{words.replace("word99", "other")}</span></div>'),
+                     ('https://c.example.com/', '<p>anteater page</p>')]
+            with zipfile.ZipFile(zip_path, 'w') as zip_file:
+                for i, (url, content) in enumerate(pages):
+                    zip_file.writestr(f'page{i}.json', json.dumps({'url': url, 'content': content}))
+
+            index = InvertedIndex(zip_path, 3, os.path.join(directory, 'index'), readers=1)
+            self.assertEqual(index.total_documents, 2)
+            self.assertEqual(index.file_opener.duplicates, {'url': 0, 'exact': 0, 'near': 1})
+            self.assertEqual(index.file_opener.source_ranges(), [[0, 2, zip_path]])
+            # The checkpoint state and the progress bar only count the documents kept
+            self.assertEqual(index.file_opener.files_read, 2)
+            self.assertEqual(index.file_opener.pbar.n, 2)
+            with open(os.path.join(directory, 'index', 'urls.json'), 'r') as f:
+                self.assertEqual(json.load(f), {'0': 'https://a.example.com/', '1': 'https://c.example.com/'})
+
+
+if __name__ == '__main__':
+    unittest.main()
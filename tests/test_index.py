@@ -1,4 +1,6 @@
-from InvertedIndex.index import InvertedIndex, weighted_tags, tokenize_chunk
+from InvertedIndex.fields import FIELDS, tag_fields
+from InvertedIndex.index import InvertedIndex, tokenize_chunk, encode_chunk
+from array import array
 from bs4 import BeautifulSoup
 from nltk.stem import PorterStemmer
 import unittest
@@ -13,20 +15,21 @@ class TestIndex(unittest.TestCase):
     def test_tokenize_documents(self):
         index = InvertedIndex()
         index.documents = {"doc1": "<html><body><p>This is a test.</p></body></html>", "doc2": "<html><body><p>This is only a test.</p></body></html>"}
-        self.assertEqual(index.tokenize_documents(), {"doc1": {"thi": 0.25, "is": 0.25, "a": 0.25, "test": 0.25}, "doc2": {"thi": 0.2, "is": 0.2, "a": 0.2, "test": 0.2, "onli": 0.2}})
+        term_frequencies = {doc_name: {index.terms[term_id]: tf for term_id, tf in zip(term_ids, tfs)}
+                            for doc_name, (term_ids, tfs, _) in index.tokenize_documents().items()}
+        self.assertEqual(term_frequencies, {"doc1": {"thi": 0.25, "is": 0.25, "a": 0.25, "test": 0.25}, "doc2": {"thi": 0.2, "is": 0.2, "a": 0.2, "test": 0.2, "onli": 0.2}})
 
     def test_calculate_tfs(self):
         index = InvertedIndex()
-        self.assertEqual(index.calculate_tfs({"thi": 1, "is": 1, "a": 1, "test": 1}), {"thi": 0.25, "is": 0.25, "a": 0.25, "test": 0.25})
-        self.assertEqual(index.calculate_tfs({"thi": 2, "is": 2, "a": 2, "test": 3, "onli": 1}), {"thi": 0.2, "is": 0.2, "a": 0.2, "test": 0.3, "onli": 0.1})
+        self.assertEqual(index.calculate_tfs(array('I', [1, 1, 1, 1])), array('d', [0.25, 0.25, 0.25, 0.25]))
+        self.assertEqual(index.calculate_tfs(array('I', [2, 2, 2, 3, 1])), array('d', [0.2, 0.2, 0.2, 0.3, 0.1]))
 
-    def test_weighted_tags(self):
-        index = InvertedIndex()
+    def test_tag_fields(self):
         html = "<html><body><h1>Title</h1><h2>Subtitle</h2><h3>Subtitle 3</h3><b>Bold</b><p>Normal text</p></body></html>"
         soup = BeautifulSoup(html, 'html.parser')
-        tokens = weighted_tags(soup)
-        expected = ["title", "title", "title", "title", "subtitle", "subtitle", "subtitle","subtitle", "subtitle" ,"3", "3", "bold"]
-        self.assertEqual(tokens, expected)
+        expected = {"title": FIELDS['h1'], "subtitle": FIELDS['h2'] | FIELDS['h3'], "3": FIELDS['h3'],
+                    "bold": FIELDS['bold']}
+        self.assertEqual(tag_fields(soup), expected)
 
 
     def test_tokenize_chunk(self):
@@ -35,9 +38,27 @@ class TestIndex(unittest.TestCase):
             "doc1": "<html><body><h1>Title</h1><p>This is a test.</p></body></html>",
             "doc2": "<html><body><p>This is only a test.</p></body></html>"
         }
-        result = tokenize_chunk(chunk, stemmer)
+        fields = {}
+        result = tokenize_chunk(chunk, stemmer, fields=fields)
 
         expected =\
-            {'doc1': {'a': 1, 'is': 1, 'test': 1, 'thi': 1, 'titl': 5},
+            {'doc1': {'a': 1, 'is': 1, 'test': 1, 'thi': 1, 'titl': 1},
              'doc2': {'a': 1, 'is': 1, 'onli': 1, 'test': 1, 'thi': 1}}
         self.assertEqual(result, expected)
+        self.assertEqual(fields, {'doc1': {'titl': FIELDS['h1']}, 'doc2': {}})
+
+    def test_tokenize_chunk_positions(self):
+        stemmer = PorterStemmer()
+        chunk = {"doc1": "<html><body><h1>Title</h1><p>This is a test test.</p></body></html>"}
+        counts, positions = tokenize_chunk(chunk, stemmer, store_positions=True)["doc1"]
+
+        self.assertEqual(counts, {'a': 1, 'is': 1, 'test': 2, 'thi': 1, 'titl': 1})
+        self.assertEqual(positions, {'titl': [0], 'thi': [1], 'is': [2], 'a': [3], 'test': [4, 5]})
+
+    def test_encode_chunk(self):
+        """Test that a chunk is sent back as local term IDs shared by its documents"""
+        chunk = {"doc1": "<p>This is a test.</p>", "doc2": "<p>Only a <b>test</b> test.</p>"}
+        terms, documents = encode_chunk(chunk, PorterStemmer())
+        self.assertEqual(terms, ['thi', 'is', 'a', 'test', 'onli'])
+        self.assertEqual(documents["doc2"], (array('I', [4, 2, 3]), array('I', [1, 1, 2]),
+                                             array('B', [0, 0, FIELDS['bold']]), None, None, None, array('Q')))
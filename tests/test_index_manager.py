@@ -1,6 +1,8 @@
 import unittest
 import json
 import os
+import pickle
+import tempfile
 from InvertedIndex.index_manager import IndexManager
 from collections import defaultdict
 
@@ -113,3 +115,42 @@ class TestIndexManager(unittest.TestCase):
             for fname in test_files:
                 if os.path.exists(fname):
                     os.remove(fname)
+
+    def test_merge_sharded_partial_indexes(self):
+        """Test that a sharded index partitions documents and shares global document frequencies"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            index_manager = IndexManager(index_dir, num_shards=2)
+            terms = index_manager.terms
+            batch_tfs = {
+                ("doc0.test", "doc0.json"): (terms.ids(["banana", "apple"]), [0.5, 0.5], [0, 1]),
+                ("doc1.test", "doc1.json"): (terms.ids(["apple"]), [1.0], [0]),
+                ("doc2.test", "doc2.json"): (terms.ids(["cherry"]), [1.0], [0]),
+            }
+            batch_lengths = {("doc0.test", "doc0.json"): 2, ("doc1.test", "doc1.json"): 1,
+                             ("doc2.test", "doc2.json"): 6}
+            index_manager.create_and_save_partial_index(batch_tfs, 0, batch_lengths=batch_lengths)
+            index_manager.merge_partial_indexes(1)
+
+            with open(os.path.join(index_dir, "shard_0", "urls.json")) as f:
+                self.assertEqual(json.load(f), {"0": "doc0.test", "2": "doc2.test"})
+            with open(os.path.join(index_dir, "shard_1", "urls.json")) as f:
+                self.assertEqual(json.load(f), {"1": "doc1.test"})
+
+            with open(os.path.join(index_dir, "shard_1", "token_positions.pkl"), "rb") as f:
+                self.assertEqual(list(pickle.load(f)), ["apple"])
+            # Field flags are only kept in the postings of terms found in a weighted field
+            with open(os.path.join(index_dir, "shard_0", "index.bin"), "rb") as f:
+                self.assertEqual(pickle.load(f), ("apple", [{"doc_id": 0, "tf": 0.5, "fields": 1}]))
+                self.assertEqual(pickle.load(f), ("banana", [{"doc_id": 0, "tf": 0.5}]))
+
+            with open(os.path.join(index_dir, "global_stats.pkl"), "rb") as f:
+                global_stats = pickle.load(f)
+            self.assertEqual(global_stats["total_documents"], 3)
+            self.assertEqual(global_stats["document_frequencies"], {"apple": 2, "banana": 1, "cherry": 1})
+            # Every shard normalizes the document lengths by the average of the whole collection
+            self.assertEqual(global_stats["average_length"], 3.0)
+            # The global lexicon expands wildcard terms for every shard
+            with open(os.path.join(index_dir, "lexicon.pkl"), "rb") as f:
+                lexicon = pickle.load(f)
+            self.assertEqual(lexicon["terms"], ["apple", "banana", "cherry"])
+            self.assertEqual(list(lexicon["document_frequencies"]), [2, 1, 1])
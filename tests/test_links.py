@@ -0,0 +1,80 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+import zipfile
+import numpy as np
+from array import array
+from bs4 import BeautifulSoup
+from InvertedIndex.document_metadata import DocumentMetadata
+from InvertedIndex.index import InvertedIndex
+from InvertedIndex.links import LinkGraph, extract_links, pagerank, url_digest
+
+
+class TestLinks(unittest.TestCase):
+    def test_extract_links(self):
+        """Test that links are resolved, stripped of fragments and kept once, without the page itself"""
+        soup = BeautifulSoup('<a href="b.html#top">B</a><a href="/c">C</a><a href="b.html">B again</a>'
+                             '<a href="mailto:x@example.com">Mail</a><a href="#self">Self</a><a>None</a>', 'html.parser')
+        self.assertEqual(extract_links(soup, 'https://example.com/a/index.html'),
+                         ['https://example.com/a/b.html', 'https://example.com/c'])
+
+    def test_pagerank(self):
+        """Test that the sparse power iteration matches the dense PageRank, with a page without links"""
+        links = {0: [1, 2], 1: [2], 2: [0], 3: [2], 4: []}
+        indptr = np.cumsum([0] + [len(links[node]) for node in range(5)])
+        indices = np.array([target for node in range(5) for target in links[node]])
+        ranks = pagerank(indptr, indices, tolerance=1e-12, max_iterations=1000)
+
+        transitions = np.zeros((5, 5))
+        for node, targets in links.items():
+            for target in targets or range(5):
+                transitions[target, node] = 1 / (len(targets) or 5)
+        expected = np.full(5, 0.2)
+        for _ in range(1000):
+            expected = 0.85 * transitions @ expected + 0.15 / 5
+        np.testing.assert_allclose(ranks, expected, atol=1e-9)
+        self.assertAlmostEqual(ranks.sum(), 1.0)
+
+    def test_link_graph(self):
+        """Test that links are resolved to document IDs, dropping links outside the index and to the page itself"""
+        url_to_id = {f"https://example.com/{i}": 10 + i for i in range(3)}
+        graph = LinkGraph()
+        graph.add(10, array('Q', [url_digest("https://example.com/1"), url_digest("https://example.com/2")]))
+        graph.add(11, array('Q', [url_digest("https://example.com/1"), url_digest("https://other.com/")]))
+        graph.add(12, array('Q', [url_digest("https://example.com/0")]))
+        indptr, indices = graph.to_csr(url_to_id, 10, 3)
+        self.assertEqual(indptr.tolist(), [0, 2, 2, 3])
+        self.assertEqual(indices.tolist(), [1, 2, 0])
+        scores = graph.static_scores(url_to_id, 10, 3)
+        self.assertAlmostEqual(scores.sum(), 3.0)
+
+    def test_static_scores_indexed(self):
+        """Test that the most linked page gets the highest static score and comes first in the postings"""
+        with tempfile.TemporaryDirectory() as directory:
+            zip_path = os.path.join(directory, 'crawl.zip')
+            # Every page links to the last one
+            pages = [(f'https://a.example.com/{i}', f'<p>anteater page {i}</p><a href="/3">hub</a>') for i in range(4)]
+            with zipfile.ZipFile(zip_path, 'w') as zip_file:
+                for i, (url, content) in enumerate(pages):
+                    zip_file.writestr(f'page{i}.json', json.dumps({'url': url, 'content': content}))
+
+            index_dir = os.path.join(directory, 'index')
+            InvertedIndex(zip_path, 0, index_dir, readers=1)
+            metadata = DocumentMetadata.open(index_dir)
+            scores = [metadata.get_static_score(doc_id) for doc_id in range(4)]
+            metadata.close()
+            self.assertEqual(max(range(4), key=scores.__getitem__), 3)
+            self.assertAlmostEqual(sum(scores), 4.0, places=4)
+
+            with open(os.path.join(index_dir, 'token_positions.pkl'), 'rb') as f:
+                offset = pickle.load(f)['anteat']
+            with open(os.path.join(index_dir, 'index.bin'), 'rb') as f:
+                f.seek(offset)
+                _, postings = pickle.load(f)
+            self.assertEqual([posting['doc_id'] for posting in postings], [3, 0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
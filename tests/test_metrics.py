@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from Search.metrics import NULL_TRACE, MetricsRegistry, QueryTrace, current_trace, end_trace, start_trace
+
+
+class TestQueryTrace(unittest.TestCase):
+    def test_nested_stages(self):
+        """Test that the time of an inner stage is taken out of the stage around it"""
+        trace = QueryTrace()
+        with trace.stage('intersect'):
+            with trace.stage('lexicon'):
+                time.sleep(0.02)
+            trace.add_time('postings_io', 0.01)
+        self.assertGreaterEqual(trace.stages['lexicon'], 0.02)
+        self.assertEqual(trace.stages['postings_io'], 0.01)
+        self.assertLess(trace.stages['intersect'], 0.01)
+        breakdown = trace.breakdown()
+        self.assertEqual(list(breakdown['stages_ms']), ['lexicon', 'postings_io', 'intersect'])
+        self.assertGreaterEqual(breakdown['total_ms'], 20)
+
+    def test_current_trace(self):
+        """Test that components only record into the trace of a running query"""
+        self.assertIs(current_trace(), NULL_TRACE)
+        trace, token = start_trace()
+        current_trace().count('cache_hits', 2)
+        end_trace(token)
+        self.assertIs(current_trace(), NULL_TRACE)
+        self.assertEqual(trace.counters['cache_hits'], 2)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_render(self):
+        """Test the Prometheus text format of the aggregated traces"""
+        metrics = MetricsRegistry()
+        trace = QueryTrace()
+        trace.add_time('decode', 0.003)
+        trace.count('bytes_read', 1024)
+        metrics.observe(trace)
+        text = metrics.render()
+        self.assertIn('anteater_queries_total 1\n', text)
+        self.assertIn('anteater_query_stage_duration_seconds_bucket{stage="decode",le="0.0025"} 0\n', text)
+        self.assertIn('anteater_query_stage_duration_seconds_bucket{stage="decode",le="0.005"} 1\n', text)
+        self.assertIn('anteater_query_stage_duration_seconds_count{stage="decode"} 1\n', text)
+        self.assertIn('anteater_postings_bytes_read_total 1024\n', text)
+
+    def test_shared_metrics(self):
+        """Test that the metrics of the worker processes sharing a directory are added up"""
+        with tempfile.TemporaryDirectory() as directory:
+            other_worker = MetricsRegistry()
+            trace = QueryTrace()
+            trace.add_time('decode', 0.003)
+            other_worker.observe(trace)
+            snapshot = other_worker.snapshot()
+            snapshot['counters']['bytes_read'] = 100
+            metrics = MetricsRegistry()
+            metrics.directory = directory
+            metrics.observe(trace)
+            with open(os.path.join(directory, 'worker_1.json'), 'w') as f:
+                json.dump(snapshot, f)
+
+            text = metrics.render()
+            self.assertIn('anteater_queries_total 2\n', text)
+            self.assertIn('anteater_query_stage_duration_seconds_count{stage="decode"} 2\n', text)
+            self.assertIn('anteater_postings_bytes_read_total 100\n', text)
+            self.assertIn(f'anteater_worker_queries_total{{pid="{os.getpid()}"}} 1\n', text)
+            self.assertIn('anteater_worker_queries_total{pid="1"} 1\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
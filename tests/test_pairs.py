@@ -0,0 +1,85 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+import zipfile
+from InvertedIndex.index import InvertedIndex
+from InvertedIndex.pairs import PAIR_OFFSETS_NAME, PAIRS_NAME, build_pair_index, query_pairs
+from Search.search import Search
+
+
+class TestPairs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        zip_path = os.path.join(self.directory.name, 'crawl.zip')
+        # 'anteater' and 'campus' are in 6 pages each and together in 3 of them
+        contents = ['anteater campus'] * 3 + ['anteater library'] * 3 + ['campus library'] * 3 + ['zot']
+        with zipfile.ZipFile(zip_path, 'w') as zip_file:
+            for i, content in enumerate(contents):
+                zip_file.writestr(f'page{i}.json', json.dumps({'url': f'https://a.example.com/{i}',
+                                                               'content': f'<p>{content} {i}</p>'}))
+        self.index_dir = os.path.join(self.directory.name, 'index')
+        InvertedIndex(zip_path, 0, self.index_dir, readers=1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_pairs(self):
+        with open(os.path.join(self.index_dir, PAIR_OFFSETS_NAME), 'rb') as f:
+            pair_index = pickle.load(f)
+        pairs = {}
+        with open(os.path.join(self.index_dir, PAIRS_NAME), 'rb') as f:
+            for key, offset in pair_index['offsets'].items():
+                f.seek(offset)
+                stored_key, postings = pickle.load(f)
+                self.assertEqual(stored_key, key)
+                pairs[key] = {term: [posting['doc_id'] for posting in term_postings]
+                              for term, term_postings in postings.items()}
+        return pairs, pair_index['document_frequencies']
+
+    def test_pairs_from_corpus(self):
+        """Test that without a query log, the pairs of frequent terms in the most documents are kept"""
+        self.assertEqual(build_pair_index(self.index_dir, num_pairs=3, candidate_terms=4), 3)
+        pairs, frequencies = self.read_pairs()
+        self.assertEqual(set(pairs), {('anteat', 'campu'), ('anteat', 'librari'), ('campu', 'librari')})
+        self.assertEqual(pairs['anteat', 'campu'], {'anteat': [0, 1, 2], 'campu': [0, 1, 2]})
+        self.assertEqual(frequencies['anteat'], 6)
+
+        # Without pairs, the files of the previous pair index are removed
+        self.assertEqual(build_pair_index(self.index_dir, num_pairs=0), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.index_dir, PAIRS_NAME)))
+
+    def test_pairs_from_query_log(self):
+        """Test that the pairs searched together are kept, and unknown or wildcard terms ignored"""
+        query_log = os.path.join(self.directory.name, 'queries.txt')
+        with open(query_log, 'w') as f:
+            f.write("Anteater campus\nanteaters campus\nanteater unknown\nlib* campus\nzot anteater\n")
+        self.assertEqual(query_pairs(query_log)['anteat', 'campu'], 2)
+        self.assertEqual(build_pair_index(self.index_dir, query_log, num_pairs=10), 2)
+        pairs, _ = self.read_pairs()
+        self.assertEqual(set(pairs), {('anteat', 'campu'), ('anteat', 'zot')})
+        self.assertEqual(pairs['anteat', 'zot'], {'anteat': [], 'zot': []})
+
+    def test_search_with_pairs(self):
+        """Test that queries routed through the pair index get the same results"""
+        queries = [['anteat', 'campu'], ['campu', 'anteat', '1'], ['anteat', 'librari', 'campu'], ['anteat', 'zot']]
+        search = Search(index_dir=self.index_dir)
+        expected = {mode: [search.top_k(query, 5, mode=mode) for query in queries] for mode in ('and', 'auto')}
+        # Too few documents have the phrase, the 'auto' mode adds the partial matches to its AND result
+        phrases = [(['anteat', 'campu'], 0)]
+        expected_phrase = search.top_k(['anteat', 'campu', 'librari'], 5, phrases, mode='auto')
+        search.close()
+
+        build_pair_index(self.index_dir, num_pairs=3, candidate_terms=4)
+        search = Search(index_dir=self.index_dir)
+        self.assertTrue(search.index_reader.has_pair('campu', 'anteat'))
+        self.assertEqual(set(search.query_processor.pair_postings(['anteat', 'campu'])), {'anteat', 'campu'})
+        for mode in ('and', 'auto'):
+            self.assertEqual([search.top_k(query, 5, mode=mode) for query in queries], expected[mode])
+        self.assertEqual(search.top_k(['anteat', 'campu', 'librari'], 5, phrases, mode='auto'), expected_phrase)
+        search.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+import zipfile
+from InvertedIndex.index import InvertedIndex
+from InvertedIndex.positions import encode_positions, decode_positions
+from Search.query.query_processor import QueryProcessor
+from Search.search import Search
+
+
+class FakePositionsReader:
+    """In-memory index reader holding the positions of a few terms"""
+    def __init__(self, positions):
+        self.positions = positions
+
+    def get_positions_for_terms(self, terms, doc_ids):
+        return {term: {doc_id: positions for doc_id, positions in self.positions.get(term, {}).items()
+                       if doc_id in doc_ids} for term in terms}
+
+
+class TestPositions(unittest.TestCase):
+    def test_round_trip(self):
+        """Test that encoded positions decode to the original positions"""
+        positions = [0, 1, 5, 127, 128, 300, 70000]
+        self.assertEqual(decode_positions(encode_positions(positions)), positions)
+
+    def test_small_gaps_use_one_byte(self):
+        """Test that positions are delta encoded, gaps under 128 taking a single byte"""
+        self.assertEqual(encode_positions([3, 10, 12]), bytes([3, 7, 2]))
+        self.assertEqual(encode_positions([128]), bytes([0x80, 0x01]))
+        self.assertEqual(decode_positions(b""), [])
+
+
+class TestPhraseQueries(unittest.TestCase):
+    def test_parse_query(self):
+        """Test that quoted phrases and their slop are parsed, and their terms searched too"""
+        query_processor = QueryProcessor(None)
+        parsed_query = query_processor.parse_query('"Machine Learning"~2 vision "anteater"')
+        self.assertEqual(parsed_query.phrases, [(['machin', 'learn'], 2)])
+        # A single term phrase is just a term
+        self.assertEqual(parsed_query.terms, ['machin', 'learn', 'vision', 'anteat'])
+        self.assertEqual(query_processor.parse_query('"machine learning" vision').phrases,
+                         [(['machin', 'learn'], 0)])
+        self.assertEqual(query_processor.parse_query('machine learning').phrases, [])
+
+    def test_phrase_search_order_and_slop(self):
+        """Test that the phrase terms must occur in order, with at most slop other tokens between them"""
+        query_processor = QueryProcessor(FakePositionsReader({
+            'machin': {0: [4], 1: [2], 2: [9]},
+            'learn': {0: [5], 1: [5], 2: [1]},
+        }))
+        self.assertEqual(query_processor.phrase_search(['machin', 'learn'], 0, {0, 1, 2}), {0})
+        self.assertEqual(query_processor.phrase_search(['machin', 'learn'], 2, {0, 1, 2}), {0, 1})
+        self.assertEqual(query_processor.phrase_search(['learn', 'machin'], 0, {0, 1, 2}), set())
+        # Only the given documents are checked
+        self.assertEqual(query_processor.phrase_search(['machin', 'learn'], 2, {1}), {1})
+
+    def test_phrase_search_repeated_terms(self):
+        """Test that every occurrence of a repeated phrase term is a distinct position"""
+        query_processor = QueryProcessor(FakePositionsReader({'cor': {0: [0, 1, 2], 1: [0, 1, 5], 2: [3]}}))
+        self.assertEqual(query_processor.phrase_search(['cor', 'cor', 'cor'], 0, {0, 1, 2}), {0})
+        self.assertEqual(query_processor.phrase_search(['cor', 'cor', 'cor'], 3, {0, 1, 2}), {0, 1})
+        self.assertEqual(query_processor.phrase_search(['cor', 'cor'], 0, {0, 1, 2}), {0, 1})
+
+    def test_in_order_within(self):
+        """Test that a later start is tried when the earliest one doesn't fit the window"""
+        query_processor = QueryProcessor(None)
+        self.assertTrue(query_processor._in_order_within([[0, 7], [3, 8]], 1))
+        self.assertFalse(query_processor._in_order_within([[0, 7], [3, 9]], 1))
+        self.assertFalse(query_processor._in_order_within([[5], [1, 2]], 10))
+
+    def test_phrases_with_and_without_positions(self):
+        """Test that phrases are matched with positions, and fall back to the AND search without them"""
+        with tempfile.TemporaryDirectory() as directory:
+            zip_path = os.path.join(directory, 'crawl.zip')
+            contents = ['anteater campus', 'campus anteater', 'anteater library campus']
+            with zipfile.ZipFile(zip_path, 'w') as zip_file:
+                for i, content in enumerate(contents):
+                    zip_file.writestr(f'page{i}.json', json.dumps({'url': f'https://a.example.com/{i}',
+                                                                   'content': f'<p>{content}</p>'}))
+            query = QueryProcessor(None).parse_query('"anteater campus"')
+
+            for store_positions, expected in ((True, {'0'}), (False, {'0', '1', '2'})):
+                index_dir = os.path.join(directory, str(store_positions))
+                InvertedIndex(zip_path, 0, index_dir, store_positions=store_positions, readers=1)
+                search = Search(index_dir=index_dir)
+                doc_ids = search.search(query.terms, query.phrases)
+                self.assertEqual({search.index_reader.get_url(doc_id).rsplit('/', 1)[1] for doc_id in doc_ids},
+                                 expected)
+                # With slop, one token may come between the phrase terms
+                if store_positions:
+                    self.assertEqual(len(search.search(query.terms, [(['anteat', 'campu'], 1)])), 2)
+                search.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from array import array
+from InvertedIndex.posting import Posting, PostingsBuffer
+
+
+class TestPostingsBuffer(unittest.TestCase):
+    def test_buffer(self):
+        """Test that postings round trip through the bytes of a partial index and merge in order"""
+        buffer = PostingsBuffer()
+        buffer.append(3, 0.5)
+        buffer.append(7, 0.25, 3)
+        merged = PostingsBuffer.from_bytes(*buffer.to_bytes())
+        merged.extend(PostingsBuffer(array('I', [9]), array('d', [1.0])))
+
+        self.assertEqual(len(merged), 3)
+        self.assertEqual(merged.to_dicts(), [{'doc_id': 3, 'tf': 0.5}, {'doc_id': 7, 'tf': 0.25, 'fields': 3},
+                                             {'doc_id': 9, 'tf': 1.0}])
+        views = list(merged)
+        self.assertIsInstance(views[0], Posting)
+        self.assertEqual((views[1].doc_id, views[1].tf, views[1].fields), (7, 0.25, 3))
+        self.assertEqual(views[1].to_dict(), merged.to_dicts()[1])
+        self.assertFalse(hasattr(views[0], '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import signal
+import time
+import unittest
+import urllib.request
+from Search.prefork import PreforkServer, worker_cache_size
+
+
+def pid_app(environ, start_response):
+    """WSGI application answering with the ID of the process serving the request"""
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode()]
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), "pre-fork serving needs os.fork")
+class TestPreforkServer(unittest.TestCase):
+    def get_pids(self, port, requests=10):
+        """Get the process IDs of the workers answering some requests"""
+        pids = set()
+        for _ in range(requests):
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5) as response:
+                pids.add(int(response.read()))
+        return pids
+
+    def test_workers_and_restart(self):
+        """Test that forked workers serve the shared socket, and that SIGHUP replaces them"""
+        loaded = []
+        server = PreforkServer(pid_app, '127.0.0.1', 0, workers=2, on_reload=lambda: loaded.append(True))
+        _, port = server.bind()
+        master = os.fork()
+        if master == 0:
+            try:
+                server.run()
+            finally:
+                os._exit(0)
+        server.socket.close()
+        try:
+            time.sleep(0.5)
+            pids = self.get_pids(port)
+            self.assertNotIn(master, pids)
+            self.assertNotIn(os.getpid(), pids)
+
+            os.kill(master, signal.SIGHUP)
+            time.sleep(1.5)
+            self.assertFalse(self.get_pids(port) & pids)
+        finally:
+            os.kill(master, signal.SIGTERM)
+            _, status = os.waitpid(master, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class TestWorkerCacheSize(unittest.TestCase):
+    def test_budget_split(self):
+        """Test that the cache budget is split between the workers and their shards"""
+        self.assertEqual(worker_cache_size(1000, 4), 250)
+        self.assertEqual(worker_cache_size(1000, 4, shards=5), 50)
+        self.assertEqual(worker_cache_size(3, 4), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
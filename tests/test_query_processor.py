@@ -0,0 +1,121 @@
+import unittest
+from Search.query.deadline import Deadline
+from Search.query.query_processor import QueryProcessor
+
+
+class FakeIndexReader:
+    """In-memory index reader holding a few postings lists"""
+    def __init__(self, postings, pairs=None, positions=None):
+        self.postings = postings
+        # Positions of each term by document, None for an index without positions
+        self.positions = positions
+        # Pair postings keyed by sorted term pairs, like the pair index
+        self.pair_offsets = pairs or {}
+        self.pair_reads = []
+
+    def has_pair(self, term_a, term_b):
+        return tuple(sorted((term_a, term_b))) in self.pair_offsets
+
+    def get_pair_postings(self, term_a, term_b):
+        self.pair_reads.append((term_a, term_b))
+        return self.pair_offsets.get(tuple(sorted((term_a, term_b))))
+
+    def get_document_frequencies(self, terms):
+        return {term: len(self.postings.get(term, [])) for term in terms}
+
+    def get_postings_for_terms(self, terms):
+        return {term: self.postings.get(term, []) for term in terms}
+
+    def get_positions_for_terms(self, terms, doc_ids):
+        if self.positions is None:
+            return None
+        return {term: {doc_id: positions for doc_id, positions in self.positions.get(term, {}).items()
+                       if doc_id in doc_ids} for term in terms}
+
+    def prefix_terms(self, prefix, max_terms):
+        matches = [(term, len(postings)) for term, postings in self.postings.items() if term.startswith(prefix)]
+        return sorted(matches, key=lambda match: match[1], reverse=True)[:max_terms]
+
+
+class TestQueryProcessor(unittest.TestCase):
+    def setUp(self):
+        self.query_processor = QueryProcessor(FakeIndexReader({
+            'machin': [{'doc_id': 0, 'tf': 2}, {'doc_id': 1, 'tf': 1}],
+            'vision': [{'doc_id': 0, 'tf': 1}, {'doc_id': 2, 'tf': 3}],
+            'learn': [{'doc_id': 0, 'tf': 1}],
+            'learner': [{'doc_id': 2, 'tf': 1}],
+        }))
+
+    def test_disjunctive_search_counts_matched_terms(self):
+        """Test that the OR search counts the query terms each document contains"""
+        coverage, num_terms = self.query_processor.disjunctive_search(['machin', 'vision', 'learn'])
+        self.assertEqual(num_terms, 3)
+        self.assertEqual(coverage, {0: 3, 1: 1, 2: 1})
+
+    def test_disjunctive_search_ignores_unknown_terms(self):
+        """Test that terms missing from the index don't count as query terms"""
+        coverage, num_terms = self.query_processor.disjunctive_search(['vision', 'missing'])
+        self.assertEqual(num_terms, 1)
+        self.assertEqual(coverage, {0: 1, 2: 1})
+        self.assertEqual(self.query_processor.disjunctive_search(['missing']), ({}, 0))
+
+    def test_wildcard_expansions_are_unioned(self):
+        """Test that a wildcard term matches the documents of any of its expansions"""
+        self.assertEqual(self.query_processor.tokenize_query("Learn* vision"), ['learn*', 'vision'])
+        self.assertEqual(self.query_processor.expand_terms(['learn*']), [['learn', 'learner']])
+        self.assertEqual(self.query_processor.boolean_and_search(['learn*', 'vision']), {0, 2})
+        self.assertEqual(self.query_processor.boolean_and_search(['learn*', 'machin']), {0})
+        coverage, num_terms = self.query_processor.disjunctive_search(['learn*', 'vision'])
+        self.assertEqual((coverage, num_terms), ({0: 2, 2: 2}, 2))
+
+    def test_expanded_prefixes_are_kept(self):
+        """Test that wildcard terms expanded once, as for the shards, aren't expanded again"""
+        query_terms = self.query_processor.expand_prefixes(['learn*', 'vision'])
+        self.assertEqual(query_terms, [('learn', 'learner'), 'vision'])
+        # A shard whose own lexicon only has one of the expansions searches both
+        postings = self.query_processor.index_reader.postings
+        query_processor = QueryProcessor(FakeIndexReader({'learn': postings['learn'], 'vision': postings['vision']}))
+        self.assertEqual(query_processor.expand_terms(query_terms), [['learn', 'learner'], ['vision']])
+        self.assertEqual(query_processor.boolean_and_search(query_terms), {0})
+        self.assertEqual(QueryProcessor(None).expand_prefixes(['learn*']), ['learn*'])
+
+    def test_wildcard_phrase_terms(self):
+        """Test that a wildcard phrase term matches the positions of any of its expansions"""
+        parsed_query = self.query_processor.parse_query('"learn* vision"')
+        self.assertEqual(parsed_query.terms, ['learn*', 'vision'])
+        self.assertEqual(parsed_query.phrases, [(['learn*', 'vision'], 0)])
+
+        postings = self.query_processor.index_reader.postings
+        positions = {'learn': {0: [3]}, 'learner': {2: [7]}, 'vision': {0: [4], 2: [1, 9]}}
+        query_processor = QueryProcessor(FakeIndexReader(postings, positions=positions))
+        self.assertEqual(query_processor.phrase_search(['learn*', 'vision'], 0, {0, 2}), {0})
+        self.assertEqual(query_processor.phrase_search(['learn*', 'vision'], 1, {0, 2}), {0, 2})
+        self.assertEqual(query_processor.phrase_search(['vision', 'learn*'], 0, {0, 2}), set())
+        # The expansions sent to the shards match the same documents
+        self.assertEqual(query_processor.phrase_search([('learn', 'learner'), 'vision'], 1, {0, 2}), {0, 2})
+
+    def test_pair_postings_route_the_intersection(self):
+        """Test that paired terms are intersected through their pair postings, with the same result"""
+        postings = self.query_processor.index_reader.postings
+        pairs = {('machin', 'vision'): {'machin': [{'doc_id': 0, 'tf': 2}], 'vision': [{'doc_id': 0, 'tf': 1}]}}
+        query_processor = QueryProcessor(FakeIndexReader(postings, pairs))
+        self.assertEqual(query_processor.pair_postings(['vision', 'machin', 'learn*']), pairs['machin', 'vision'])
+        self.assertEqual(query_processor.boolean_and_search(['vision', 'machin']),
+                         self.query_processor.boolean_and_search(['vision', 'machin']))
+        self.assertEqual(query_processor.boolean_and_search(['vision', 'machin', 'learn*']), {0})
+        self.assertEqual(query_processor.index_reader.pair_reads[0], ('vision', 'machin'))
+        self.assertEqual(query_processor.pair_postings(['vision', 'learn']), {})
+
+    def test_deadline_skips_common_terms(self):
+        """Test that past the deadline, only the rarest term is read and the skipped terms are reported"""
+        deadline = Deadline(timeout_ms=0)
+        self.assertEqual(self.query_processor.boolean_and_search(['machin', 'learn'], deadline=deadline), {0})
+        self.assertEqual(self.query_processor.boolean_and_search(['vision', 'learn*'], deadline=deadline), {0, 2})
+        # A wildcard term is skipped with all its expansions
+        self.assertEqual(deadline.skipped_terms, {'machin', 'learn', 'learner'})
+        self.assertEqual(deadline.skipped, {'terms': 3, 'postings': 4})
+
+        deadline = Deadline(timeout_ms=0)
+        coverage, num_terms = self.query_processor.disjunctive_search(['machin', 'learn'], deadline)
+        self.assertEqual((coverage, num_terms), ({0: 1}, 1))
+        self.assertEqual(self.query_processor.boolean_and_search(['machin', 'learn'], deadline=Deadline(1000)), {0})
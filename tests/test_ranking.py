@@ -0,0 +1,110 @@
+import unittest
+from InvertedIndex.fields import FIELDS, parse_field_weights
+from Search.query.deadline import CHECK_INTERVAL, DOCUMENT_CHECK_INTERVAL, Deadline
+from Search.query.ranking import Ranking, count_matched_groups
+
+
+class FakeIndexReader:
+    """In-memory index reader holding a few postings lists, document lengths and static scores"""
+    def __init__(self, postings, lengths, static_scores=None):
+        self.postings = postings
+        self.lengths = lengths
+        self.static_scores = static_scores or {}
+
+    def get_postings_for_term(self, term):
+        return self.postings.get(term, [])
+
+    def get_document_frequency(self, term):
+        return len(self.postings.get(term, []))
+
+    def get_document_length(self, doc_id):
+        return self.lengths.get(doc_id, 0)
+
+    def get_average_document_length(self):
+        return sum(self.lengths.values()) / len(self.lengths)
+
+    def get_static_score(self, doc_id):
+        return self.static_scores.get(doc_id, 0.0)
+
+    def get_url(self, doc_id):
+        return f"https://example.com/{doc_id}"
+
+
+class TestRanking(unittest.TestCase):
+    def setUp(self):
+        # Both documents hold 'anteat' twice in 10 tokens, in the title of document 1
+        self.index_reader = FakeIndexReader({
+            'anteat': [{'doc_id': 0, 'tf': 0.2}, {'doc_id': 1, 'tf': 0.2, 'fields': FIELDS['title']}],
+            'zot': [{'doc_id': 0, 'tf': 0.1}, {'doc_id': 1, 'tf': 0.1}, {'doc_id': 2, 'tf': 0.5}],
+        }, {0: 10, 1: 10, 2: 2})
+
+    def rank(self, **kwargs):
+        ranking = Ranking(3, self.index_reader, **kwargs)
+        return [doc_id for doc_id, *_ in ranking.rank_results({0, 1}, ['anteat', 'zot'])]
+
+    def test_fields_weighted_at_query_time(self):
+        """Test that a term in the title ranks higher, unless its field weight is set to 0"""
+        self.assertEqual(self.rank(), [1, 0])
+        self.assertEqual(self.rank(field_weights=parse_field_weights("title=0")), [0, 1])
+
+    def test_term_weight(self):
+        """Test that the weight of a term saturates with its occurrences and fields"""
+        ranking = Ranking(3, self.index_reader, k1=1.2, b=0.75)
+        body = ranking.term_weight({'doc_id': 0, 'tf': 0.2}, 10)
+        title = ranking.term_weight({'doc_id': 1, 'tf': 0.2, 'fields': FIELDS['title']}, 10)
+        # 2 occurrences in a document of the average length, 2 + 5 with the title weight
+        self.assertAlmostEqual(body, 2 * 2.2 / (2 + 1.2 * (0.25 + 0.75 * 10 / (22 / 3))))
+        self.assertAlmostEqual(title, 7 * 2.2 / (7 + 1.2 * (0.25 + 0.75 * 10 / (22 / 3))))
+        self.assertLess(title, 2.2)
+
+    def test_static_scores(self):
+        """Test that the static score of a document is a prior on its score, ignored with a weight of 0"""
+        self.index_reader.static_scores = {0: 10.0, 1: 0.1}
+        self.assertEqual(self.rank(), [0, 1])
+        self.assertEqual(self.rank(static_weight=0), [1, 0])
+
+    def test_deadline_scores_first_blocks(self):
+        """Test that past the deadline, only the first blocks of postings and documents are scored"""
+        num_documents = CHECK_INTERVAL + 500
+        self.index_reader.postings['common'] = [{'doc_id': doc_id, 'tf': 0.1} for doc_id in range(num_documents)]
+        self.index_reader.lengths.update((doc_id, 10) for doc_id in range(3, num_documents))
+        ranking = Ranking(num_documents, self.index_reader)
+        doc_ids = set(range(num_documents))
+        self.assertEqual(len(ranking.rank_results(doc_ids, ['common'], deadline=Deadline())), num_documents)
+
+        deadline = Deadline(timeout_ms=0)
+        ranked = ranking.rank_results(doc_ids, ['common'], deadline=deadline)
+        # The documents are scored in the order of the postings, the first block of them
+        self.assertEqual({doc_id for doc_id, *_ in ranked}, set(range(DOCUMENT_CHECK_INTERVAL)))
+        self.assertTrue(deadline.partial)
+        self.assertEqual(deadline.stats(), {'timeout_ms': 0, 'skipped': {
+            'postings': 500, 'documents': num_documents - DOCUMENT_CHECK_INTERVAL}})
+
+        # The rarest term is scored first, the common one is left
+        deadline = Deadline(timeout_ms=0)
+        ranked = ranking.rank_results(doc_ids, ['common', 'zot'], deadline=deadline, k=2)
+        self.assertEqual([doc_id for doc_id, *_ in ranked], [2, 0])
+        self.assertEqual(deadline.skipped, {'terms': 1, 'documents': num_documents - 3})
+
+    def test_wildcard_term_matches_once(self):
+        """Test that the expansions of a wildcard term count as one matched query term"""
+        for term in ('zot1', 'zot2', 'zot3'):
+            self.index_reader.postings[term] = [{'doc_id': 2, 'tf': 0.5}]
+        self.index_reader.postings['zot1'].append({'doc_id': 1, 'tf': 0.1})
+        ranking = Ranking(3, self.index_reader)
+        term_groups = [['anteat'], ['zot1', 'zot2', 'zot3']]
+        ranked = ranking.rank_results({1, 2}, ['anteat', 'zot1', 'zot2', 'zot3'], term_groups=term_groups)
+        # Document 2 contains three expansions of one query term, document 1 both query terms
+        self.assertEqual([doc_id for doc_id, *_ in ranked], [1, 2])
+        self.assertEqual(count_matched_groups(ranked[1][3], term_groups + [['zot2', 'zot3']]), 2)
+
+    def test_parse_field_weights(self):
+        """Test that fields left out keep their default weight and unknown fields are rejected"""
+        weights = parse_field_weights("title=8, bold=0.5")
+        self.assertEqual((weights['title'], weights['bold'], weights['h1']), (8.0, 0.5, 4))
+        with self.assertRaises(ValueError):
+            parse_field_weights("footer=2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import importlib
+import json
+import os
+import tempfile
+import time
+import unittest
+import zipfile
+from unittest import mock
+from InvertedIndex.index import InvertedIndex
+from Search.reloader import SearchReloader
+from Search.search import Search
+
+
+class TestSearchReloader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        zip_path = os.path.join(cls.directory.name, 'crawl.zip')
+        contents = ['anteater campus', 'anteater library', 'campus library zot']
+        with zipfile.ZipFile(zip_path, 'w') as zip_file:
+            for i, content in enumerate(contents):
+                zip_file.writestr(f'page{i}.json', json.dumps({'url': f'https://a.example.com/{i}',
+                                                               'content': f'<p>{content}</p>'}))
+        cls.index_dir = os.path.join(cls.directory.name, 'index')
+        InvertedIndex(zip_path, 0, cls.index_dir, readers=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def wait_for_generation(self, reloader, generation, timeout=10):
+        """Wait until the reloader swapped in the given generation"""
+        end = time.monotonic() + timeout
+        while reloader.generation < generation and time.monotonic() < end:
+            time.sleep(0.02)
+        self.assertEqual(reloader.generation, generation)
+
+    def test_swap_keeps_acquired_instance_open(self):
+        """Test that a replaced instance serves the requests holding it and is closed by the last one"""
+        reloader = SearchReloader(lambda index_dir: Search(index_dir=index_dir), self.index_dir)
+        old_engine = reloader.acquire()
+        expected = old_engine.top_k(['anteat'], 5)
+        with mock.patch.object(old_engine, 'close', wraps=old_engine.close) as close:
+            self.assertEqual(reloader.reload(), 1)
+            self.assertIsNot(reloader.get(), old_engine)
+            # The request that acquired the old instance before the swap keeps working on it
+            self.assertEqual(old_engine.top_k(['anteat'], 5), expected)
+            close.assert_not_called()
+            reloader.release(old_engine)
+            close.assert_called_once()
+
+        # An instance nobody uses is closed right away
+        with reloader.using() as search_engine:
+            self.assertEqual(search_engine.top_k(['anteat'], 5), expected)
+        with mock.patch.object(search_engine, 'close') as close:
+            reloader.reload()
+            close.assert_called_once()
+        reloader.get().close()
+
+    def test_warm_up_replays_recent_queries(self):
+        """Test that the new instance is warmed with the most recent queries, each once"""
+        engines = []
+
+        def factory(index_dir):
+            engines.append(mock.Mock(index_reader=None))
+            return engines[-1]
+
+        reloader = SearchReloader(factory, self.index_dir, warmup_queries=2)
+        for query_terms in (['zot'], ['anteat', 'campu'], ['librari'], ['anteat', 'campu']):
+            reloader.record_query(query_terms)
+        reloader.reload()
+        self.assertEqual([call.args for call in engines[1].top_k.call_args_list],
+                         [(['librari'], 5), (['anteat', 'campu'], 5)])
+
+    def test_watch_reloads_changed_index(self):
+        """Test that rewriting a watched file of the index triggers a reload"""
+        reloader = SearchReloader(lambda index_dir: mock.Mock(index_reader=None), self.index_dir)
+        reloader.watch(interval=0.05)
+        time.sleep(0.2)
+        path = os.path.join(self.index_dir, 'token_positions.pkl')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.wait_for_generation(reloader, 1)
+
+    def test_admin_reload_requires_token(self):
+        """Test that /admin/reload is refused without the admin token, and reloads with it"""
+        with mock.patch.dict(os.environ, {'INDEX_DIR': self.index_dir, 'ADMIN_TOKEN': 'secret'}):
+            search_server = importlib.import_module('search_server')
+        with mock.patch.object(search_server, 'admin_token', 'secret'), \
+                mock.patch.object(search_server, 'reloader',
+                                  SearchReloader(lambda index_dir: Search(index_dir=index_dir), self.index_dir)):
+            client = search_server.app.test_client()
+            self.assertEqual(client.post('/admin/reload').status_code, 403)
+            self.assertEqual(client.post('/admin/reload', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+            self.assertEqual(search_server.reloader.generation, 0)
+
+            response = client.post('/admin/reload', headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(response.status_code, 202)
+            self.wait_for_generation(search_server.reloader, 1)
+            search_server.reloader.get().close()
+        search_server.reloader.get().close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from array import array
+from InvertedIndex.report import IndexingProfiler, postings_statistics
+
+
+class TestIndexingProfiler(unittest.TestCase):
+    def test_nested_stages_and_workers(self):
+        """Test that inner stages are taken out of outer ones, and worker timings are summed"""
+        profiler = IndexingProfiler()
+        with profiler.stage('zip_read'):
+            profiler.count('zip_read', 2, 100)
+            with profiler.stage('simhash'):
+                time.sleep(0.02)
+        profiler.add_worker_timings({'html_parse': (0.5, 0.4, 2, 100), 'tokenize': (1.0, 0.9, 2, 80),
+                                     'pid': 1, 'peak_rss': 1000})
+        profiler.add_worker_timings({'html_parse': (0.5, 0.4, 3, 150), 'pid': 2, 'peak_rss': 3000})
+
+        stages = profiler.stage_report()
+        self.assertGreaterEqual(stages['simhash']['wall_seconds'], 0.02)
+        self.assertLess(stages['zip_read']['wall_seconds'], 0.02)
+        self.assertEqual(stages['html_parse']['documents'], 5)
+        self.assertEqual(stages['html_parse']['docs_per_sec'], 5.0)
+        self.assertEqual(stages['html_parse']['processes'], 2)
+        self.assertEqual(stages['tokenize']['bytes_per_sec'], 80.0)
+        self.assertEqual(profiler.worker_peak_rss, {1: 1000, 2: 3000})
+
+    def test_report_file(self):
+        """Test the postings statistics and the JSON report written for an index"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            with open(os.path.join(index_dir, 'lexicon.pkl'), 'wb') as f:
+                pickle.dump({'terms': ['a', 'b', 'c', 'd'], 'document_frequencies': array('I', [1, 2, 3, 9])}, f)
+            statistics = postings_statistics(index_dir, top_terms=2)
+            self.assertEqual((statistics['terms'], statistics['postings']), (4, 15))
+            self.assertEqual(statistics['document_frequency_histogram'], {'1': 1, '2-3': 2, '8-15': 1})
+            self.assertEqual(statistics['top_terms'], [('d', 9), ('c', 3)])
+
+            report_path = os.path.join(index_dir, 'report.json')
+            IndexingProfiler().write(report_path, index_dir, 10)
+            with open(report_path, 'r') as f:
+                report = json.load(f)
+            self.assertEqual(report['documents'], 10)
+            self.assertIn('lexicon.pkl', report['files'])
+            self.assertEqual(report['postings']['top_terms'][0], ['d', 9])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import json
+import os
+import tempfile
+from InvertedIndex.segments import SegmentManager
+
+
+class TestSegmentManager(unittest.TestCase):
+    def test_add_segment_tombstones_updated_urls(self):
+        """Test that re-indexing a URL in a new segment tombstones the old document"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            segment_manager = SegmentManager(index_dir)
+            segment_manager.add_segment("zips/dummy.zip")
+            segment_manager.add_segment("zips/dummy.zip")
+
+            segments = segment_manager.manifest["segments"]
+            self.assertEqual([(s["base_doc_id"], s["end_doc_id"]) for s in segments], [(0, 2), (2, 4)])
+            self.assertEqual(sorted(segment_manager.manifest["tombstones"][segments[0]["name"]]), [0, 1])
+
+            with open(os.path.join(index_dir, "segments.json")) as f:
+                self.assertEqual(json.load(f)["generation"], 2)
+
+    def test_merge_drops_deleted_documents(self):
+        """Test that the merge policy compacts adjacent segments without their deleted documents"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            segment_manager = SegmentManager(index_dir, merge_factor=2)
+            segment_manager.add_segment("zips/dummy.zip")
+            segment_manager.add_segment("zips/dummy.zip")
+            self.assertEqual(segment_manager.delete_urls(["doc1.test"]), 1)
+
+            self.assertEqual(segment_manager.maybe_merge(), 1)
+            segments = segment_manager.manifest["segments"]
+            self.assertEqual(len(segments), 1)
+            self.assertEqual(segments[0]["doc_count"], 1)
+            self.assertEqual(segment_manager.manifest["tombstones"], {})
+
+            with open(os.path.join(segment_manager.segment_dir(segments[0]["name"]), "urls.json")) as f:
+                self.assertEqual(json.load(f), {"3": "doc2.test"})
+
+    def test_merge_drops_fully_deleted_segments(self):
+        """Test that merging segments whose documents were all deleted drops them instead of writing an empty one"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            segment_manager = SegmentManager(index_dir, merge_factor=2)
+            segment_manager.add_segment("zips/dummy.zip")
+            segment_manager.add_segment("zips/dummy.zip")
+            names = [segment["name"] for segment in segment_manager.manifest["segments"]]
+            self.assertEqual(segment_manager.delete_urls(["doc1.test", "doc2.test"]), 2)
+
+            self.assertIsNone(segment_manager.merge_segments(segment_manager.manifest["segments"]))
+            self.assertEqual(segment_manager.manifest["segments"], [])
+            self.assertEqual(segment_manager.manifest["tombstones"], {})
+            self.assertEqual(segment_manager.manifest["retired"], names)
@@ -0,0 +1,77 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+import zipfile
+from InvertedIndex.index import InvertedIndex
+from Search.search import Search
+from Search.shards import open_shards
+
+
+class TestShardCoordinator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        zip_path = os.path.join(cls.directory.name, 'crawl.zip')
+        words = ['anteater', 'campus', 'library', 'librarian', 'libretto', 'zot', 'aldrich', 'park']
+        generator = random.Random(7)
+        with zipfile.ZipFile(zip_path, 'w') as zip_file:
+            for i in range(24):
+                # Every page gets a different mix and count of the words
+                content = ' '.join(word for word in words for _ in range(generator.choice((0, 0, 1, 2))))
+                zip_file.writestr(f'page{i}.json', json.dumps({'url': f'https://a.example.com/{i}',
+                                                               'content': f'<p>{content} page {i}</p>'}))
+        cls.single_dir = os.path.join(cls.directory.name, 'single')
+        cls.sharded_dir = os.path.join(cls.directory.name, 'sharded')
+        InvertedIndex(zip_path, 0, cls.single_dir, readers=1)
+        InvertedIndex(zip_path, 0, cls.sharded_dir, num_shards=3, readers=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def results(self, search, query_terms, mode):
+        """Get the total and the results of a query, ties in any order"""
+        total, results = search.top_k(query_terms, 30, mode=mode)
+        return total, sorted((doc_id, round(score, 9)) for doc_id, _, score, _ in results)
+
+    def test_sharded_results_match_single_index(self):
+        """Test that the merged results of the shards have the totals and scores of the unsharded index"""
+        queries = [['anteat', 'campu'], ['zot', 'aldrich', 'park'], ['libr*'], ['libr*', 'zot'], ['anteat', 'missing']]
+        single = Search(index_dir=self.single_dir)
+        # The coordinator expands the wildcard terms with the global lexicon, the same for every shard
+        sharded = Search(shards=open_shards(self.sharded_dir, None), index_dir=self.sharded_dir)
+        try:
+            for query_terms in queries:
+                for mode in ('and', 'or', 'auto'):
+                    self.assertEqual(self.results(sharded, query_terms, mode),
+                                     self.results(single, query_terms, mode), (query_terms, mode))
+        finally:
+            single.close()
+            sharded.close()
+
+    def test_partial_matches_merged_by_matched_terms(self):
+        """Test that the merged partial matches come by decreasing number of query terms, wildcard terms counting once"""
+        single = Search(index_dir=self.single_dir)
+        sharded = Search(shards=open_shards(self.sharded_dir, None), index_dir=self.sharded_dir)
+        # Without a global lexicon, every shard expands the wildcard terms and the coordinator
+        # groups the terms of their results by prefix
+        unexpanded = Search(shards=open_shards(self.sharded_dir, None), index_dir=self.directory.name)
+        self.assertIsNone(unexpanded.query_processor.index_reader)
+        try:
+            for search in (sharded, unexpanded):
+                for mode in ('or', 'auto'):
+                    total, results = search.top_k(['libr*', 'zot', 'missing'], 30, mode=mode)
+                    self.assertEqual(total, single.top_k(['libr*', 'zot', 'missing'], 30, mode=mode)[0])
+                    counts = [('zot' in info) + any(term.startswith('libr') for term in info)
+                              for _, _, _, info in results]
+                    self.assertEqual(counts, sorted(counts, reverse=True))
+                    self.assertEqual(set(counts), {1, 2})
+        finally:
+            single.close()
+            sharded.close()
+            unexpanded.close()
+
+if __name__ == '__main__':
+    unittest.main()
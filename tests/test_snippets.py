@@ -0,0 +1,28 @@
+import unittest
+from nltk.stem import PorterStemmer
+from InvertedIndex.index import tokenize_chunk
+from Search.query.snippets import make_snippet
+
+
+class TestSnippets(unittest.TestCase):
+    def setUp(self):
+        html = ("<html><body><h1>Welcome</h1><p>The department was founded in 1968. "
+                "Students learn machine learning and computer vision in small classes. "
+                "Computers are everywhere!</p></body></html>")
+        self.counts, positions, self.record = tokenize_chunk({"doc1": html}, PorterStemmer(), store_snippets=True)["doc1"]
+        self.assertIsNone(positions)
+
+    def test_best_sentence(self):
+        """Test that the sentence with the most distinct query terms is chosen"""
+        self.assertEqual(self.counts['comput'], 2)
+        self.assertEqual(make_snippet(self.record, ['comput', 'vision']),
+                         "Students learn machine learning and computer vision in small classes.")
+        self.assertEqual(make_snippet(self.record, ['comput']), "Students learn machine learning and computer vision in small classes.")
+        self.assertEqual(make_snippet(self.record, ['found']), "Welcome The department was founded in 1968.")
+
+    def test_long_sentence_is_shortened_around_the_match(self):
+        """Test that long sentences are cut at word boundaries around the first match"""
+        snippet = make_snippet(self.record, ['vision'], max_length=30)
+        self.assertTrue(snippet.startswith('...') and snippet.endswith('...'))
+        self.assertIn('vision', snippet)
+        self.assertLessEqual(len(snippet), 36)
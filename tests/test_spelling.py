@@ -0,0 +1,32 @@
+import os
+import pickle
+import tempfile
+import unittest
+from array import array
+from InvertedIndex.spelling import build_spelling_index
+from Search.query import SpellingCorrector
+from Search.query.spelling import edit_distance
+
+
+class TestSpelling(unittest.TestCase):
+    def test_edit_distance(self):
+        """Test the bounded edit distance, counting a transposition as one edit"""
+        self.assertEqual(edit_distance("scienc", "scienc", 2), 0)
+        self.assertEqual(edit_distance("sceinc", "scienc", 2), 1)
+        self.assertEqual(edit_distance("comptr", "comput", 2), 2)
+        self.assertEqual(edit_distance("vision", "network", 2), 3)
+        self.assertEqual(edit_distance("ab", "abcdef", 2), 3)
+
+    def test_correct_terms(self):
+        """Test that only missing terms are corrected, to the most frequent of the closest terms"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            with open(os.path.join(index_dir, 'lexicon.pkl'), 'wb') as f:
+                pickle.dump({'terms': ['comput', 'commut', 'machin', 'scienc'],
+                             'document_frequencies': array('I', [50, 2, 30, 40])}, f)
+            self.assertEqual(build_spelling_index(index_dir), 4)
+
+            spelling = SpellingCorrector.open(index_dir)
+            self.assertEqual(spelling.correct_terms(['comut', 'scienc', 'machien', 'learn*']),
+                             {'comut': 'comput', 'machien': 'machin'})
+            self.assertIsNone(spelling.correct('zzzzzz'))
+            self.assertEqual(spelling.stats()['lookups'], 3)
@@ -0,0 +1,43 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import unittest
+from Search.indexing import IndexReader
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        """Test that importing Search leaves out NLTK, the HTML parser and the summarizer client"""
+        repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script = ("import sys; import Search; "
+                  "print([name for name in ('nltk', 'bs4', 'lxml', 'google.genai') if name in sys.modules])")
+        output = subprocess.run([sys.executable, '-c', script], cwd=repository, capture_output=True,
+                                text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_deferred_loading(self):
+        """Test that the token positions are loaded on first use, or by a background preload"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            with open(os.path.join(index_dir, 'token_positions.pkl'), 'wb') as f:
+                pickle.dump({'anteat': 0}, f)
+            for name in ('urls.json', 'files.json'):
+                with open(os.path.join(index_dir, name), 'w') as f:
+                    json.dump({'0': 'a'}, f)
+
+            reader = IndexReader(index_dir=index_dir)
+            self.assertFalse(reader.loaded)
+            self.assertTrue(reader.has_term('anteat'))
+            self.assertTrue(reader.loaded)
+            self.assertIsNone(reader.position_offsets)
+
+            reader = IndexReader(index_dir=index_dir)
+            reader.preload_in_background().join()
+            self.assertTrue(reader.loaded)
+            self.assertEqual(reader.token_positions, {'anteat': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import pickle
+import tempfile
+import unittest
+from array import array
+from InvertedIndex.suggest import build_suggestions
+from Search.indexing import SuggestionReader
+
+
+class TestSuggest(unittest.TestCase):
+    def test_completions_ranked_by_queries_then_frequency(self):
+        """Test that logged queries come before terms, and terms are ordered by document frequency"""
+        with tempfile.TemporaryDirectory() as index_dir:
+            with open(os.path.join(index_dir, 'lexicon.pkl'), 'wb') as f:
+                pickle.dump({'terms': ['comput', 'compil', 'complex', 'scienc', 'typo'],
+                             'document_frequencies': array('I', [50, 20, 30, 40, 1])}, f)
+            query_log = os.path.join(index_dir, 'queries.txt')
+            with open(query_log, 'w') as f:
+                f.write("Computer Science\ncomputer  science\ncompilers\n")
+
+            self.assertEqual(build_suggestions(index_dir, query_log, k=3), 6)
+            suggestions = SuggestionReader.open(index_dir)
+            try:
+                self.assertEqual(suggestions.suggest("Comp"), ['computer science', 'compilers', 'comput'])
+                self.assertEqual(suggestions.suggest("comp", limit=1), ['computer science'])
+                self.assertEqual(suggestions.suggest("compl"), ['complex'])
+                self.assertEqual(suggestions.suggest("computer "), ['computer science'])
+                # Terms in too few documents are not suggested
+                self.assertEqual(suggestions.suggest("typ"), [])
+                self.assertEqual(suggestions.suggest(""), [])
+            finally:
+                suggestions.close()
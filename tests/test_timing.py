@@ -0,0 +1,35 @@
+import unittest
+from InvertedIndex.timing import StageTimer
+
+
+class TestStageTimer(unittest.TestCase):
+    def test_nested_stages(self):
+        """Test that every stage only gets its exclusive time, at any depth and for every clock"""
+        now = [0.0]
+        recorded = {}
+
+        def record(name, times):
+            recorded[name] = tuple(total + time for total, time in zip(recorded.get(name, (0.0, 0.0)), times))
+
+        # The second clock runs at half the speed of the first, like CPU time in a waiting process
+        timer = StageTimer(lambda: (now[0], now[0] / 2), record)
+        with timer.stage('merge'):
+            now[0] += 1
+            with timer.stage('partial_write'):
+                now[0] += 2
+                with timer.stage('dedup'):
+                    now[0] += 4
+            # Time measured elsewhere during the stage, such as by a worker process
+            now[0] += 8
+            timer.add_time('tokenize', (8.0, 4.0))
+        self.assertEqual(recorded, {'dedup': (4.0, 2.0), 'partial_write': (2.0, 1.0), 'tokenize': (8.0, 4.0),
+                                    'merge': (1.0, 0.5)})
+
+        # Time added outside of any stage is only recorded
+        timer.add_time('tokenize', (1.0, 1.0))
+        self.assertEqual(recorded['tokenize'], (9.0, 5.0))
+        self.assertEqual(timer.inner, [])
+
+
+if __name__ == '__main__':
+    unittest.main()